@@ -0,0 +1,166 @@
+"""
+Set-based bulk actions on tasks for the task changelist.
+
+Status, assignee, priority and due date are changed for all selected tasks
+with one UPDATE per action instead of a form save per task. The value comes
+from the fields TaskActionForm adds next to the action select. The queryset
+is the changelist's, so it already carries the role rules of
+``TaskAdmin.get_queryset`` (developers only reach their own tasks).
+
+Updates skip ``Task.save`` and its signals, so each action keeps up what the
+signals would have: ``status_rank`` (``TaskQuerySet.update``), ``updated_at``
+and, on reassignment, the tasks-by-project cache, which filters developers by
+assignee. None of these fields is in the full-text index or the timesheet
+rollups (the task and project of a task do not change here).
+"""
+from datetime import date, timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
+from django.dispatch import Signal
+from django.forms.utils import pretty_name
+
+from .caches import invalidate_project_tasks
+from .models import PRIORITY_CHOICES, Project, Task
+from .teams import grouped_team_choices
+
+# Largest due date shift of one action, in days (either way)
+MAX_SHIFT_DAYS = 365
+
+BLANK_CHOICE = [('', '---------')]
+
+# Sent (sender=Task) after an action updated tasks, with the action's ``queryset`` and the
+# changed ``fields``: the updates send no post_save, receivers handle the rows as a set. Status
+# and assignee changes also send the ``assignees`` of the updated tasks by project (before and
+# after the update), read before the update takes the rows out of a filtered queryset.
+tasks_bulk_updated = Signal()
+
+
+def assignees_by_project(queryset):
+    """``{project id: {assigned_to id, ...}}`` of the tasks of ``queryset``."""
+    assignees = {}
+    for project_id, user_id in queryset.order_by().values_list('project_id', 'assigned_to_id').distinct():
+        assignees.setdefault(project_id, set()).add(user_id)
+    return assignees
+
+
+def _assignee_choices():
+    # The cached team select choices, evaluated when the changelist renders the form
+    return BLANK_CHOICE + grouped_team_choices()
+
+
+class TaskActionForm(ActionForm):
+    """The admin action form with the values the bulk task actions apply."""
+    status = forms.ChoiceField(choices=BLANK_CHOICE + Task.STATUS_CHOICES, required=False)
+    assigned_to = forms.TypedChoiceField(
+        label='Assign to', choices=_assignee_choices, coerce=int, empty_value=None, required=False,
+    )
+    priority = forms.ChoiceField(choices=BLANK_CHOICE + PRIORITY_CHOICES, required=False)
+    shift_days = forms.IntegerField(
+        label='Shift due date by (days)', min_value=-MAX_SHIFT_DAYS, max_value=MAX_SHIFT_DAYS, required=False,
+    )
+
+
+def action_value(modeladmin, request, name):
+    """Value of an action form field, None (with an error message) when it was left blank."""
+    # The changelist only runs an action once the whole action form is valid
+    form = modeladmin.action_form(request.POST)
+    form.fields['action'].choices = modeladmin.get_action_choices(request)
+    form.is_valid()
+    value = form.cleaned_data.get(name)
+    if value in (None, ''):
+        label = form.fields[name].label or pretty_name(name)
+        modeladmin.message_user(request, f'Choose a value for "{label}" next to the action.', messages.ERROR)
+        return None
+    return value
+
+
+def report(modeladmin, request, updated, change, skipped=0, reason=''):
+    modeladmin.message_user(request, f'{updated} task{"s" if updated != 1 else ""} {change}.', messages.SUCCESS)
+    if skipped:
+        modeladmin.message_user(
+            request, f'{skipped} task{"s" if skipped != 1 else ""} skipped: {reason}.', messages.WARNING,
+        )
+
+
+@admin.action(description='Set the status of selected tasks', permissions=['change'])
+def set_status(modeladmin, request, queryset):
+    status = action_value(modeladmin, request, 'status')
+    if status is None:
+        return
+    changed = queryset.exclude(status=status)
+    with transaction.atomic():
+        assignees = assignees_by_project(changed)
+        # status_rank follows in the same UPDATE
+        updated = changed.update(status=status, updated_at=date.today())
+        if updated:
+            tasks_bulk_updated.send(sender=Task, queryset=queryset, fields={'status'}, assignees=assignees)
+    report(modeladmin, request, updated, f'set to {status}')
+
+
+@admin.action(description='Set the priority of selected tasks', permissions=['change'])
+def set_priority(modeladmin, request, queryset):
+    priority = action_value(modeladmin, request, 'priority')
+    if priority is None:
+        return
+    updated = queryset.exclude(priority=priority).update(priority=priority, updated_at=date.today())
+    if updated:
+        tasks_bulk_updated.send(sender=Task, queryset=queryset, fields={'priority'})
+    report(modeladmin, request, updated, f'set to {priority} priority')
+
+
+@admin.action(description='Assign selected tasks', permissions=['change'])
+def reassign(modeladmin, request, queryset):
+    user_id = action_value(modeladmin, request, 'assigned_to')
+    if user_id is None:
+        return
+
+    # Like the change form, only a member of the task's project team can be assigned
+    on_team = Exists(Project.team.through.objects.filter(project_id=OuterRef('project_id'), user_id=user_id))
+    with transaction.atomic():
+        per_project = list(
+            queryset.order_by().values('project_id')
+            .annotate(selected=Count('pk'), eligible=Count('pk', filter=Q(on_team)))
+        )
+        changed = queryset.filter(on_team).exclude(assigned_to_id=user_id)
+        # The previous assignees, and the new one
+        assignees = {project_id: user_ids | {user_id} for project_id, user_ids in assignees_by_project(changed).items()}
+        updated = changed.update(assigned_to_id=user_id, updated_at=date.today())
+        if updated:
+            invalidate_project_tasks(*(row['project_id'] for row in per_project if row['eligible']))
+            tasks_bulk_updated.send(sender=Task, queryset=queryset, fields={'assigned_to'}, assignees=assignees)
+
+    skipped = sum(row['selected'] - row['eligible'] for row in per_project)
+    report(modeladmin, request, updated, 'assigned', skipped, "the user is not in the project's team")
+
+
+@admin.action(description='Shift the due date of selected tasks', permissions=['change'])
+def shift_due_dates(modeladmin, request, queryset):
+    days = action_value(modeladmin, request, 'shift_days')
+    if days is None:
+        return
+    if days == 0:
+        report(modeladmin, request, 0, 'moved')
+        return
+
+    # task_date_errors in SQL: the shifted due date stays within start date and project end date
+    shift = timedelta(days=days)
+    fits = Q(due_date__gte=F('start_date') - shift) & (
+        Q(project__end_date__isnull=True) | Q(due_date__lte=F('project__end_date') - shift)
+    )
+    with transaction.atomic():
+        counts = queryset.order_by().aggregate(
+            dated=Count('pk', filter=Q(due_date__isnull=False)), fitting=Count('pk', filter=fits),
+        )
+        updated = queryset.filter(fits).update(due_date=F('due_date') + shift, updated_at=date.today())
+        if updated:
+            tasks_bulk_updated.send(sender=Task, queryset=queryset, fields={'due_date'})
+
+    report(
+        modeladmin, request, updated, f'moved by {days} day{"s" if abs(days) != 1 else ""}',
+        counts['dated'] - counts['fitting'],
+        "the due date would fall before the task's start date or after the project's end date",
+    )
@@ -1,24 +1,93 @@
 from django.contrib import admin
-from .models import Task, Project, Comment, File, TimeSheet
+from .models import Task, Project, Comment, File, TimeSheet, task_date_errors
 from django import forms
-from django.db.models import Q
-from django.urls import path
+from django.db.models import Q, Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.urls import path, reverse
 from django.http import JsonResponse
+from django.conf import settings
+from django.contrib.admin.widgets import AutocompleteSelectMultiple
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.utils.cache import patch_cache_control
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
 from datetime import date
-
-
-
-
-
-class MasterAdmin(admin.ModelAdmin):
+from functools import wraps
+import hashlib
+from .actions import TaskActionForm, reassign, set_priority, set_status, shift_due_dates
+from .changelists import ListOnlyMixin
+from .conditional import acondition
+from .exports import export_as_csv, export_as_jsonl
+from .imports import ImportAdminMixin, TaskImporter, TimeSheetImporter
+from .live import live_events_backend
+from .pagination import KeysetPaginationMixin
+from .previews import read_preview, with_preview_status
+from .replicas import ReplicaReadsMixin
+from .roles import is_project_lead, is_tester, sees_all_project_tasks
+from .search import COMMENT_INDEX, TASK_INDEX, FullTextSearchMixin
+from .storage import digest_of
+from .teams import (
+    aget_team_rosters, ateam_roster_versions, get_team_rosters, grouped_team_choices, search_team_members,
+    team_roster_versions,
+)
+
+
+
+
+
+def rollup_hours(obj):
+    """Hours of the object's timesheet rollup row (0 when nothing was logged)."""
+    try:
+        return obj.hours_rollup.hours
+    except ObjectDoesNotExist:
+        return 0
+
+
+# Characters of a text preview shown in the File changelist and task inline
+PREVIEW_CHARS = 300
+
+
+@admin.display(description='Preview')
+def file_preview(obj):
+    """Thumbnail or start of the text preview of an attachment, from the annotations of with_preview_status."""
+    if not obj.pk:
+        return '-'
+    status = getattr(obj, 'preview_status', None)
+    if getattr(obj, 'preview_thumbnail', False):
+        return format_html(
+            '<a href="{}"><img src="{}" alt="" loading="lazy" style="max-width:128px;max-height:128px"></a>',
+            reverse('download_file', args=[obj.pk]) + '?inline=1',
+            reverse('file_thumbnail', args=[obj.pk]),
+        )
+    if getattr(obj, 'preview_text', False):
+        text = read_preview(digest_of(obj.file.name), PREVIEW_CHARS + 1) or ''
+        if len(text) > PREVIEW_CHARS:
+            text = text[:PREVIEW_CHARS] + '…'
+        return format_html('<pre style="max-width:40em;white-space:pre-wrap">{}</pre>', text)
+    if status in ('pending', 'running'):
+        return 'Generating…'
+    return '-'
+
+
+class MasterAdmin(ReplicaReadsMixin, admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         # Set the created_user only for new instances
         if not obj.pk:
             obj.created_user = request.user
         super().save_model(request, obj, form, change)
 
-from django.contrib.auth.models import Group, User
+from django.contrib.auth.models import User
+
+
+class TeamAutocompleteSelectMultiple(AutocompleteSelectMultiple):
+    """Select2 widget for the project team, backed by ProjectAdmin's team search endpoint."""
+
+    def get_url(self):
+        return reverse('%s:project_project_team_search' % self.admin_site.name)
+
 
 class ProjectForm(forms.ModelForm):
     class Meta:
@@ -49,31 +118,31 @@ class ProjectForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Group users by their roles
-        grouped_users = []
-        groups = Group.objects.exclude(name='Project Manager')
+        # The field is missing when it is read-only for the user (Project Lead)
+        if 'team' not in self.fields:
+            return
 
-        for group in groups:
-            # Get users in this group
-            users_in_group = User.objects.filter(groups=group).order_by('username')
-            if users_in_group.exists():
-                # Add group and its users as a tuple
-                grouped_users.append((group.name, [(user.id, user.username) for user in users_in_group]))
+        if getattr(settings, 'PROJECT_TEAM_AUTOCOMPLETE', False):
+            # Large organisations: only render the selected members and search the rest on demand
+            self.fields['team'].widget = TeamAutocompleteSelectMultiple(Project._meta.get_field('team'), admin.site)
+            self.fields['team'].queryset = User.objects.all()
+            return
 
-        # Set the grouped choices for the `team` field
+        # Set the grouped choices (users grouped by their roles) for the `team` field
         self.fields['team'].queryset = User.objects.all()
         self.fields['team'].widget = forms.SelectMultiple()
-        self.fields['team'].choices = grouped_users
-        
+        self.fields['team'].choices = grouped_team_choices()
+
 
-from django.urls import reverse
 from django.utils.html import format_html
 
 
 
-class ProjectAdmin(MasterAdmin):
+class ProjectAdmin(ListOnlyMixin, MasterAdmin):
     
-    list_display = ('name', 'status', 'start_date', 'end_date', 'priority', 'task_count', 'view_tasks_link', 'add_task_link')
+    list_display = ('name', 'status', 'start_date', 'end_date', 'priority', 'task_count', 'logged_hours', 'view_tasks_link', 'add_task_link')
+    list_select_related = ('hours_rollup',)
+    list_only = ('name', 'status', 'start_date', 'end_date', 'priority', 'hours_rollup__hours')
 
     def add_task_link(self, obj):
         """Generates a link to add a task and passes the project ID."""
@@ -91,43 +160,72 @@ class ProjectAdmin(MasterAdmin):
     view_tasks_link.short_description = 'Tasks'
 
     def task_count(self, obj):
-        """Show the task count based on user role."""
-        user = self.request.user
+        """Show the task count based on user role (annotated in get_queryset)."""
+        return obj.task_count_value
 
-        # If superuser, show total task count
-        if user.is_superuser:
-            return obj.task_set.count()
-
-        # For Team Managers and Team Leads
-        if user.groups.filter(name__in=["Project Manager", "Project Lead"]).exists():
-            return obj.task_set.count()
-        
+    task_count.short_description = 'Task Count'
+    task_count.admin_order_field = 'task_count_value'
 
-        # For Developers, show only tasks assigned to them
-        return obj.task_set.filter(assigned_to=user).count()
+    def logged_hours(self, obj):
+        """Hours logged on the project, read from the timesheet rollup."""
+        return rollup_hours(obj)
 
-    task_count.short_description = 'Task Count'
+    logged_hours.short_description = 'Logged Hours'
+    logged_hours.admin_order_field = 'hours_rollup__hours'
 
     # Include filter_horizontal and form configurations
     form = ProjectForm
+    search_fields = ('name',)
     readonly_fields = ('created_user',)
     filter_horizontal = ('team',)
 
     def get_queryset(self, request):
-        self.request = request  # Save request to use in `task_count`
-        queryset = super().get_queryset(request)
+        # Projects where the logged-in user is part of the team or the creator
+        queryset = super().get_queryset(request).visible_to(request.user)
 
-        # Filter projects where the logged-in user is part of the team or the creator
-        if not request.user.is_superuser:
-            queryset = queryset.filter(Q(team=request.user) | Q(created_user=request.user)).distinct()
+        return queryset.annotate(task_count_value=self.task_count_subquery(request))
 
-        return queryset
+    def task_count_subquery(self, request):
+        """
+        Count tasks per project in a single correlated subquery, so the
+        changelist does not run a count query for every row.
+        """
+        tasks = Task.objects.filter(project=OuterRef('pk'))
+
+        # Superusers, Project Managers and Project Leads see the total task count,
+        # Developers only the tasks assigned to them
+        if not sees_all_project_tasks(request):
+            tasks = tasks.filter(assigned_to=request.user)
+
+        counts = tasks.order_by().values('project').annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('team-search/', self.admin_site.admin_view(self.team_search), name='project_project_team_search'),
+        ]
+        return custom_urls + urls
+
+    def team_search(self, request):
+        """Paginated team member search used by the autocomplete team widget."""
+        if not (self.has_add_permission(request) or self.has_change_permission(request)):
+            raise PermissionDenied
+
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+
+        page_size = 20
+        results, more = search_team_members(request.GET.get('term', '').strip(), (page - 1) * page_size, page_size)
+        return JsonResponse({'results': results, 'pagination': {'more': more}})
 
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = super().get_readonly_fields(request, obj)
 
         # If the user is a Project Lead, make specific fields read-only except for 'status'
-        if request.user.groups.filter(name="Project Lead").exists():
+        if is_project_lead(request):
             readonly_fields += ('is_active', 'name', 'description', 'start_date', 'end_date', 'priority', 'team')
 
         return readonly_fields
@@ -135,10 +233,13 @@ class ProjectAdmin(MasterAdmin):
 
 #-----------------------Task Section----------------------------------
 class FileInline(admin.TabularInline):
-    readonly_fields = ('created_user',)
+    readonly_fields = ('created_user', file_preview)
     model = File
     extra = 1
 
+    def get_queryset(self, request):
+        return with_preview_status(super().get_queryset(request))
+
 
 class TaskAdminForm(forms.ModelForm):
     class Meta:
@@ -157,35 +258,88 @@ class TaskAdminForm(forms.ModelForm):
         }
     
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if 'assigned_to' in self.fields and 'project' in self.fields:
+            # Only the team of the selected project can be assigned (the change form reloads
+            # the choices from the cached team roster when the project changes)
+            project_id = self.data.get(self.add_prefix('project')) if self.is_bound else None
+            project_id = project_id or self.get_initial_for_field(self.fields['project'], 'project')
+            try:
+                project_id = int(getattr(project_id, 'pk', project_id) or 0)
+            except (TypeError, ValueError):
+                project_id = 0
+
+            members = Q(pk__in=Project.team.through.objects.filter(project_id=project_id).values('user_id'))
+            if self.instance.assigned_to_id:
+                members |= Q(pk=self.instance.assigned_to_id)
+            self.fields['assigned_to'].queryset = User.objects.filter(members).order_by('username')
+
     def clean(self):
         cleaned_data = super().clean()
         start_date = cleaned_data.get('start_date')
         due_date = cleaned_data.get('due_date')
         project = cleaned_data.get('project')  # Fetch the selected project
 
-        if start_date and project.start_date and start_date < project.start_date:
-            raise forms.ValidationError(f"Task start date cannot be earlier than the project's start date ({project.start_date}).")
+        # Dates within the project's window, start_date not later than due_date
+        errors = task_date_errors(start_date, due_date, project)
+        if errors:
+            raise forms.ValidationError(errors[0])
 
-        if due_date and project.end_date and due_date > project.end_date:
-            raise forms.ValidationError(f"Task due date cannot be later than the project's end date ({project.end_date}).")
+        return cleaned_data
 
-        # Ensure start_date is not later than due_date
-        if start_date and due_date and start_date > due_date:
-            raise forms.ValidationError("Start date cannot be later than due date.")
 
-        return cleaned_data
+# Upper bound of projects per bulk fetch-team-members request
+TEAM_ROSTERS_MAX_PROJECTS = 200
 
 
-from django.db.models import Case, When, Value, IntegerField
+def async_admin_view(admin_site, view):
+    """
+    AdminSite.admin_view for an async view: its wrapper is synchronous and
+    reads request.user, so the staff check is done here with request.auser().
+    """
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return redirect_to_login(request.get_full_path(), reverse('admin:login', current_app=admin_site.name))
+        return await view(request, *args, **kwargs)
+    return never_cache(inner)
 
-class TaskAdmin(MasterAdmin):
+
+class TaskAdmin(ListOnlyMixin, FullTextSearchMixin, ImportAdminMixin, KeysetPaginationMixin, MasterAdmin):
     change_form_template = "admin/project/task/change_form.html"
+    # Keyset changelist plus the live change notice
+    change_list_template = "admin/project/task/change_list.html"
     form = TaskAdminForm
     
     
     readonly_fields = ('created_user','due_date')
     inlines = [FileInline]
-    list_display = ('project', 'title', 'status', 'priority')
+    list_display = ('project', 'title', 'status', 'priority', 'logged_hours')
+    list_select_related = ('project', 'hours_rollup')
+    # status_rank: the keyset of the cursor pagination is read from the last row
+    list_only = ('title', 'status', 'priority', 'status_rank', 'project__name', 'hours_rollup__hours')
+    # Searched through the FTS5 index (title, description, steps, environment), search_fields without it
+    search_fields = ('title',)
+    search_index = TASK_INDEX
+    actions = [set_status, reassign, set_priority, shift_due_dates, export_as_csv, export_as_jsonl]
+    # Values of the bulk status / assignee / priority / due date actions
+    action_form = TaskActionForm
+    importer_class = TaskImporter
+    autocomplete_fields = ('project',)
+    # Custom status order (New, Reopened, Inprogress, Resolved, closed), served by the stored status_rank index.
+    # It is also the keyset of the cursor pagination.
+    ordering = ('status_rank', 'id')
+
+    def logged_hours(self, obj):
+        """Hours logged on the task, read from the timesheet rollup."""
+        return rollup_hours(obj)
+
+    logged_hours.short_description = 'Logged Hours'
+    logged_hours.admin_order_field = 'hours_rollup__hours'
+
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
 
@@ -216,59 +370,100 @@ class TaskAdmin(MasterAdmin):
         super().save_related(request, form, formsets, change)
     
 
+    def changelist_view(self, request, extra_context=None):
+        if live_events_backend():
+            extra_context = {**(extra_context or {}), 'live_events_url': reverse('live_events')}
+        return super().changelist_view(request, extra_context)
+
     def get_urls(self):
         urls = super().get_urls()
+        if getattr(settings, 'PROJECT_ASYNC_API', False):
+            fetch_team_members = async_admin_view(
+                self.admin_site, acondition(etag_func=self.ateam_members_etag)(self.afetch_team_members),
+            )
+        else:
+            fetch_team_members = self.admin_site.admin_view(
+                condition(etag_func=self.team_members_etag)(self.fetch_team_members),
+            )
         custom_urls = [
-            path('fetch-team-members/', self.fetch_team_members, name='fetch-team-members'),
+            path('fetch-team-members/', fetch_team_members, name='fetch-team-members'),
         ]
         return custom_urls + urls
 
+    def team_members_project_ids(self, request):
+        """Project IDs of a request: `project_id`, or a comma separated `project_ids` in bulk mode."""
+        raw = request.GET.get('project_ids') or request.GET.get('project_id') or ''
+        try:
+            project_ids = list(dict.fromkeys(int(value) for value in raw.split(',') if value.strip()))
+        except ValueError:
+            return []
+        return project_ids[:TEAM_ROSTERS_MAX_PROJECTS]
+
+    def team_members_etag_value(self, request, project_ids, versions):
+        key = '|'.join(f'{project_id}:{versions[project_id]!r}' for project_id in project_ids)
+        return hashlib.md5(f"{'bulk' if 'project_ids' in request.GET else 'single'}|{key}".encode()).hexdigest()
+
+    def team_members_etag(self, request):
+        project_ids = self.team_members_project_ids(request)
+        if not project_ids:
+            return None
+        return self.team_members_etag_value(request, project_ids, team_roster_versions(project_ids))
+
+    async def ateam_members_etag(self, request):
+        project_ids = self.team_members_project_ids(request)
+        if not project_ids:
+            return None
+        return self.team_members_etag_value(request, project_ids, await ateam_roster_versions(project_ids))
+
     def fetch_team_members(self, request):
-        project_id = request.GET.get('project_id')
-        if not project_id:
+        project_ids = self.team_members_project_ids(request)
+        if not project_ids:
             return JsonResponse({'error': 'No project ID provided'}, status=400)
+        return self.team_members_response(request, project_ids, get_team_rosters(project_ids))
 
-        try:
-            project = Project.objects.get(id=project_id)
-            team_members = project.team.all().values('id', 'username')
-            return JsonResponse({'team_members': list(team_members)})
-        except Project.DoesNotExist:
+    async def afetch_team_members(self, request):
+        """fetch_team_members with the async cache and ORM, routed when PROJECT_ASYNC_API is on."""
+        project_ids = self.team_members_project_ids(request)
+        if not project_ids:
+            return JsonResponse({'error': 'No project ID provided'}, status=400)
+        return self.team_members_response(request, project_ids, await aget_team_rosters(project_ids))
+
+    def team_members_response(self, request, project_ids, rosters):
+        if 'project_ids' in request.GET:
+            # Bulk mode, unknown projects are left out
+            response = JsonResponse({'team_members': {str(project_id): members for project_id, members in rosters.items()}})
+        elif project_ids[0] in rosters:
+            response = JsonResponse({'team_members': rosters[project_ids[0]]})
+        else:
             return JsonResponse({'error': 'Project not found'}, status=404)
+
+        # Browsers keep the rosters and revalidate them with the ETag (304 until the team changes)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
 
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-
-        # Define a custom order for the status field
-        status_order = {
-            'New': 1,
-            'Reopened': 2,
-            'Inprogress': 3,
-            'Resolved': 4,
-            'Closed': 5,
-        }
-
-        # If user is not superuser, filter tasks
-        if not request.user.is_superuser:
-            # If user is a developer, show only their assigned tasks
-            if request.user.groups.filter(name="developer").exists():
-                queryset = queryset.filter(assigned_to=request.user)
-            else:
-                # For other roles (Project Lead, etc.), show tasks where they're in the project team
-                queryset = queryset.filter(
-                    Q(project__team=request.user) | Q(created_user=request.user)
-                ).distinct()
-
-        # Add a custom ordering based on status
-        queryset = queryset.annotate(
-            status_order=Case(
-                *[When(status=status, then=Value(order)) for status, order in status_order.items()],
-                default=Value(999),
-                output_field=IntegerField()
-            )
-        ).order_by('status_order')
-
-        return queryset
+        # Developers see their assigned tasks, other roles the tasks of their projects
+        return super().get_queryset(request).visible_to(request.user)
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+
+        # Task autocomplete of another form: apply that form's choice rules
+        source = (request.GET.get('model_name'), request.GET.get('field_name'))
+        if source == ('comment', 'task') and is_tester(request):
+            queryset = queryset.filter(status='Resolved', project__team=request.user)
+        elif source == ('timesheet', 'task') and request.GET.get('project'):
+            try:
+                project_id = int(request.GET['project'])
+            except ValueError:
+                return queryset.none(), may_have_duplicates
+            # The tasks of a project are only listed to those who see the project
+            if not Project.objects.visible_to(request.user).filter(pk=project_id).exists():
+                raise PermissionDenied
+            queryset = queryset.filter(project_id=project_id)
+
+        return queryset, may_have_duplicates
     
     # def get_readonly_fields(self, request, obj=None):
     #     readonly_fields = super().get_readonly_fields(request, obj)
@@ -297,10 +492,17 @@ class TaskAdmin(MasterAdmin):
 
 #----------------------Comment Section--------------------------    
 
-class CommentAdmin(MasterAdmin):
+class CommentAdmin(ListOnlyMixin, FullTextSearchMixin, MasterAdmin):
     readonly_fields = ('created_user',)
     list_display = ('task','created_user')
+    list_select_related = ('task', 'created_user')
+    # title: str(comment) labels the row checkbox
+    list_only = ('title', 'task__title', 'created_user__username')
     fields = ('title','task','content','is_active')
+    search_fields = ('title', 'content')
+    search_index = COMMENT_INDEX
+    autocomplete_fields = ('task',)
+    actions = [export_as_csv, export_as_jsonl]
 
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
@@ -309,13 +511,10 @@ class CommentAdmin(MasterAdmin):
             queryset = queryset.filter(Q(task__assigned_to=request.user) | Q(created_user=request.user))
 
         # Check if the user is a Team Lead and filter tasks with comments visible for them
-        if request.user.groups.filter(name="Project Lead").exists():
+        if is_project_lead(request):
             # Get tasks where the user is in the project's team
             queryset = queryset.filter(task__project__team=request.user)
 
-            # Prefetch related comments for these tasks
-            queryset = queryset.prefetch_related('task__comment')
-
         return queryset
     
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -323,7 +522,7 @@ class CommentAdmin(MasterAdmin):
         Filter the 'project' and 'assigned_to' fields based on the Team Lead's team.
         """
         if db_field.name == "task":
-            if request.user.groups.filter(name="Testers").exists():
+            if is_tester(request):
                 # Show only projects where the Team Lead is a part of the team
                 kwargs['queryset'] = Task.objects.filter(status='Resolved', project__team=request.user)
 
@@ -332,13 +531,15 @@ class CommentAdmin(MasterAdmin):
     
 #-------------------------File Section-------------------------------
 
-class FileAdmin(MasterAdmin):
-    readonly_fields = ('created_user',)
-    list_display = ('task','name', 'file')
-    fields = ('task', 'name', 'file')
+class FileAdmin(ListOnlyMixin, MasterAdmin):
+    readonly_fields = ('created_user', file_preview)
+    list_display = ('task','name', 'file', file_preview)
+    list_select_related = ('task',)
+    list_only = ('name', 'file', 'task__title')
+    fields = ('task', 'name', 'file', file_preview)
 
     def get_queryset(self, request):
-        queryset = super().get_queryset(request)
+        queryset = with_preview_status(super().get_queryset(request))
         # Filter projects where the logged-in user is in the team
         if not request.user.is_superuser:  # Allow superusers to see all projects
             queryset = queryset.filter(Q(task__assigned_to=request.user) | Q(created_user=request.user))
@@ -350,9 +551,21 @@ class FileAdmin(MasterAdmin):
         super().save_model(request, obj, form, change)
 
 
-class TimeSheetAdmin(MasterAdmin):
+class TimeSheetAdmin(ListOnlyMixin, ImportAdminMixin, KeysetPaginationMixin, MasterAdmin):
     exclude = ('created_user',)
     list_display = ('task','project','created_user','date')
+    list_select_related = ('task', 'project', 'created_user')
+    list_only = ('date', 'task__title', 'project__name', 'created_user__username')
+    # Newest entries first, also the keyset of the cursor pagination
+    ordering = ('-date', '-id')
+    autocomplete_fields = ('project', 'task')
+    actions = [export_as_csv, export_as_jsonl]
+    importer_class = TimeSheetImporter
+
+    class Media:
+        # Limits the task autocomplete to the selected project
+        js = ('admin/js/timesheet_dynamic_task.js',)
+
 #Register models to admin panel
 
 admin.site.register(Task,TaskAdmin)
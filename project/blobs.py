@@ -0,0 +1,112 @@
+"""
+Reference counting of the content-addressed attachment blobs.
+
+Every File whose stored name is content-addressed holds one reference to the
+Blob of its digest. Signals add a reference when a File is saved with a new
+file and release one when the file is replaced or the File is deleted
+(including the cascade from its Task). The blob file is removed once the
+transaction that released its last reference commits, unless an upload of
+the same content referenced it again meanwhile. Files from before the
+content-addressed storage are deleted from disk when no File uses them.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Blob, File
+from .previews import enqueue_preview
+from .storage import BLOB_DIR, CAS_PREFIX, digest_of
+
+
+def _storage():
+    return File._meta.get_field('file').storage
+
+
+def add_reference(name):
+    digest = digest_of(name)
+    if digest is None:
+        return
+    if Blob.objects.filter(pk=digest).update(refs=F('refs') + 1):
+        return
+    try:
+        with transaction.atomic():
+            blob = Blob.objects.create(digest=digest, size=_storage().size(name), refs=1)
+    except IntegrityError:
+        # Created concurrently
+        Blob.objects.filter(pk=digest).update(refs=F('refs') + 1)
+    else:
+        enqueue_preview(blob, os.path.basename(name))
+
+
+def release_reference(name):
+    if not name:
+        return
+    storage = _storage()
+    digest = digest_of(name)
+    if digest is None:
+        # A file from before the content-addressed storage, only this File may have used it
+        if not File.objects.filter(file=name).exists():
+            transaction.on_commit(lambda: storage.delete(name))
+        return
+
+    Blob.objects.filter(pk=digest).update(refs=F('refs') - 1)
+    if Blob.objects.filter(pk=digest, refs__lte=0).delete()[0]:
+        released_at = time.time()
+        transaction.on_commit(lambda: _delete_unused_blob(storage, digest, released_at))
+
+
+def _delete_unused_blob(storage, digest, released_at):
+    """Delete a blob whose last reference was released, unless an upload of the same content took it since."""
+    with transaction.atomic():
+        # Locks out a concurrent add_reference (SQLite transactions take the write lock up front)
+        if Blob.objects.select_for_update().filter(pk=digest).exists():
+            return
+        # Touched by an upload whose File is not committed yet (a second of margin for coarse
+        # mtimes): collect_garbage removes it later if it stays unused
+        path = storage.path(storage.blob_name(digest))
+        if os.path.exists(path) and os.path.getmtime(path) > released_at - 1:
+            return
+        storage.delete_blob(digest)
+
+
+def rebuild_references():
+    """Recount the references of every blob from the File table, returns the number of blobs in use."""
+    storage = _storage()
+    refs = {}
+    for name in File.objects.filter(file__startswith=CAS_PREFIX).values_list('file', flat=True).iterator():
+        refs[digest_of(name)] = refs.get(digest_of(name), 0) + 1
+
+    with transaction.atomic():
+        Blob.objects.exclude(pk__in=refs).delete()
+        existing = set(Blob.objects.values_list('pk', flat=True))
+        for digest in existing:
+            Blob.objects.filter(pk=digest).update(refs=refs[digest])
+        Blob.objects.bulk_create(
+            Blob(digest=digest, size=os.path.getsize(storage.path(storage.blob_name(digest))), refs=count)
+            for digest, count in refs.items()
+            if digest not in existing and os.path.exists(storage.path(storage.blob_name(digest)))
+        )
+    return len(refs)
+
+
+def collect_garbage(min_age=timedelta(hours=1)):
+    """
+    Delete the blob files without a Blob row (e.g. left by a File save that
+    failed) and abandoned temporary files, returns how many. Files younger than
+    ``min_age`` are kept, they may belong to a File being saved.
+    """
+    storage = _storage()
+    in_use = set(Blob.objects.values_list('pk', flat=True))
+    cutoff = time.time() - min_age.total_seconds()
+    removed = 0
+    for directory, _, filenames in os.walk(storage.path(BLOB_DIR)):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            # Derivatives are named <digest>.<kind>, they go with their blob
+            if filename.split('.')[0] not in in_use and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+    return removed
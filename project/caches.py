@@ -0,0 +1,120 @@
+"""
+Versioned cache entries.
+
+Cached data is stored under a key that embeds a version stamp. Invalidating
+only replaces the stamp, so stale entries are never read again and simply
+expire. The stamp is a timestamp, which doubles as the Last-Modified time of
+the data for conditional GETs.
+
+Invalidations replace the stamp when the transaction of the change commits:
+a reader in between would otherwise cache the old rows under the new stamp.
+Stamps are kept for ``PROJECT_CACHE_VERSION_TIMEOUT`` seconds. A bump only
+reaches the processes sharing the cache, so with a per-process cache (the
+local-memory default) other workers serve their entries until their stamp
+expires and a new one is taken.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Project, Task
+from .replicas import primary_reads
+
+
+def version_timeout():
+    return getattr(settings, 'PROJECT_CACHE_VERSION_TIMEOUT', 60)
+
+
+def get_version(name):
+    """Return the current version stamp of ``name``, creating one if needed."""
+    return cache.get_or_set(f'project:version:{name}', time.time, version_timeout())
+
+
+def get_versions(names):
+    """Return ``{name: version stamp}`` for several names with one cache round trip."""
+    keys = {f'project:version:{name}': name for name in names}
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, version_timeout())
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+async def aget_version(name):
+    return await cache.aget_or_set(f'project:version:{name}', time.time, version_timeout())
+
+
+async def aget_versions(names):
+    keys = {f'project:version:{name}': name for name in names}
+    versions = await cache.aget_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, version_timeout())
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_version(*names):
+    now = time.time()
+    cache.set_many({f'project:version:{name}': now for name in names}, version_timeout())
+
+
+def bump_version_on_commit(*names):
+    """bump_version once the current transaction commits (at once outside a transaction)."""
+    transaction.on_commit(lambda: bump_version(*names))
+
+
+#-----------------------Tasks by project------------------------------
+
+def project_tasks_version(project_id):
+    return get_version(f'project-tasks:{project_id}')
+
+
+async def aproject_tasks_version(project_id):
+    return await aget_version(f'project-tasks:{project_id}')
+
+
+def invalidate_project_tasks(*project_ids):
+    bump_version_on_commit(*(f'project-tasks:{project_id}' for project_id in project_ids if project_id))
+
+
+def project_task_rows(project_id):
+    """Query of the cached task rows of a project, the role rules are applied to the rows."""
+    return (
+        Task.objects.filter(project_id=project_id, is_active=True)
+        .order_by('title', 'id')
+        .values_list('id', 'title', 'assigned_to_id', 'created_user_id')
+    )
+
+
+def get_project_task_rows(project_id):
+    """
+    Return ``(id, title, assigned_to_id, created_user_id)`` of the active tasks
+    of a project ordered by title, or None when the project does not exist.
+    """
+    key = f'project:project-tasks:{project_id}:{project_tasks_version(project_id)}'
+    rows = cache.get(key)
+    if rows is None:
+        # Cached under the current version, so read from the primary (see project.replicas)
+        with primary_reads():
+            if not Project.objects.filter(pk=project_id).exists():
+                return None
+            rows = list(project_task_rows(project_id))
+        cache.set(key, rows, getattr(settings, 'PROJECT_TASKS_CACHE_TIMEOUT', 3600))
+    return rows
+
+
+async def aget_project_task_rows(project_id):
+    """get_project_task_rows for async views (async cache and ORM)."""
+    key = f'project:project-tasks:{project_id}:{await aproject_tasks_version(project_id)}'
+    rows = await cache.aget(key)
+    if rows is None:
+        with primary_reads():
+            if not await Project.objects.filter(pk=project_id).aexists():
+                return None
+            rows = [row async for row in project_task_rows(project_id)]
+        await cache.aset(key, rows, getattr(settings, 'PROJECT_TASKS_CACHE_TIMEOUT', 3600))
+    return rows
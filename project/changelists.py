@@ -0,0 +1,37 @@
+"""
+Changelist querysets that load only what the list shows.
+
+Related objects in ``list_display`` come from ``list_select_related`` joins,
+and ``list_only`` restricts the changelist query to the columns the list
+needs (``QuerySet.only()``, related columns as ``fk__field``), so the large
+text fields are never read for a list. It must include what the model's
+``__str__`` reads, the admin labels every row checkbox with it. The change
+views still load full objects. A field missing from ``list_only`` is fetched
+once per row; the changelist query-count tests catch it.
+"""
+import functools
+
+
+@functools.cache
+def only_changelist(changelist_class):
+    """Subclass of a ChangeList applying the admin's ``list_only`` to its queryset."""
+
+    class OnlyChangeList(changelist_class):
+        def get_queryset(self, request, exclude_parameters=None):
+            queryset = super().get_queryset(request, exclude_parameters)
+            fields = self.model_admin.get_list_only(request)
+            return queryset.only(*fields) if fields else queryset
+
+    OnlyChangeList.__name__ = f'Only{changelist_class.__name__}'
+    return OnlyChangeList
+
+
+class ListOnlyMixin:
+    """ModelAdmin mixin loading only the ``list_only`` fields in the changelist."""
+    list_only = None
+
+    def get_list_only(self, request):
+        return self.list_only
+
+    def get_changelist(self, request, **kwargs):
+        return only_changelist(super().get_changelist(request, **kwargs))
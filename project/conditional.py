@@ -0,0 +1,35 @@
+"""
+Conditional GET for async views.
+
+``acondition`` is django.views.decorators.http.condition for async views
+whose ETag and Last-Modified functions are coroutines: condition() calls
+them synchronously, where the cache and ORM lookups would block the event
+loop. Shared by the async task list view and the async admin team lookup.
+"""
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def acondition(etag_func=None, last_modified_func=None):
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            last_modified = None
+            if last_modified_func and (dt := await last_modified_func(request, *args, **kwargs)):
+                last_modified = int(dt.timestamp())
+            etag = await etag_func(request, *args, **kwargs) if etag_func else None
+            etag = quote_etag(etag) if etag is not None else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,76 @@
+"""
+Thumbnail and text preview rendering for attachment blobs.
+
+Kept free of Django imports: the functions run in worker processes (see
+project.previews) that only get a blob path and write the derivatives next to
+it. Image thumbnails need Pillow and PDF previews pypdf; without them those
+types are skipped.
+"""
+import mimetypes
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_SUFFIX = '.thumb.png'
+PREVIEW_SUFFIX = '.preview.txt'
+# Text previews hold at most this many lines / bytes of the start of the file
+PREVIEW_LINES = 40
+PREVIEW_BYTES = 16 * 1024
+
+TEXT_EXTENSIONS = {'.log', '.txt', '.md', '.csv', '.json', '.jsonl', '.xml', '.yaml', '.yml', '.ini', '.cfg', '.conf', '.sql', '.py', '.js', '.html', '.css', '.har'}
+
+
+def _write_atomic(path, write):
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as output:
+        write(output)
+    os.replace(tmp_path, path)
+
+
+def _text_preview(text):
+    lines = text[:PREVIEW_BYTES].splitlines()[:PREVIEW_LINES]
+    return '\n'.join(lines).encode('utf-8')
+
+
+def render_derivatives(blob_path, filename):
+    """
+    Write the thumbnail and/or text preview of the blob at ``blob_path`` (the
+    type is guessed from ``filename``), returns ``(thumbnail, preview)`` flags
+    of what was written.
+    """
+    content_type = mimetypes.guess_type(filename)[0] or ''
+    extension = os.path.splitext(filename)[1].lower()
+    thumbnail = preview = False
+
+    if content_type.startswith('image/') and Image is not None and content_type != 'image/svg+xml':
+        with Image.open(blob_path) as image:
+            # draft() lets JPEG decode at a reduced scale instead of full size
+            image.draft('RGB', THUMBNAIL_SIZE)
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA')
+            _write_atomic(blob_path + THUMBNAIL_SUFFIX, lambda output: image.save(output, 'PNG'))
+        thumbnail = True
+
+    elif content_type.startswith('text/') or extension in TEXT_EXTENSIONS:
+        with open(blob_path, 'rb') as source:
+            text = source.read(PREVIEW_BYTES).decode('utf-8', errors='replace')
+        _write_atomic(blob_path + PREVIEW_SUFFIX, lambda output: output.write(_text_preview(text)))
+        preview = True
+
+    elif content_type == 'application/pdf' and pypdf is not None:
+        reader = pypdf.PdfReader(blob_path)
+        text = reader.pages[0].extract_text() if reader.pages else ''
+        _write_atomic(blob_path + PREVIEW_SUFFIX, lambda output: output.write(_text_preview(text)))
+        preview = True
+
+    return thumbnail, preview
@@ -0,0 +1,120 @@
+"""
+Streamed downloads of stored files, with HTTP Range support.
+
+The response body is read from storage in blocks while it is sent, and a
+single ``Range: bytes=...`` request is answered with 206 and just that part,
+so players and download managers can seek and resume. With
+``PROJECT_FILE_SENDFILE`` set the file is not read by Django at all: the
+response only names it in an ``X-Accel-Redirect`` (nginx) or ``X-Sendfile``
+(Apache, lighttpd) header and the front proxy sends it, ranges included.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` (inclusive) of a single-range ``Range`` header, None to
+    send the whole file (no, multi-part or malformed header), or ``False``
+    when the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _read_range(fieldfile, start, length):
+    with fieldfile.open('rb') as source:
+        source.seek(start)
+        while length > 0:
+            block = source.read(min(STREAM_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def _last_modified(fieldfile):
+    try:
+        return fieldfile.storage.get_modified_time(fieldfile.name)
+    except (NotImplementedError, OSError):
+        return None
+
+
+def _sendfile_response(mode, fieldfile):
+    response = HttpResponse()
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'PROJECT_FILE_ACCEL_PREFIX', '/protected-media/')
+        # The location of the file under MEDIA_ROOT, which is not its name in content-addressed storage
+        location = os.path.relpath(fieldfile.path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(location)
+    else:
+        response['X-Sendfile'] = fieldfile.path
+    # Let the proxy set the type from the file
+    del response['Content-Type']
+    return response
+
+
+def file_response(request, fieldfile, filename=None, as_attachment=True):
+    """Response sending a stored file (``FieldFile``), whole, as a byte range or through the front proxy."""
+    filename = filename or os.path.basename(fieldfile.name)
+    mode = getattr(settings, 'PROJECT_FILE_SENDFILE', None)
+
+    if mode:
+        response = _sendfile_response(mode, fieldfile)
+    else:
+        size = fieldfile.size
+        last_modified = _last_modified(fieldfile)
+        byte_range = parse_range(request.headers.get('Range'), size)
+
+        # If-Range: only send the range when the file is unchanged since the client's copy
+        if_range = request.headers.get('If-Range')
+        if byte_range and if_range and (last_modified is None or parse_http_date_safe(if_range) != int(last_modified.timestamp())):
+            byte_range = None
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(fieldfile, start, end - start + 1), status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        else:
+            # FileResponse streams the file in blocks (and sets type and length)
+            response = FileResponse(fieldfile.open('rb'))
+            response.block_size = STREAM_BLOCK_SIZE
+
+        response['Accept-Ranges'] = 'bytes'
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+
+    disposition = 'attachment' if as_attachment else 'inline'
+    response['Content-Disposition'] = f"{disposition}; filename*=UTF-8''{quote(filename)}"
+    # Attachments are private: no shared caches
+    response['Cache-Control'] = 'private'
+    return response
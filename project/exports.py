@@ -0,0 +1,128 @@
+"""
+Streaming CSV / JSON Lines exports of tasks, timesheets and comments.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` and the
+related names (project, task, users) are joined in the same query, so memory
+stays flat however many rows are exported. The queryset passed in decides
+what is exported: the admin actions and the ``export_records`` command both
+start from the admin ``get_queryset`` and therefore apply its role rules.
+"""
+import csv
+import json
+
+from django.contrib import admin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import Comment, Task, TimeSheet
+from .replicas import on_replica
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Exported columns per model: (header, field path)
+EXPORT_COLUMNS = {
+    Task: [
+        ('id', 'id'),
+        ('title', 'title'),
+        ('project', 'project__name'),
+        ('assigned_to', 'assigned_to__username'),
+        ('status', 'status'),
+        ('priority', 'priority'),
+        ('tracker_type', 'tracker_type'),
+        ('severity', 'severity'),
+        ('reproducibility', 'reproducibility'),
+        ('start_date', 'start_date'),
+        ('due_date', 'due_date'),
+        ('description', 'description'),
+        ('is_active', 'is_active'),
+        ('created_user', 'created_user__username'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+    ],
+    TimeSheet: [
+        ('id', 'id'),
+        ('date', 'date'),
+        ('project', 'project__name'),
+        ('task', 'task__title'),
+        ('user', 'created_user__username'),
+        ('hours', 'hours'),
+        ('description', 'description'),
+        ('is_active', 'is_active'),
+    ],
+    Comment: [
+        ('id', 'id'),
+        ('title', 'title'),
+        ('project', 'task__project__name'),
+        ('task', 'task__title'),
+        ('created_user', 'created_user__username'),
+        ('content', 'content'),
+        ('is_active', 'is_active'),
+        ('created_at', 'created_at'),
+    ],
+}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+class _Echo:
+    """File-like object for csv.writer that returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export rows of a queryset, ordered by primary key."""
+    paths = [path for _, path in EXPORT_COLUMNS[queryset.model]]
+    # distinct() from role filters is kept, any ordering and annotation is replaced
+    return queryset.order_by('pk').values_list(*paths).iterator(chunk_size=chunk_size)
+
+
+def _batched(lines, chunk_size):
+    # Join the lines of each chunk, so the response is not written one line at a time
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= chunk_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_export(queryset, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the export of a queryset as chunks of CSV or JSON Lines text."""
+    headers = [header for header, _ in EXPORT_COLUMNS[queryset.model]]
+    rows = export_rows(queryset, chunk_size)
+
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        lines = (writer.writerow(row) for row in rows)
+        yield writer.writerow(headers)
+    elif fmt == 'jsonl':
+        lines = (json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+    else:
+        raise ValueError(f'Unknown export format: {fmt}')
+
+    yield from _batched(lines, chunk_size)
+
+
+def export_response(queryset, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    content_type, extension = FORMATS[fmt]
+    response = StreamingHttpResponse(stream_export(queryset, fmt, chunk_size), content_type=content_type)
+    filename = f'{queryset.model._meta.model_name}s.{extension}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@admin.action(description='Export selected %(verbose_name_plural)s as CSV', permissions=['view'])
+def export_as_csv(modeladmin, request, queryset):
+    return export_response(on_replica(queryset), 'csv')
+
+
+@admin.action(description='Export selected %(verbose_name_plural)s as JSON Lines', permissions=['view'])
+def export_as_jsonl(modeladmin, request, queryset):
+    return export_response(on_replica(queryset), 'jsonl')
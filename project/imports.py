@@ -0,0 +1,417 @@
+"""
+Bulk import of tasks and timesheet entries from CSV or JSON Lines.
+
+Records are read one at a time from the file and processed in batches: the
+projects, users and tasks a batch refers to are loaded with one query per
+kind into lookup maps, every record is validated against the maps (the same
+rules as the task admin form), and the valid rows of a batch are written with
+``bulk_create`` in one transaction. Invalid rows are reported with their line
+number and skipped; in dry-run mode nothing is written.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime, time
+from itertools import islice
+
+from django import forms
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models, transaction
+from django.db.models import Q
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .caches import invalidate_project_tasks
+from .models import Project, Task, TimeSheet, keep_dates, task_date_errors
+from .roles import user_sees_all_project_tasks
+from .rollups import apply_timesheet_batch
+from .search import TASK_INDEX
+
+DEFAULT_BATCH_SIZE = 500
+
+RowError = namedtuple('RowError', ['line', 'field', 'message'])
+
+# Marks a name that matches more than one row
+AMBIGUOUS = object()
+
+# Spellings of booleans accepted on top of the form field's (True/False, t/f, 1/0)
+BOOLEAN_VALUES = {'true': True, 'false': False, 'yes': True, 'no': False}
+
+
+def read_records(stream, fmt):
+    """Yield ``(line number, record dict)`` from a CSV (with header row) or JSON Lines text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {'__error__': f'Invalid JSON: {e}'}
+            if not isinstance(record, dict):
+                record = {'__error__': 'Expected a JSON object'}
+            yield line_number, record
+    else:
+        raise ValueError(f'Unknown import format: {fmt}')
+
+
+def _is_id(ref):
+    # ASCII only: isdigit() also accepts characters like '²' that are no integers
+    return ref.isascii() and ref.isdigit()
+
+
+def _text(record, name):
+    value = record.get(name)
+    return '' if value is None else str(value).strip()
+
+
+class BaseImporter:
+    """Runs the batched validate-and-insert pipeline; subclasses resolve and build the rows."""
+    model = None
+    # Record fields holding usernames
+    user_fields = ()
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        self.user = user
+        self.batch_size = max(int(batch_size), 1)
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        # Lookup maps kept across batches: reference -> object, None or AMBIGUOUS
+        self.projects = {}
+        self.users = {}
+
+    def run(self, records):
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            self.process_batch(batch)
+        return self
+
+    def process_batch(self, batch):
+        self.resolve(batch)
+
+        objs = []
+        for line, record in batch:
+            errors = []
+            if '__error__' in record:
+                errors.append(RowError(line, '', record['__error__']))
+            else:
+                obj = self.build(line, record, errors)
+            if errors:
+                self.errors.extend(errors)
+            else:
+                objs.append(obj)
+
+        self.rows += len(batch)
+        if objs and not self.dry_run:
+            with transaction.atomic():
+                self.save(objs)
+        # In dry-run mode: the rows that would have been created
+        self.created += len(objs)
+
+    def resolve(self, batch):
+        """Load the referenced objects of a batch into the lookup maps."""
+        project_refs = {_text(record, 'project') for _, record in batch} - set(self.projects) - {''}
+        if project_refs:
+            ids = [ref for ref in project_refs if _is_id(ref)]
+            names = [ref for ref in project_refs if not _is_id(ref)]
+            found = (
+                Project.objects.visible_to(self.user)
+                .filter(Q(pk__in=ids) | Q(name__in=names))
+                .order_by().only('id', 'name', 'start_date', 'end_date')
+            )
+            self.projects.update(dict.fromkeys(project_refs))
+            for project in found:
+                if str(project.pk) in project_refs:
+                    self.projects[str(project.pk)] = project
+                if project.name in project_refs:
+                    self.projects[project.name] = AMBIGUOUS if self.projects[project.name] else project
+
+        user_refs = {_text(record, field) for _, record in batch for field in self.user_fields} - set(self.users) - {''}
+        if user_refs:
+            self.users.update(dict.fromkeys(user_refs))
+            self.users.update({user.username: user for user in User.objects.filter(username__in=user_refs).order_by().only('id', 'username')})
+
+    def lookup(self, mapping, record, field, errors, line, label, required=True):
+        ref = _text(record, field)
+        if not ref:
+            if required:
+                errors.append(RowError(line, field, 'This field is required.'))
+            return None
+        value = mapping.get(ref)
+        if value is AMBIGUOUS:
+            errors.append(RowError(line, field, f'More than one {label} is named "{ref}", use the ID.'))
+            return None
+        if value is None:
+            errors.append(RowError(line, field, f'Unknown {label} "{ref}".'))
+        return value
+
+    def clean_field(self, record, name, errors, line):
+        """Convert and validate a plain model field like a model form would; empty means the default."""
+        field = self.model._meta.get_field(name)
+        raw = record.get(name)
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            if field.has_default():
+                return field.get_default()
+            if not field.blank:
+                errors.append(RowError(line, name, 'This field is required.'))
+                return None
+            return None if field.null else ''
+        if isinstance(field, models.BooleanField) and isinstance(raw, str):
+            raw = BOOLEAN_VALUES.get(raw.strip().lower(), raw)
+        try:
+            return field.clean(raw.strip() if isinstance(raw, str) else raw, None)
+        except ValidationError as e:
+            errors.extend(RowError(line, name, message) for message in e.messages)
+            return None
+
+    def build(self, line, record, errors):
+        raise NotImplementedError
+
+    def save(self, objs):
+        raise NotImplementedError
+
+
+class TaskImporter(BaseImporter):
+    """
+    Columns: title, project (ID or name), assigned_to (username), start_date,
+    due_date, description, priority, status, tracker_type, severity,
+    reproducibility, steps_to_reproduce, environment, is_active.
+    """
+    model = Task
+    user_fields = ('assigned_to',)
+    plain_fields = (
+        'title', 'description', 'priority', 'status', 'tracker_type', 'severity', 'reproducibility',
+        'start_date', 'due_date', 'steps_to_reproduce', 'environment', 'is_active',
+    )
+
+    def resolve(self, batch):
+        super().resolve(batch)
+
+        # Team memberships of the batch's projects and assignees, for the assignee rule
+        projects = {self.projects.get(_text(record, 'project')) for _, record in batch}
+        users = {self.users.get(_text(record, 'assigned_to')) for _, record in batch}
+        project_ids = {project.pk for project in projects if isinstance(project, Project)}
+        user_ids = {user.pk for user in users if user is not None}
+        self.memberships = set(
+            Project.team.through.objects
+            .filter(project_id__in=project_ids, user_id__in=user_ids)
+            .values_list('project_id', 'user_id')
+        )
+
+    def build(self, line, record, errors):
+        values = {name: self.clean_field(record, name, errors, line) for name in self.plain_fields}
+        project = self.lookup(self.projects, record, 'project', errors, line, 'project')
+        assigned_to = self.lookup(self.users, record, 'assigned_to', errors, line, 'user')
+        if errors:
+            return None
+
+        if (project.pk, assigned_to.pk) not in self.memberships:
+            errors.append(RowError(line, 'assigned_to', f'"{assigned_to.username}" is not in the team of "{project.name}".'))
+        errors.extend(
+            RowError(line, 'start_date', message)
+            for message in task_date_errors(values['start_date'], values['due_date'], project)
+        )
+        return Task(project=project, assigned_to=assigned_to, created_user=self.user, **values)
+
+    def save(self, objs):
+        Task.objects.bulk_create(objs)
+        # bulk_create sends no post_save: index the tasks and invalidate the tasks-by-project caches here
+        TASK_INDEX.index(objs)
+        invalidate_project_tasks(*{obj.project_id for obj in objs})
+
+
+class TimeSheetImporter(BaseImporter):
+    """
+    Columns: project (ID or name), task (ID or title within the project),
+    date (ISO date or datetime), hours, description, user (username, defaults
+    to the importing user), is_active. Entries of other users can be imported
+    by superusers, Project Managers and Project Leads, for members of the
+    project's team.
+    """
+    model = TimeSheet
+    user_fields = ('user',)
+    plain_fields = ('hours', 'description', 'is_active')
+
+    def __init__(self, user, *args, **kwargs):
+        super().__init__(user, *args, **kwargs)
+        self.imports_for_others = user_sees_all_project_tasks(user)
+
+    def resolve(self, batch):
+        super().resolve(batch)
+
+        projects = {self.projects.get(_text(record, 'project')) for _, record in batch}
+        project_ids = {project.pk for project in projects if isinstance(project, Project)}
+
+        # Team memberships of the batch's projects and users, for entries of other users
+        users = {self.users.get(_text(record, 'user')) for _, record in batch}
+        user_ids = {user.pk for user in users if user is not None and user.pk != self.user.pk}
+        self.memberships = set()
+        if self.imports_for_others and user_ids:
+            self.memberships = set(
+                Project.team.through.objects
+                .filter(project_id__in=project_ids, user_id__in=user_ids)
+                .values_list('project_id', 'user_id')
+            )
+
+        # Tasks the importing user sees in the referenced projects, by ID and by title
+        self.tasks = {}
+        refs = {_text(record, 'task') for _, record in batch} - {''}
+        if refs and project_ids:
+            ids = [ref for ref in refs if _is_id(ref)]
+            titles = [ref for ref in refs if not _is_id(ref)]
+            found = (
+                Task.objects.visible_to(self.user).filter(project_id__in=project_ids)
+                .filter(Q(pk__in=ids) | Q(title__in=titles))
+                .order_by()
+                .values_list('id', 'title', 'project_id')
+            )
+            for task_id, title, project_id in found:
+                self.tasks[(project_id, str(task_id))] = task_id
+                key = (project_id, title)
+                self.tasks[key] = AMBIGUOUS if key in self.tasks else task_id
+
+    def parse_date(self, record, errors, line):
+        raw = _text(record, 'date')
+        if not raw:
+            errors.append(RowError(line, 'date', 'This field is required.'))
+            return None
+        try:
+            value = parse_datetime(raw) or (parse_date(raw) and datetime.combine(parse_date(raw), time()))
+        except ValueError:
+            value = None
+        if not value:
+            errors.append(RowError(line, 'date', f'Invalid date "{raw}", expected YYYY-MM-DD[THH:MM[:SS]].'))
+            return None
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def build(self, line, record, errors):
+        values = {name: self.clean_field(record, name, errors, line) for name in self.plain_fields}
+        date = self.parse_date(record, errors, line)
+        project = self.lookup(self.projects, record, 'project', errors, line, 'project')
+        user = self.lookup(self.users, record, 'user', errors, line, 'user', required=False) or self.user
+
+        task_id = None
+        if project:
+            ref = _text(record, 'task')
+            task_id = self.tasks.get((project.pk, ref))
+            if not ref:
+                errors.append(RowError(line, 'task', 'This field is required.'))
+            elif task_id is AMBIGUOUS:
+                errors.append(RowError(line, 'task', f'More than one task of "{project.name}" is titled "{ref}", use the ID.'))
+            elif task_id is None:
+                errors.append(RowError(line, 'task', f'Unknown task "{ref}" in "{project.name}".'))
+
+        if project and user.pk != self.user.pk:
+            if not self.imports_for_others:
+                errors.append(RowError(line, 'user', 'You can only import your own entries.'))
+            elif (project.pk, user.pk) not in self.memberships:
+                errors.append(RowError(line, 'user', f'"{user.username}" is not in the team of "{project.name}".'))
+
+        if values['hours'] is not None and values['hours'] <= 0:
+            errors.append(RowError(line, 'hours', 'Hours must be greater than 0.'))
+        if errors:
+            return None
+
+        return TimeSheet(project=project, task_id=task_id, created_user=user, date=date, **values)
+
+    def save(self, objs):
+        # `date` is auto_now_add: keep the imported dates instead of now
+        TimeSheet.objects.bulk_create(keep_dates(objs))
+        # bulk_create sends no post_save, add the entries to the rollups here
+        apply_timesheet_batch(objs)
+
+
+IMPORTERS = {
+    'task': TaskImporter,
+    'timesheet': TimeSheetImporter,
+}
+
+
+def detect_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class ImportForm(forms.Form):
+    file = forms.FileField()
+    format = forms.ChoiceField(
+        choices=[('auto', 'From the file extension'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')],
+        initial='auto',
+    )
+    batch_size = forms.IntegerField(min_value=1, max_value=10000, initial=DEFAULT_BATCH_SIZE)
+    dry_run = forms.BooleanField(required=False, initial=True, help_text='Validate only, nothing is saved.')
+
+
+# Errors listed on the import page at most
+IMPORT_ERRORS_SHOWN = 500
+
+
+class ImportAdminMixin:
+    """ModelAdmin mixin adding an "Import" page (CSV / JSON Lines upload) to the changelist."""
+    importer_class = None
+    import_template = 'admin/project/import_form.html'
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='%s_%s_import' % info),
+        ] + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        if self.has_add_permission(request):
+            info = self.opts.app_label, self.opts.model_name
+            extra_context['import_url'] = reverse('%s:%s_%s_import' % ((self.admin_site.name,) + info))
+        return super().changelist_view(request, extra_context)
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        importer = None
+        if request.method == 'POST':
+            form = ImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                upload = form.cleaned_data['file']
+                fmt = form.cleaned_data['format']
+                if fmt == 'auto':
+                    fmt = detect_format(upload.name)
+                importer = self.importer_class(
+                    request.user,
+                    batch_size=form.cleaned_data['batch_size'],
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+                # Decode the upload while reading it, it is never loaded whole
+                stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+                try:
+                    importer.run(read_records(stream, fmt))
+                except UnicodeDecodeError:
+                    form.add_error('file', 'The file is not UTF-8 encoded text.')
+                    importer = None
+        else:
+            form = ImportForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': f'Import {self.opts.verbose_name_plural}',
+            'opts': self.opts,
+            'form': form,
+            'importer': importer,
+            'errors_shown': importer.errors[:IMPORT_ERRORS_SHOWN] if importer else [],
+            'columns_help': self.importer_class.__doc__,
+        }
+        return TemplateResponse(request, self.import_template, context)
@@ -0,0 +1,443 @@
+"""
+Live change events of projects, pushed to the task changelist over
+server-sent events (``api/v1/events/``, served by an ASGI server).
+
+Model signals queue an event per change (task created, status or assignee
+changed, comment or file added) and the events of one transaction are merged
+per project and published once it commits, so a bulk action or an import
+sends one message per project however many rows it touched. Event streams
+gather what arrives within ``PROJECT_LIVE_COALESCE_SECONDS`` into one message
+as well. Events only say what changed where (kinds, task IDs); the page
+reloads to see it, through the usual permission checks.
+
+Fan-out: each server process has a LocalHub delivering messages to its open
+streams. With ``PROJECT_LIVE_EVENTS = 'memory'`` events are published to the
+hub of the process that made the change, enough for a single ASGI process
+serving everything. With a ``redis://host:port`` URL they are PUBLISHed on
+Redis instead, and every ASGI process relays the project channels into its
+hub (started by ``project_management/asgi.py``), so changes made by any
+worker, WSGI or ASGI, reach every stream. The ``live_broker`` command is a
+local stand-in speaking the subset of the Redis protocol this uses.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'project:'
+# Task IDs listed by one event at most, beyond that its "tasks" is null (many)
+MAX_EVENT_TASKS = 100
+# Messages waiting per stream at most; a client falling further behind is told to resync
+STREAM_QUEUE_SIZE = 1000
+# Seconds between keep-alive comments of an idle stream (also detects closed connections)
+HEARTBEAT_SECONDS = 15
+# Milliseconds a browser waits before reconnecting a dropped stream
+RETRY_MILLISECONDS = 5000
+# Seconds a stream stays open: the browser then reconnects, which checks the user's projects again
+# (and lets a server stop, as servers wait for open responses before shutting down)
+MAX_STREAM_SECONDS = 300
+
+# Stream messages besides the published ones
+RESYNC = object()
+CLOSED = object()
+
+
+def live_events_backend():
+    """None when live events are off, 'memory' or the redis:// URL of the broker."""
+    return getattr(settings, 'PROJECT_LIVE_EVENTS', None) or None
+
+
+def coalesce_seconds():
+    return getattr(settings, 'PROJECT_LIVE_COALESCE_SECONDS', 0.5)
+
+
+def channel(project_id):
+    return f'{CHANNEL_PREFIX}{project_id}'
+
+
+#-----------------------Events----------------------------------------
+
+def make_event(project_id, kinds, task_ids=None, assignees=None):
+    """
+    An event of a project. ``task_ids`` and ``assignees`` (user IDs the
+    changed tasks are or were assigned to) are None when unknown (many).
+    """
+    return {
+        'project': project_id,
+        'kinds': sorted(set(kinds)),
+        'tasks': None if task_ids is None else sorted(set(task_ids)),
+        'assignees': None if assignees is None else sorted(set(assignees) - {None}),
+    }
+
+
+def merge_event(into, event):
+    """Merge ``event`` into ``into``, both events of the same project."""
+    into['kinds'] = sorted(set(into['kinds']) | set(event['kinds']))
+    for key in ('tasks', 'assignees'):
+        if into[key] is None or event[key] is None:
+            into[key] = None
+        else:
+            into[key] = sorted(set(into[key]) | set(event[key]))
+    if into['tasks'] is not None and len(into['tasks']) > MAX_EVENT_TASKS:
+        into['tasks'] = None
+
+
+class _Batch:
+    """The events of one transaction by project, published when it commits."""
+
+    def __init__(self):
+        self.events = {}
+
+    def add(self, event):
+        if event['project'] in self.events:
+            merge_event(self.events[event['project']], event)
+        else:
+            self.events[event['project']] = event
+
+    def __call__(self):
+        if getattr(_local, 'batch', None) is self:
+            _local.batch = None
+        for event in self.events.values():
+            publish(event)
+
+
+_local = threading.local()
+
+
+def queue_event(project_id, kinds, task_ids=None, assignees=None, using=DEFAULT_DB_ALIAS):
+    """Queue an event, published (merged with the other events of the transaction) on commit."""
+    if not live_events_backend() or not project_id:
+        return
+    event = make_event(project_id, kinds, task_ids, assignees)
+    connection = transaction.get_connection(using)
+    batch = getattr(_local, 'batch', None)
+    # The batch of an earlier transaction is done: flushed, or dropped with a rollback
+    if batch is not None and any(func is batch for _, func, _ in connection.run_on_commit):
+        batch.add(event)
+        return
+    batch = _local.batch = _Batch()
+    batch.add(event)
+    # Runs right away outside a transaction
+    transaction.on_commit(batch, using=using)
+
+
+def publish(event):
+    try:
+        broker().publish(channel(event['project']), json.dumps(event))
+    except (OSError, BrokerError) as e:
+        # The change itself is committed, a lost event only delays the refresh
+        logger.warning('Live event of project %s not published: %s', event['project'], e)
+
+
+#-----------------------Local fan-out---------------------------------
+
+class Subscription:
+    """Messages of some channels for one stream, consumed on the event loop it was created on."""
+
+    def __init__(self, hub, channels):
+        self.hub = hub
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(STREAM_QUEUE_SIZE)
+
+    def offer(self, message):
+        # Called from any thread
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop of a stream that was not closed properly is gone
+            self.close()
+
+    def _put(self, message):
+        if message is CLOSED:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        elif self.queue.full():
+            message = RESYNC
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        """The next message, None after ``timeout`` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalHub:
+    """In-process fan-out of channel messages to the subscribed streams, thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, list(channels))
+        with self._lock:
+            for name in subscription.channels:
+                self._subscriptions[name].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for name in subscription.channels:
+                self._subscriptions[name].discard(subscription)
+                if not self._subscriptions[name]:
+                    del self._subscriptions[name]
+
+    def _all(self):
+        with self._lock:
+            return set().union(*self._subscriptions.values())
+
+    def publish(self, name, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(name, ()))
+        for subscription in subscriptions:
+            subscription.offer(message)
+        return len(subscriptions)
+
+    def resync(self):
+        """Tell every stream that messages may have been lost."""
+        for subscription in self._all():
+            subscription.offer(RESYNC)
+
+    def close(self):
+        """End every stream (server shutdown)."""
+        for subscription in self._all():
+            subscription.offer(CLOSED)
+
+
+hub = LocalHub()
+
+
+#-----------------------Redis protocol--------------------------------
+
+class BrokerError(Exception):
+    pass
+
+
+def encode_command(*args):
+    """A command in the Redis protocol (RESP array of bulk strings)."""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+async def read_reply(reader):
+    """Read one RESP value from an asyncio stream: bytes, int, list or None; errors raise BrokerError."""
+    line = await reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Connection closed by the broker')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'*':
+        return None if int(rest) < 0 else [await read_reply(reader) for _ in range(int(rest))]
+    if kind == b'$':
+        return None if int(rest) < 0 else (await reader.readexactly(int(rest) + 2))[:-2]
+    if kind == b':':
+        return int(rest)
+    if kind == b'+':
+        return rest
+    if kind == b'-':
+        raise BrokerError(rest.decode(errors='replace'))
+    raise BrokerError(f'Unexpected reply {line[:40]!r}')
+
+
+def broker_address(url):
+    parts = urlsplit(url)
+    if parts.scheme != 'redis':
+        raise ValueError(f'Unsupported live events broker {url!r}, expected redis://host:port')
+    return parts.hostname or '127.0.0.1', parts.port or 6379
+
+
+class RedisPublisher:
+    """PUBLISH to a Redis server (or the live_broker stand-in), one connection per thread."""
+    timeout = 2
+
+    def __init__(self, url):
+        self.address = broker_address(url)
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, 'file', None) is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            self._local.file = sock.makefile('rwb')
+            sock.close()  # The file keeps the socket open
+        return self._local.file
+
+    def publish(self, name, message):
+        for attempt in range(2):
+            file = self._connection()
+            try:
+                file.write(encode_command('PUBLISH', name, message))
+                file.flush()
+                reply = file.readline()
+            except OSError:
+                reply = b''
+            if reply.startswith(b':'):
+                return int(reply[1:])
+            # A connection dropped since the last use: reconnect once
+            file.close()
+            self._local.file = None
+            if reply.startswith(b'-'):
+                raise BrokerError(reply[1:].strip().decode(errors='replace'))
+        raise ConnectionError(f'No reply from the live events broker at {self.address[0]}:{self.address[1]}')
+
+
+_publishers = {}
+
+
+def broker():
+    """Where events are published: the local hub, or a RedisPublisher for a redis:// backend."""
+    backend = live_events_backend()
+    if backend == 'memory':
+        return hub
+    if backend not in _publishers:
+        _publishers[backend] = RedisPublisher(backend)
+    return _publishers[backend]
+
+
+async def relay(url):
+    """Forward the project channels of the Redis broker into the local hub, reconnecting as needed."""
+    host, port = broker_address(url)
+    connected = failing = False
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                writer.write(encode_command('PSUBSCRIBE', CHANNEL_PREFIX + '*'))
+                await writer.drain()
+                if connected:
+                    # Events published while disconnected are lost
+                    hub.resync()
+                connected, failing = True, False
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and reply[0] == b'pmessage':
+                        hub.publish(reply[2].decode(), reply[3].decode())
+            finally:
+                writer.close()
+        except (OSError, asyncio.IncompleteReadError, BrokerError) as e:
+            if not failing:
+                logger.warning('Live events relay from %s:%s interrupted, retrying: %s', host, port, e)
+            failing = True
+            await asyncio.sleep(1)
+
+
+_relays = {}
+
+
+def ensure_relay():
+    """Start the relay of a redis:// backend on the running event loop, once."""
+    backend = live_events_backend()
+    if not backend or backend == 'memory':
+        return
+    loop = asyncio.get_running_loop()
+    task = _relays.get(loop)
+    if task is None or task.done():
+        _relays[loop] = loop.create_task(relay(backend))
+
+
+async def stop():
+    """End the streams and the relay of this process."""
+    hub.close()
+    task = _relays.pop(asyncio.get_running_loop(), None)
+    if task is not None:
+        task.cancel()
+
+
+def live_events_application(application):
+    """
+    ASGI application: ``application`` with the live events relay run over the
+    server's lifespan. Servers without lifespan events start the relay with
+    the first stream instead.
+    """
+    async def app(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                ensure_relay()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return app
+
+
+#-----------------------Event streams---------------------------------
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def parse_event(message):
+    try:
+        event = json.loads(message)
+        return event if {'project', 'kinds', 'tasks', 'assignees'} <= event.keys() else None
+    except (TypeError, ValueError, AttributeError):
+        logger.warning('Ignored malformed live event %.100r', message)
+        return None
+
+
+def visible(event, assigned_to):
+    """Whether a stream limited to the tasks assigned to ``assigned_to`` (None: all tasks) gets the event."""
+    return assigned_to is None or event['assignees'] is None or assigned_to in event['assignees']
+
+
+async def event_stream(project_ids, assigned_to=None):
+    """
+    Server-sent events of the projects, merged per project over the coalesce
+    window. With ``assigned_to`` (developers) only events of tasks assigned,
+    now or before, to that user are sent.
+    """
+    ensure_relay()
+    subscription = hub.subscribe(channel(project_id) for project_id in project_ids)
+    loop = asyncio.get_running_loop()
+    ends_at = loop.time() + MAX_STREAM_SECONDS
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        while (remaining := ends_at - loop.time()) > 0:
+            message = await subscription.get(min(HEARTBEAT_SECONDS, remaining))
+            if message is None:
+                yield ': keep-alive\n\n'
+                continue
+
+            # Gather what arrives within the window into one message per project
+            events, resync = {}, False
+            deadline = loop.time() + coalesce_seconds()
+            while message is not None:
+                if message is CLOSED:
+                    return
+                if message is RESYNC:
+                    resync = True
+                elif (event := parse_event(message)) and visible(event, assigned_to):
+                    if event['project'] in events:
+                        merge_event(events[event['project']], event)
+                    else:
+                        events[event['project']] = event
+                remaining = deadline - loop.time()
+                message = await subscription.get(remaining) if remaining > 0 else None
+
+            if resync:
+                yield _sse('resync', {})
+            for event in events.values():
+                del event['assignees']
+                yield _sse('project', event)
+    finally:
+        subscription.close()
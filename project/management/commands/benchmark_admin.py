@@ -0,0 +1,228 @@
+import json
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from project.models import Comment, File, Project, Task, TimeSheet
+from project.profiling import percentile, profiled
+from project.roles import DEVELOPER, PROJECT_LEAD, PROJECT_MANAGER, TESTER
+
+# Benchmarked roles and their group (None: a superuser)
+ROLES = {'superuser': None, 'manager': PROJECT_MANAGER, 'lead': PROJECT_LEAD, 'developer': DEVELOPER, 'tester': TESTER}
+
+TARGETS = (
+    'project-changelist', 'task-changelist', 'comment-changelist',
+    'project-change', 'task-change', 'comment-change',
+    'tasks-for-project', 'team-members',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the admin hot paths as each role: the project, task and comment changelists, "
+        "their change forms, get_tasks_for_project and fetch_team_members, requested in-process "
+        "through the full middleware stack. Reports status, query counts (with repeated queries "
+        "and cache hits) and latency percentiles per role and target as JSON, and compares them "
+        "with a --baseline file of an earlier run. Caches are warm (see --warmup); the requests "
+        "log the users in, which writes sessions, so use a benchmark database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Project of the change forms and lookups (default: the one with the most tasks).')
+        parser.add_argument('--role', choices=ROLES, action='append', help='Role(s) to benchmark (default all).')
+        parser.add_argument('--target', choices=TARGETS, action='append', help='Target(s) to benchmark (default all).')
+        parser.add_argument('--repeat', type=int, default=30, help='Measured requests per role and target.')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests before them.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Relative p50 increase over the baseline counted as a regression (default 0.2); more queries always are.',
+        )
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error when a regression is found.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('Give at least one --repeat.')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read the baseline {options['baseline']}: {e}")
+
+        project = Project.objects.filter(pk=options['project']).first() if options['project'] else self.busiest_project()
+        if project is None:
+            raise CommandError('No project to benchmark, generate a dataset first (generate_dataset).')
+
+        # The table goes next to the JSON when that is written to a file
+        self.report_to = self.stdout if options['output'] else self.stderr
+        self.report_to.write(f'Project {project.pk} "{project}", {options["repeat"]} requests per target')
+
+        results = {}
+        # Sampled profiling would take over the query and cache counters
+        with override_settings(PROJECT_PROFILE_SAMPLE_RATE=0):
+            for role in options['role'] or ROLES:
+                user = self.role_user(role, project)
+                if user is None:
+                    self.report_to.write(self.style.WARNING(f'{role}: no active staff user on the project, skipped'))
+                    continue
+                urls = self.target_urls(user, project)
+                client = Client(HTTP_HOST=self.host())
+                client.force_login(user)
+                try:
+                    for target in options['target'] or TARGETS:
+                        if urls.get(target) is None:
+                            self.report_to.write(f'{role}/{target}: nothing visible to {user.username}, skipped')
+                            continue
+                        result = self.measure(client, urls[target], options['warmup'], options['repeat'])
+                        results[f'{role}/{target}'] = {'user': user.username, 'path': urls[target], **result}
+                finally:
+                    client.logout()
+
+        document = {'meta': self.meta(project, options), 'results': results}
+        output = json.dumps(document, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        regressions = self.report(results, baseline, options['tolerance'])
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{regressions} regression(s) against the baseline.')
+
+    def host(self):
+        # Requests pass ALLOWED_HOSTS like real ones (DEBUG allows localhost when it is empty)
+        hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+        return hosts[0] if hosts else 'localhost'
+
+    def busiest_project(self):
+        return Project.objects.annotate(task_count=Count('task')).order_by('-task_count', 'pk').first()
+
+    def role_user(self, role, project):
+        """The active staff user of the role on the project's team (or its creator) with the most tasks in it."""
+        users = User.objects.filter(is_active=True, is_staff=True)
+        if ROLES[role] is None:
+            return users.filter(is_superuser=True).order_by('pk').first()
+
+        team = Project.team.through.objects.filter(project_id=project.pk).values('user_id')
+        tasks = (
+            Task.objects.filter(project_id=project.pk, assigned_to=OuterRef('pk'))
+            .order_by().values('assigned_to').annotate(count=Count('pk')).values('count')
+        )
+        return (
+            users.filter(groups__name=ROLES[role], is_superuser=False)
+            .filter(Q(pk__in=team) | Q(pk=project.created_user_id))
+            .annotate(project_tasks=Coalesce(Subquery(tasks), 0))
+            .order_by('-project_tasks', 'pk')
+            .first()
+        )
+
+    def target_urls(self, user, project):
+        """URL of every target, None where the user sees no object to open."""
+        request = RequestFactory().get('/admin/')
+        request.user = user
+
+        def first_visible(model, **filters):
+            # Through the admin's own queryset, so the role rules apply
+            queryset = admin.site.get_model_admin(model).get_queryset(request)
+            return queryset.filter(**filters).order_by('pk').values_list('pk', flat=True).first()
+
+        def change_url(model, pk):
+            return reverse(f'admin:project_{model._meta.model_name}_change', args=[pk]) if pk is not None else None
+
+        return {
+            'project-changelist': reverse('admin:project_project_changelist'),
+            'task-changelist': reverse('admin:project_task_changelist'),
+            'comment-changelist': reverse('admin:project_comment_changelist'),
+            'project-change': change_url(Project, first_visible(Project, pk=project.pk)),
+            'task-change': change_url(Task, first_visible(Task, project_id=project.pk)),
+            'comment-change': change_url(Comment, first_visible(Comment, task__project_id=project.pk)),
+            'tasks-for-project': reverse('get_tasks_for_project', args=[project.pk]),
+            'team-members': reverse('admin:fetch-team-members') + f'?project_id={project.pk}',
+        }
+
+    def measure(self, client, url, warmup, repeat):
+        for _ in range(warmup):
+            client.get(url)
+
+        timings, queries = [], []
+        for _ in range(repeat):
+            with profiled() as profile:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(profile.queries)
+
+        timings.sort()
+        duplicates, similar, top = profile.repeated()
+        return {
+            'status': response.status_code,
+            # Query counts can vary with cache expiry, the median is the typical request
+            'queries': int(statistics.median(queries)),
+            'queries_max': max(queries),
+            'duplicates': duplicates,
+            'similar': similar,
+            'repeated': [{'sql': sql, 'count': count} for sql, count in top],
+            'cache_hits': profile.cache_hits,
+            'cache_misses': profile.cache_misses,
+            'p50': round(percentile(timings, 0.50), 2),
+            'p95': round(percentile(timings, 0.95), 2),
+            'p99': round(percentile(timings, 0.99), 2),
+            'mean': round(statistics.mean(timings), 2),
+            'max': round(timings[-1], 2),
+        }
+
+    def meta(self, project, options):
+        return {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'project': project.pk,
+            'repeat': options['repeat'],
+            'warmup': options['warmup'],
+            'rows': {model.__name__: model.objects.count() for model in (User, Project, Task, TimeSheet, Comment, File)},
+        }
+
+    def report(self, results, baseline, tolerance):
+        """Print the results table, with the changes against the baseline; returns the number of regressions."""
+        regressions = 0
+        header = f"{'role/target':<30} {'status':>6} {'queries':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        self.report_to.write(header + ('  vs baseline' if baseline else ''))
+        for key, result in results.items():
+            line = (
+                f"{key:<30} {result['status']:>6} {result['queries']:>8} "
+                f"{result['p50']:>9.2f} {result['p95']:>9.2f} {result['p99']:>9.2f}"
+            )
+            before = (baseline or {}).get(key)
+            if before is not None:
+                queries = result['queries'] - before['queries']
+                p50 = (result['p50'] - before['p50']) / before['p50'] if before['p50'] else 0
+                p95 = (result['p95'] - before['p95']) / before['p95'] if before['p95'] else 0
+                line += f'  queries {queries:+d}, p50 {p50:+.0%}, p95 {p95:+.0%}'
+                if queries > 0 or p50 > tolerance or result['status'] != before['status']:
+                    regressions += 1
+                    line = self.style.ERROR(line + '  REGRESSION')
+            self.report_to.write(line)
+        if baseline:
+            missing = sorted(set(baseline) - set(results))
+            if missing:
+                self.report_to.write(f"Not measured this time: {', '.join(missing)}")
+        return regressions
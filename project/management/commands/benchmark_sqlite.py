@@ -0,0 +1,157 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project.sqlite import DEFAULT_PRAGMAS, JOURNAL_MODE, apply_pragmas, configured_pragmas
+
+SCHEMA = (
+    'CREATE TABLE entry (id INTEGER PRIMARY KEY, task_id INTEGER NOT NULL, hours REAL NOT NULL, note TEXT NOT NULL)',
+    'CREATE INDEX entry_task_idx ON entry (task_id)',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure SQLite read/write throughput with parallel writers and readers on a scratch "
+        "database, with Django's default connection setup and with the tuned one (WAL and the "
+        "PRAGMAs of PROJECT_SQLITE_PRAGMAS, immediate transactions, reused connections). "
+        "The project database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Parallel writer threads.')
+        parser.add_argument('--readers', type=int, default=4, help='Parallel reader threads.')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run.')
+        parser.add_argument('--rows', type=int, default=20000, help='Rows loaded before each run.')
+        parser.add_argument('--mode', choices=('default', 'tuned', 'both'), default='both')
+        parser.add_argument('--path', help='Directory of the scratch database (default: a temporary directory).')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 0 or options['readers'] < 0 or options['writers'] + options['readers'] == 0:
+            raise CommandError('Give at least one writer or reader.')
+
+        modes = ('default', 'tuned') if options['mode'] == 'both' else (options['mode'],)
+        self.stdout.write(
+            f"{options['writers']} writers, {options['readers']} readers, {options['seconds']}s per run"
+        )
+        self.stdout.write(
+            f"{'setup':<8} {'writes/s':>10} {'reads/s':>10} {'locked':>8} {'write p50 ms':>13} {'write p95 ms':>13}"
+        )
+        for mode in modes:
+            with tempfile.TemporaryDirectory(dir=options['path']) as directory:
+                result = self.run(os.path.join(directory, 'benchmark.sqlite3'), mode, options)
+            self.stdout.write(
+                f"{mode:<8} {result['writes']:>10.0f} {result['reads']:>10.0f} {result['locked']:>8} "
+                f"{result['p50']:>13.2f} {result['p95']:>13.2f}"
+            )
+
+    def connect(self, path, mode):
+        # Both use Django's own connection parameters: autocommit, 5s busy timeout
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        if mode == 'tuned':
+            apply_pragmas(connection, {'journal_mode': JOURNAL_MODE, **(configured_pragmas() or DEFAULT_PRAGMAS)})
+        return connection
+
+    def prepare(self, path, mode, rows):
+        connection = self.connect(path, mode)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO entry (task_id, hours, note) VALUES (?, ?, ?)',
+            ((random.randrange(1000), random.random() * 8, 'x' * 80) for _ in range(rows)),
+        )
+        connection.execute('COMMIT')
+        connection.close()
+
+    def run(self, path, mode, options):
+        self.prepare(path, mode, options['rows'])
+        tuned = mode == 'tuned'
+        # A "request": a transaction that reads the task's total then adds an entry, as the admin
+        # does when saving a timesheet. Default: a new connection per request (CONN_MAX_AGE=0) and
+        # a deferred transaction; tuned: one reused connection and BEGIN IMMEDIATE.
+        begin = 'BEGIN IMMEDIATE' if tuned else 'BEGIN'
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        totals = {'writes': 0, 'reads': 0, 'locked': 0}
+        latencies = []
+
+        def writer():
+            writes = locked = 0
+            timings = []
+            connection = self.connect(path, mode) if tuned else None
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                current = connection or self.connect(path, mode)
+                task_id = random.randrange(1000)
+                try:
+                    current.execute(begin)
+                    current.execute('SELECT COALESCE(SUM(hours), 0) FROM entry WHERE task_id = ?', (task_id,)).fetchone()
+                    current.execute('INSERT INTO entry (task_id, hours, note) VALUES (?, ?, ?)', (task_id, 1.5, 'x' * 80))
+                    current.execute('COMMIT')
+                    writes += 1
+                    timings.append(time.monotonic() - started)
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                    if current.in_transaction:
+                        current.execute('ROLLBACK')
+                    locked += 1
+                finally:
+                    if connection is None:
+                        current.close()
+            if connection is not None:
+                connection.close()
+            with lock:
+                totals['writes'] += writes
+                totals['locked'] += locked
+                latencies.extend(timings)
+
+        def reader():
+            reads = locked = 0
+            connection = self.connect(path, mode) if tuned else None
+            while time.monotonic() < deadline:
+                current = connection or self.connect(path, mode)
+                try:
+                    current.execute(
+                        'SELECT task_id, SUM(hours) FROM entry WHERE task_id BETWEEN ? AND ? GROUP BY task_id',
+                        (task_id := random.randrange(1000), task_id + 20),
+                    ).fetchall()
+                    reads += 1
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                    locked += 1
+                finally:
+                    if connection is None:
+                        current.close()
+            if connection is not None:
+                connection.close()
+            with lock:
+                totals['reads'] += reads
+                totals['locked'] += locked
+
+        # Threads are enough: sqlite3 releases the GIL while SQLite runs a statement or waits for a lock
+        threads = [threading.Thread(target=writer) for _ in range(options['writers'])]
+        threads += [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies.sort()
+        return {
+            'writes': totals['writes'] / elapsed,
+            'reads': totals['reads'] / elapsed,
+            'locked': totals['locked'],
+            'p50': statistics.median(latencies) * 1000 if latencies else 0,
+            'p95': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        }
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from project.blobs import add_reference, collect_garbage, rebuild_references, release_reference
+from project.models import File
+from project.storage import CAS_PREFIX
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the attachments stored before the content-addressed storage (media/files/...) "
+        "into it, storing identical files once, then recount blob references and delete "
+        "unreferenced blobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the files that would be moved.')
+
+    def handle(self, *args, **options):
+        storage = File._meta.get_field('file').storage
+        legacy = File.objects.exclude(file__startswith=CAS_PREFIX).exclude(file='').order_by('pk')
+
+        moved = missing = 0
+        moved_bytes = 0
+        for attachment in legacy.iterator():
+            name = attachment.file.name
+            if not storage.exists(name):
+                self.stderr.write(f'File {attachment.pk}: {name} is missing, skipped.')
+                missing += 1
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'File {attachment.pk}: {name}')
+                moved += 1
+                continue
+
+            with storage.open(name, 'rb') as content:
+                new_name = storage.save(name, content)
+            with transaction.atomic():
+                # update() sends no signals, the references are handled here
+                File.objects.filter(pk=attachment.pk).update(file=new_name)
+                add_reference(new_name)
+                release_reference(name)
+            moved += 1
+            moved_bytes += storage.size(new_name)
+
+        if options['dry_run']:
+            self.stdout.write(f'{moved} files would be moved, {missing} missing.')
+            return
+
+        blobs = rebuild_references()
+        removed = collect_garbage()
+        self.stdout.write(
+            f'{moved} files ({moved_bytes} bytes) moved, {missing} missing, '
+            f'{blobs} unique blobs in use, {removed} unreferenced blobs deleted.'
+        )
+        self.stdout.write(self.style.SUCCESS('Attachments deduplicated.'))
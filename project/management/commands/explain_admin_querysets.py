@@ -0,0 +1,95 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from project.caches import project_task_rows
+from project.models import Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN QUERY PLAN on the changelist queryset of every project admin, "
+        "as each given user, and report full table scans and temporary sorts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help='Username to resolve the querysets as (repeatable). Defaults to a superuser and one member of every group.',
+        )
+        parser.add_argument('--verbose-plan', action='store_true', help='Print the complete plan of every queryset.')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error when a full scan is found.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN reporting is only implemented for SQLite.')
+
+        users = self.get_users(options['usernames'])
+        if not users:
+            raise CommandError('No users to explain the querysets for.')
+
+        scans = 0
+        for user in users:
+            for label, queryset in self.get_querysets(user):
+                plan = queryset.explain()
+                problems = [line for line in plan.splitlines() if self.is_full_scan(line) or self.is_temp_sort(line)]
+                full_scans = [line for line in problems if self.is_full_scan(line)]
+                scans += len(full_scans)
+
+                if full_scans:
+                    status = self.style.ERROR('FULL SCAN')
+                elif problems:
+                    status = self.style.WARNING('TEMP SORT')
+                else:
+                    status = self.style.SUCCESS('OK')
+                self.stdout.write(f'{label} as {user.username}: {status}')
+                for line in (plan.splitlines() if options['verbose_plan'] else problems):
+                    self.stdout.write(f'    {line}')
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f'{scans} full scan(s) found.')
+
+    def get_users(self, usernames):
+        if usernames:
+            users = list(User.objects.filter(username__in=usernames))
+            missing = set(usernames) - {user.username for user in users}
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+            return users
+
+        # A superuser plus the first member of every group not yet covered
+        users = list(User.objects.filter(is_superuser=True).order_by('pk')[:1])
+        seen_groups = set()
+        for user in User.objects.filter(groups__isnull=False).prefetch_related('groups').order_by('pk').distinct():
+            groups = {group.name for group in user.groups.all()}
+            if not groups <= seen_groups:
+                seen_groups |= groups
+                users.append(user)
+        return users
+
+    def get_querysets(self, user):
+        request = RequestFactory().get('/admin/')
+        request.user = user
+
+        for model, model_admin in admin.site._registry.items():
+            if model._meta.app_label != 'project':
+                continue
+            changelist = model_admin.get_changelist_instance(request)
+            name = type(model_admin).__name__
+            yield f'{name} changelist', changelist.queryset
+
+        project = Project.objects.order_by('pk').first()
+        if project is not None:
+            # Same query as the view, which caches the rows
+            yield 'get_tasks_for_project', project_task_rows(project.pk)
+
+    @staticmethod
+    def is_full_scan(line):
+        line = line.strip(' -|`')
+        return line.startswith('SCAN ') and 'USING' not in line and 'CONSTANT ROW' not in line
+
+    @staticmethod
+    def is_temp_sort(line):
+        return 'USE TEMP B-TREE' in line
@@ -0,0 +1,44 @@
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from project.exports import DEFAULT_CHUNK_SIZE, EXPORT_COLUMNS, FORMATS, stream_export
+from project.replicas import on_replica
+
+MODELS = {model._meta.model_name: model for model in EXPORT_COLUMNS}
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream tasks, timesheets or comments as CSV or JSON Lines, "
+        "limited to what the given user sees in the admin."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODELS), help='What to export.')
+        parser.add_argument('--user', required=True, help='Username whose admin visibility rules apply.')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help='Output format (default csv).')
+        parser.add_argument('--output', help='File to write to (default stdout).')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows fetched per database round trip.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['user']}")
+
+        # Same queryset as the admin changelist of the user
+        request = RequestFactory().get('/admin/')
+        request.user = user
+        model = MODELS[options['model']]
+        queryset = on_replica(admin.site.get_model_admin(model).get_queryset(request))
+
+        chunks = stream_export(queryset, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
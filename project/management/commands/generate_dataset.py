@@ -0,0 +1,330 @@
+import random
+import time
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission, User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+
+from project.blobs import rebuild_references
+from project.caches import invalidate_project_tasks
+from project.models import PRIORITY_CHOICES, Comment, File, Project, Task, TimeSheet, keep_dates
+from project.rollups import rebuild_rollups
+from project.roles import DEVELOPER, PROJECT_LEAD, PROJECT_MANAGER, TESTER
+from project.search import SEARCH_INDEXES
+from project.teams import invalidate_team_choices, invalidate_team_rosters
+
+# Usernames of the generated users start with this, a second run is refused while they exist
+PREFIX = 'synthetic-'
+
+# Share of the users in each role, the developers take the rest
+ROLE_SHARES = {PROJECT_MANAGER: 0.05, PROJECT_LEAD: 0.10, TESTER: 0.20}
+
+# Permissions a role group gets when it does not exist yet: (action, model) of the project app
+ROLE_PERMISSIONS = {
+    PROJECT_MANAGER: [(action, model) for action in ('add', 'change', 'delete', 'view')
+                      for model in ('project', 'task', 'comment', 'file', 'timesheet')],
+    PROJECT_LEAD: [('view', 'project'), ('change', 'project'), ('view', 'timesheet')]
+                  + [(action, model) for action in ('add', 'change', 'delete', 'view') for model in ('task', 'comment', 'file')],
+    DEVELOPER: [('view', 'project'), ('view', 'task'), ('change', 'task'), ('add', 'comment'), ('change', 'comment'),
+                ('view', 'comment'), ('add', 'file'), ('view', 'file'), ('add', 'timesheet'), ('view', 'timesheet')],
+    TESTER: [('view', 'project'), ('view', 'task'), ('change', 'task'), ('add', 'comment'), ('change', 'comment'),
+             ('view', 'comment'), ('add', 'file'), ('view', 'file')],
+}
+
+WORDS = (
+    'login page dashboard report export import invoice payment user account profile settings search filter '
+    'timeout crash error slow cache database query index migration deploy release build test review api '
+    'endpoint token session permission role team project task comment file upload download preview email '
+    'notification schedule calendar timesheet hours budget estimate customer order cart checkout mobile '
+    'android ios browser chrome firefox safari layout button form validation field date currency language '
+    'translation accessibility keyboard scroll table column sort pagination chart graph metrics monitoring'
+).split()
+
+STATUS_WEIGHTS = {'New': 25, 'Inprogress': 25, 'Resolved': 15, 'Reopened': 5, 'closed': 30}
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic dataset at production scale for benchmarks: users in "
+        "the Project Manager, Project Lead, developer and Testers groups, projects with large teams "
+        "and a long tail of task counts, tasks, timesheet entries, comments and attachments. The "
+        "same --seed gives the same dataset (dates relative to today). Rollups, the search index "
+        "and the attachment references are rebuilt at the end. Use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--projects', type=int, default=500)
+        parser.add_argument('--team-size', type=int, default=150, help='Members per project team (leads, testers, developers).')
+        parser.add_argument('--tasks', type=int, default=2_000_000)
+        parser.add_argument('--timesheets', type=int, default=2_000_000)
+        parser.add_argument('--comments', type=int, default=1_000_000)
+        parser.add_argument('--files', type=int, default=100_000)
+        parser.add_argument('--attachments', type=int, default=50, help='Distinct attachment contents the files share.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert.')
+        parser.add_argument('--password', default='synthetic', help='Password of every generated user.')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('The generator needs a database that returns the IDs of bulk inserts.')
+        if options['users'] < len(ROLE_PERMISSIONS) or options['projects'] < 1:
+            raise CommandError(f'Give at least {len(ROLE_PERMISSIONS)} users (one per role) and one project.')
+        if User.objects.filter(username__startswith=PREFIX).exists():
+            raise CommandError(f'Users named {PREFIX}* exist already, generate into an empty database.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = max(options['batch_size'], 1)
+        self.today = date.today()
+
+        self.step('users', lambda: self.create_users(options['users'], options['password']))
+        self.step('projects', lambda: self.create_projects(options['projects'], options['team_size']))
+        self.step('tasks', lambda: self.create_tasks(options['tasks']))
+        if self.task_ids:
+            self.step('timesheets', lambda: self.create_timesheets(options['timesheets']))
+            self.step('comments', lambda: self.create_comments(options['comments']))
+            self.step('files', lambda: self.create_files(options['files'], options['attachments']))
+
+        # bulk_create sends no signals: rebuild what they would have maintained
+        self.step('rollups', lambda: sum(rebuild_rollups(batch_size=self.batch_size).values()))
+        for name, index in sorted(SEARCH_INDEXES.items()):
+            if index.available():
+                self.step(f'{name} search index', index.rebuild)
+        self.step('attachment blobs', rebuild_references)
+        invalidate_team_choices()
+        invalidate_team_rosters(*self.project_ids)
+        invalidate_project_tasks(*self.project_ids)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            # Planner statistics, as a database that grew over time would have
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        self.stdout.write(self.style.SUCCESS(f'Dataset generated. Log in as {PREFIX}admin or any {PREFIX}* user.'))
+
+    def step(self, label, create):
+        started = time.monotonic()
+        count = create()
+        self.stdout.write(f'{label}: {count} rows in {time.monotonic() - started:.1f}s')
+
+    def insert(self, model, objs):
+        """bulk_create in batches of one transaction each, with the generated dates; returns the number of rows."""
+        count = 0
+        for batch in chunks(objs, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(keep_dates(batch))
+            count += len(batch)
+            # With DEBUG on, connection.queries would keep the SQL of thousands of bulk inserts
+            reset_queries()
+        return count
+
+    def words(self, low, high):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def created(self, day):
+        return {'created_at': day, 'updated_at': day}
+
+    #-----------------------Users and projects-------------------------
+
+    def role_group(self, name):
+        group, created = Group.objects.get_or_create(name=name)
+        if created:
+            codenames = [f'{action}_{model}' for action, model in ROLE_PERMISSIONS[name]]
+            group.permissions.set(Permission.objects.filter(content_type__app_label='project', codename__in=codenames))
+        return group
+
+    def create_users(self, count, password):
+        # One hash for all: hashing thousands of passwords would take minutes
+        password = make_password(password)
+        sizes = {role: max(int(count * share), 1) for role, share in ROLE_SHARES.items()}
+        sizes[DEVELOPER] = count - sum(sizes.values())
+
+        admin = User(username=f'{PREFIX}admin', password=password, is_staff=True, is_superuser=True)
+        admin.save()
+        self.users = {}
+        memberships = []
+        for role, size in sizes.items():
+            slug = role.lower().replace(' ', '-')
+            users = User.objects.bulk_create(
+                (User(username=f'{PREFIX}{slug}-{index}', email=f'{slug}-{index}@example.com', password=password, is_staff=True)
+                 for index in range(size)),
+                batch_size=self.batch_size,
+            )
+            self.users[role] = [user.pk for user in users]
+            group = self.role_group(role)
+            memberships.extend(User.groups.through(user_id=user.pk, group_id=group.pk) for user in users)
+        User.groups.through.objects.bulk_create(memberships, batch_size=self.batch_size)
+        return count + 1
+
+    def create_projects(self, count, team_size):
+        rng = self.rng
+        projects = []
+        for index in range(count):
+            start = self.today - timedelta(days=rng.randint(30, 3 * 365))
+            end = start + timedelta(days=rng.randint(180, 1000)) if rng.random() < 0.7 else None
+            projects.append(Project(
+                name=f'{self.words(1, 3).title()} {index}',
+                description=self.words(10, 40),
+                start_date=start,
+                end_date=end,
+                status=rng.choices(['New', 'Inprogress', 'Completed'], [2, 6, 2])[0],
+                priority=rng.choice(PRIORITY_CHOICES)[0],
+                is_active=rng.random() < 0.95,
+                created_user_id=rng.choice(self.users[PROJECT_MANAGER]),
+                **self.created(start),
+            ))
+        projects = Project.objects.bulk_create(keep_dates(projects), batch_size=self.batch_size)
+        self.projects = projects
+        self.project_ids = [project.pk for project in projects]
+
+        # Project Managers create projects, the teams are leads, testers and developers
+        self.teams = []
+        memberships = []
+        for project in projects:
+            team = {
+                PROJECT_LEAD: self.sample(PROJECT_LEAD, max(team_size // 20, 1)),
+                TESTER: self.sample(TESTER, max(team_size // 5, 1)),
+            }
+            team[DEVELOPER] = self.sample(DEVELOPER, max(team_size - len(team[PROJECT_LEAD]) - len(team[TESTER]), 1))
+            self.teams.append(team)
+            memberships.extend(
+                Project.team.through(project_id=project.pk, user_id=user_id)
+                for members in team.values() for user_id in members
+            )
+        self.insert(Project.team.through, memberships)
+
+        # A long tail: a few projects have many times the tasks of a typical one
+        self.project_weights = [rng.paretovariate(2) for _ in projects]
+        return count
+
+    def sample(self, role, size):
+        return self.rng.sample(self.users[role], min(size, len(self.users[role])))
+
+    #-----------------------Tasks and their children--------------------
+
+    def create_tasks(self, count):
+        rng = self.rng
+        # Compact per-task columns for the children: index of the project, assignee, first and last active day
+        self.task_ids = array('q')
+        self.task_projects = array('l')
+        self.task_assignees = array('l')
+        self.task_days = array('l'), array('l')
+
+        statuses, status_weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        trackers = [choice for choice, _ in Task.TRACKER_CHOICES]
+        severities = [choice for choice, _ in Task.SEVERITY_CHOICES]
+        reproducibilities = [choice for choice, _ in Task.REPRODUCTIBILITY_CHOICES]
+        indexes = range(len(self.projects))
+
+        for batch in chunks(range(count), self.batch_size):
+            tasks = []
+            for number, project_index in zip(batch, rng.choices(indexes, self.project_weights, k=len(batch))):
+                project = self.projects[project_index]
+                team = self.teams[project_index]
+                # Within the project's dates (task_date_errors), started by today
+                last_day = project.end_date or self.today + timedelta(days=90)
+                start = project.start_date + timedelta(days=rng.randint(0, (min(last_day, self.today) - project.start_date).days))
+                due = min(start + timedelta(days=rng.randint(1, 60)), last_day) if rng.random() < 0.8 else None
+                tracker = rng.choice(trackers)
+                is_bug = tracker == 'Bug'
+                tasks.append(Task(
+                    title=f'{self.words(2, 6).capitalize()} #{number}'[:100],
+                    description=self.words(10, 60),
+                    project_id=project.pk,
+                    assigned_to_id=rng.choice(team[DEVELOPER]),
+                    priority=rng.choice(PRIORITY_CHOICES)[0],
+                    status=rng.choices(statuses, status_weights)[0],
+                    tracker_type=tracker,
+                    severity=rng.choice(severities),
+                    reproducibility=rng.choice(reproducibilities),
+                    start_date=start,
+                    due_date=due,
+                    steps_to_reproduce=self.words(10, 30) if is_bug else '',
+                    environment=self.words(2, 6) if is_bug else '',
+                    is_active=rng.random() < 0.97,
+                    created_user_id=rng.choice([project.created_user_id, *team[PROJECT_LEAD]]),
+                    **self.created(start),
+                ))
+                self.task_projects.append(project_index)
+                self.task_days[0].append(start.toordinal())
+                self.task_days[1].append(max((due or start + timedelta(days=30)).toordinal(), start.toordinal()))
+            with transaction.atomic():
+                tasks = Task.objects.bulk_create(keep_dates(tasks))
+            self.task_ids.extend(task.pk for task in tasks)
+            self.task_assignees.extend(task.assigned_to_id for task in tasks)
+            reset_queries()
+        return count
+
+    def random_task(self):
+        """(index, day) of a random task and a day it was worked on, not after today."""
+        index = self.rng.randrange(len(self.task_ids))
+        first, last = self.task_days[0][index], self.task_days[1][index]
+        day = date.fromordinal(min(self.rng.randint(first, last), self.today.toordinal()))
+        return index, day
+
+    def create_timesheets(self, count):
+        hours = [Decimal(quarter) / 4 for quarter in range(1, 33)]
+
+        def timesheets():
+            for _ in range(count):
+                index, day = self.random_task()
+                logged = datetime(day.year, day.month, day.day, self.rng.randint(8, 18), tzinfo=timezone.utc)
+                yield TimeSheet(
+                    project_id=self.project_ids[self.task_projects[index]],
+                    task_id=self.task_ids[index],
+                    date=logged,
+                    hours=self.rng.choice(hours),
+                    description=self.words(3, 12),
+                    created_user_id=self.task_assignees[index],
+                    **self.created(day),
+                )
+        return self.insert(TimeSheet, timesheets())
+
+    def create_comments(self, count):
+        def comments():
+            for _ in range(count):
+                index, day = self.random_task()
+                # By the assignee or a tester of the project
+                testers = self.teams[self.task_projects[index]][TESTER]
+                author = self.task_assignees[index] if self.rng.random() < 0.6 else self.rng.choice(testers)
+                yield Comment(
+                    title=self.words(2, 5).capitalize(),
+                    task_id=self.task_ids[index],
+                    content=self.words(10, 40),
+                    created_user_id=author,
+                    **self.created(day),
+                )
+        return self.insert(Comment, comments())
+
+    def create_files(self, count, attachments):
+        if not count:
+            return 0
+        # A few real attachments in the content-addressed storage, shared by all the files
+        storage = File._meta.get_field('file').storage
+        names = [
+            storage.save(f'synthetic-{index}.txt', ContentFile(f'Synthetic attachment {index}\n{self.words(50, 200)}\n'.encode()))
+            for index in range(max(attachments, 1))
+        ]
+
+        def files():
+            for number in range(count):
+                index, day = self.random_task()
+                yield File(
+                    name=f'Attachment {number}',
+                    file=self.rng.choice(names),
+                    task_id=self.task_ids[index],
+                    created_user_id=self.task_assignees[index],
+                    **self.created(day),
+                )
+        return self.insert(File, files())
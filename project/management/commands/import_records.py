@@ -0,0 +1,51 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from project.imports import DEFAULT_BATCH_SIZE, IMPORTERS, detect_format, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Import tasks or timesheet entries from CSV or JSON Lines in batches, "
+        "with the rules of the admin forms. Invalid rows are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(IMPORTERS), help='What to import.')
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--user', required=True, help='Importing user: created_user, and whose projects are visible.')
+        parser.add_argument('--format', choices=['auto', 'csv', 'jsonl'], default='auto', help='Input format (default from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows validated and inserted per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, nothing is saved.')
+        parser.add_argument('--errors', help='Write the row errors to this CSV file.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['user']}")
+
+        fmt = options['format']
+        if fmt == 'auto':
+            fmt = detect_format(options['path'])
+
+        importer = IMPORTERS[options['model']](user, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                importer.run(read_records(stream, fmt))
+        except OSError as e:
+            raise CommandError(e)
+
+        if options['errors']:
+            with open(options['errors'], 'w', newline='', encoding='utf-8') as output:
+                writer = csv.writer(output)
+                writer.writerow(['line', 'field', 'message'])
+                writer.writerows(importer.errors)
+        else:
+            for error in importer.errors:
+                self.stderr.write(f'Line {error.line}: {error.field + ": " if error.field else ""}{error.message}')
+
+        verb = 'valid (dry run, nothing saved)' if importer.dry_run else 'imported'
+        self.stdout.write(f'{importer.created} of {importer.rows} rows {verb}, {len(importer.errors)} errors.')
@@ -0,0 +1,90 @@
+import asyncio
+import fnmatch
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from project.live import BrokerError, encode_command, read_reply
+
+
+class Command(BaseCommand):
+    help = (
+        "Local stand-in for Redis as the live events broker: a pub/sub server speaking the part "
+        "of the Redis protocol used by PROJECT_LIVE_EVENTS = 'redis://host:port' (PUBLISH, "
+        "SUBSCRIBE, PSUBSCRIBE, their UNSUBSCRIBEs and PING). Nothing is stored."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6379)
+
+    def handle(self, *args, **options):
+        # Subscribed writers by channel and by pattern
+        self.channels = defaultdict(set)
+        self.patterns = defaultdict(set)
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.client, host, port)
+        self.stdout.write(f'Live events broker listening on {host}:{port}, Ctrl+C to stop.')
+        async with server:
+            await server.serve_forever()
+
+    async def client(self, reader, writer):
+        subscriptions = {'channel': set(), 'pattern': set()}
+        try:
+            while True:
+                try:
+                    command = await read_reply(reader)
+                except BrokerError:
+                    writer.write(b'-ERR Protocol error\r\n')
+                    break
+                if not isinstance(command, list) or not command:
+                    writer.write(b'-ERR Protocol error\r\n')
+                    break
+                name, args = command[0].upper(), command[1:]
+                if name == b'PUBLISH' and len(args) == 2:
+                    writer.write(b':%d\r\n' % self.publish(*args))
+                elif name in (b'SUBSCRIBE', b'PSUBSCRIBE') and args:
+                    kind = 'channel' if name == b'SUBSCRIBE' else 'pattern'
+                    for target in args:
+                        subscriptions[kind].add(target)
+                        (self.channels if kind == 'channel' else self.patterns)[target].add(writer)
+                        writer.write(self.confirmation(name.lower(), target, sum(map(len, subscriptions.values()))))
+                elif name in (b'UNSUBSCRIBE', b'PUNSUBSCRIBE'):
+                    kind = 'channel' if name == b'UNSUBSCRIBE' else 'pattern'
+                    for target in args or list(subscriptions[kind]):
+                        subscriptions[kind].discard(target)
+                        (self.channels if kind == 'channel' else self.patterns)[target].discard(writer)
+                        writer.write(self.confirmation(name.lower(), target, sum(map(len, subscriptions.values()))))
+                elif name == b'PING':
+                    writer.write(b'+PONG\r\n')
+                else:
+                    writer.write(b'-ERR unknown command or wrong number of arguments\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for target in subscriptions['channel']:
+                self.channels[target].discard(writer)
+            for target in subscriptions['pattern']:
+                self.patterns[target].discard(writer)
+            writer.close()
+
+    def confirmation(self, kind, target, count):
+        return b'*3\r\n' + encode_command(kind, target)[4:] + b':%d\r\n' % count
+
+    def publish(self, name, message):
+        receivers = 0
+        for writer in self.channels.get(name, ()):
+            writer.write(encode_command('message', name, message))
+            receivers += 1
+        for pattern, writers in self.patterns.items():
+            if writers and fnmatch.fnmatchcase(name.decode(errors='replace'), pattern.decode(errors='replace')):
+                for writer in writers:
+                    writer.write(encode_command('pmessage', pattern, name, message))
+                    receivers += 1
+        return receivers
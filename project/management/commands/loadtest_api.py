@@ -0,0 +1,197 @@
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.urls import reverse
+
+from project.models import Project
+
+MODES = ('sync', 'async')
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+
+async def _request(reader, writer, raw):
+    writer.write(raw)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    body = await reader.readexactly(length) if length else b''
+    return status, body
+
+
+async def _client(host, port, raw, deadline, measure_from, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                status, _ = await _request(reader, writer, raw)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                statuses['error'] = statuses.get('error', 0) + 1
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            if started >= measure_from:
+                latencies.append(time.monotonic() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def _load(host, port, raw, clients, seconds, warmup):
+    start = time.monotonic()
+    measure_from = start + warmup
+    deadline = measure_from + seconds
+    latencies, statuses = [], {}
+    results = await asyncio.gather(
+        *(_client(host, port, raw, deadline, measure_from, latencies, statuses) for _ in range(clients)),
+        return_exceptions=True,
+    )
+    failed = [result for result in results if isinstance(result, Exception)]
+    return latencies, statuses, failed
+
+
+async def _fetch_once(host, port, raw):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return await _request(reader, writer, raw)
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the task list and team member lookup APIs under uvicorn, once with the sync "
+        "views and once with the async ones (PROJECT_ASYNC_API), with N concurrent keep-alive "
+        "clients, and report requests/s and latency percentiles. Needs uvicorn."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Staff username the requests are made as.')
+        parser.add_argument('--project', type=int, help='Project ID (default: the one with the most tasks).')
+        parser.add_argument('--endpoint', choices=('tasks', 'team-members'), action='append', help='Endpoint(s) to test (default both).')
+        parser.add_argument('--mode', choices=MODES, action='append', help='View flavour(s) to test (default both).')
+        parser.add_argument('--clients', type=int, default=500, help='Concurrent clients.')
+        parser.add_argument('--seconds', type=float, default=15, help='Measured duration of each run.')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before measuring.')
+        parser.add_argument('--port', type=int, default=8765)
+        # Internal: run the server of one mode (started by the load test itself)
+        parser.add_argument('--serve', choices=MODES, help='Run uvicorn with the given views instead of testing.')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('The load test needs uvicorn: pip install uvicorn')
+
+        if options['serve']:
+            # Before the URLconf is loaded, it picks the views from the setting
+            settings.PROJECT_ASYNC_API = options['serve'] == 'async'
+            # Under ASGI every request runs its sync code in a thread of its own, persistent
+            # connections would pile up per thread
+            for alias in connections:
+                connections.settings[alias]['CONN_MAX_AGE'] = 0
+            from django.core.asgi import get_asgi_application
+            uvicorn.run(get_asgi_application(), host='127.0.0.1', port=options['port'], log_level='warning', lifespan='off')
+            return
+
+        if not options['user']:
+            raise CommandError('Give the --user to make the requests as.')
+        try:
+            user = User.objects.get(username=options['user'], is_staff=True, is_active=True)
+        except User.DoesNotExist:
+            raise CommandError(f"No active staff user {options['user']}")
+        project_id = options['project'] or self.busiest_project()
+        if project_id is None:
+            raise CommandError('No project to query, create one first.')
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session_key = self.login(session, user)
+        paths = {
+            'tasks': reverse('get_tasks_for_project', args=[project_id]),
+            'team-members': reverse('admin:fetch-team-members') + f'?project_id={project_id}',
+        }
+        endpoints = options['endpoint'] or list(paths)
+        try:
+            bodies = {}
+            for mode in options['mode'] or MODES:
+                server = self.start_server(mode, options['port'])
+                try:
+                    for endpoint in endpoints:
+                        raw = (
+                            f"GET {paths[endpoint]} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                            f"Cookie: {settings.SESSION_COOKIE_NAME}={session_key}\r\n\r\n"
+                        ).encode()
+                        status, body = asyncio.run(_fetch_once('127.0.0.1', options['port'], raw))
+                        if status != 200:
+                            raise CommandError(f'{mode} {endpoint}: HTTP {status}, {body[:200]!r}')
+                        bodies.setdefault(endpoint, {})[mode] = json.loads(body)
+                        self.report(mode, endpoint, options, asyncio.run(_load(
+                            '127.0.0.1', options['port'], raw, options['clients'], options['seconds'], options['warmup'],
+                        )))
+                finally:
+                    server.terminate()
+                    server.wait(10)
+        finally:
+            session.delete()
+
+        for endpoint, by_mode in bodies.items():
+            if len(set(json.dumps(body, sort_keys=True) for body in by_mode.values())) > 1:
+                self.stderr.write(f'{endpoint}: the sync and async responses differ!')
+
+    def busiest_project(self):
+        project = Project.objects.annotate(task_count=Count('task')).order_by('-task_count').first()
+        return project.pk if project else None
+
+    def login(self, session, user):
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def start_server(self, mode, port):
+        # A process per mode: the URLconf (and so the views) is chosen once, when it is loaded
+        command = [sys.executable, '-m', 'django', 'loadtest_api', '--serve', mode, '--port', str(port)]
+        server = subprocess.Popen(command)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    raise CommandError(f'The {mode} server exited with {server.returncode}')
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'The {mode} server did not start')
+
+    def report(self, mode, endpoint, options, result):
+        latencies, statuses, failed = result
+        latencies.sort()
+        ok = statuses.get(200, 0) + statuses.get(304, 0)
+        others = {status: count for status, count in statuses.items() if status not in (200, 304)}
+        self.stdout.write(
+            f"{mode:<6} {endpoint:<13} {options['clients']} clients: {ok / options['seconds']:8.0f} req/s  "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms"
+            + (f'  other responses {others}' if others else '')
+            + (f'  {len(failed)} clients failed' if failed else '')
+        )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from project.previews import backfill_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = "Generate the pending attachment thumbnails and text previews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Jobs run per pass (default 100).')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new jobs.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop (default 5).')
+        parser.add_argument('--backfill', action='store_true', help='First create the jobs of blobs that have none.')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f'{backfill_jobs()} jobs created.')
+
+        while True:
+            done, failed = run_jobs(options['limit'])
+            if done or failed:
+                self.stdout.write(f'{done} previews generated, {failed} failed.')
+            if not options['loop']:
+                break
+            if done + failed < options['limit']:
+                time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from project.uploads import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete chunked uploads (and their partial files) that have not received a chunk for a while."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help='Age in hours of the last chunk (default 24).')
+
+    def handle(self, *args, **options):
+        count = purge_stale_uploads(timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f'{count} stale uploads deleted.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from project.search import SEARCH_INDEXES
+
+
+class Command(BaseCommand):
+    help = "Re-index all tasks and comments in the FTS5 full-text search tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help=f"Indexes to rebuild: {', '.join(sorted(SEARCH_INDEXES))} (default all).")
+
+    def handle(self, *args, **options):
+        unknown = set(options['models']) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f"Unknown index: {', '.join(sorted(unknown))}")
+
+        for name in options['models'] or sorted(SEARCH_INDEXES):
+            index = SEARCH_INDEXES[name]
+            if not index.available():
+                raise CommandError('Full-text search needs the SQLite database backend.')
+            self.stdout.write(f'{name}: {index.rebuild()} rows')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
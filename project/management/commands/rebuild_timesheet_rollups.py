@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from project.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the task, project, user-day and ISO week hour rollups from all TimeSheet entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert (default 1000).')
+
+    def handle(self, *args, **options):
+        counts = rebuild_rollups(batch_size=options['batch_size'])
+        for name, count in counts.items():
+            self.stdout.write(f'{name}: {count} rows')
+        self.stdout.write(self.style.SUCCESS('Timesheet rollups rebuilt.'))
@@ -0,0 +1,66 @@
+import sqlite3
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from project.replicas import replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        "Local stand-in for replication between two SQLite files: every --interval seconds "
+        "snapshot the default database and copy the snapshot taken --lag seconds earlier into "
+        "the replica (PROJECT_READ_REPLICA), so the replica trails the primary by the lag."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag', type=float, default=3, help='Seconds the replica trails the primary.')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds between snapshots.')
+        parser.add_argument('--once', action='store_true', help='Copy the primary to the replica once, without lag, and exit.')
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica configured, set PROJECT_READ_REPLICA to an alias of DATABASES.')
+        primary, replica = connections[DEFAULT_DB_ALIAS].settings_dict, connections[alias].settings_dict
+        if primary['ENGINE'] != 'django.db.backends.sqlite3' or replica['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Replication is only simulated between SQLite databases, use real replication for others.')
+        if str(primary['NAME']) == str(replica['NAME']):
+            raise CommandError('The replica must be a different file than the primary.')
+
+        if options['once']:
+            self.copy(self.snapshot(primary['NAME']), replica['NAME'])
+            self.stdout.write(self.style.SUCCESS('Replica updated.'))
+            return
+
+        # Snapshots in memory waiting for their turn: (taken at, connection)
+        pending = deque()
+        self.stdout.write(f"Replicating with {options['lag']}s lag, Ctrl+C to stop.")
+        try:
+            while True:
+                now = time.monotonic()
+                pending.append((now, self.snapshot(primary['NAME'])))
+                while pending and pending[0][0] <= now - options['lag']:
+                    taken_at, snapshot = pending.popleft()
+                    self.copy(snapshot, replica['NAME'])
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'Applied the snapshot of {now - taken_at:.1f}s ago.')
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def snapshot(self, path):
+        # The backup API copies a consistent state, even while the primary is written to
+        source = sqlite3.connect(path)
+        snapshot = sqlite3.connect(':memory:')
+        source.backup(snapshot)
+        source.close()
+        return snapshot
+
+    def copy(self, snapshot, path):
+        target = sqlite3.connect(path, timeout=30)
+        snapshot.backup(target)
+        target.close()
+        snapshot.close()
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from project.sqlite import journal_mode
+
+MODES = ('wal', 'delete', 'truncate', 'persist')
+
+
+class Command(BaseCommand):
+    help = (
+        "Show or change the journal mode stored in a SQLite database file. 'wal' lets readers "
+        "and the writer work concurrently (recommended for a served database, it keeps -wal and "
+        "-shm files next to it), 'delete' is SQLite's default single-file mode. Run it while no "
+        "other process uses the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?', choices=MODES, help='Journal mode to set (default: show the current one).')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"{options['database']} is not a SQLite database.")
+
+        with connection.cursor() as cursor:
+            current = journal_mode(cursor)
+            if options['mode'] and options['mode'] != current:
+                cursor.execute(f"PRAGMA journal_mode = {options['mode']}")
+                current = cursor.fetchone()[0].lower()
+                if current != options['mode']:
+                    raise CommandError(f"SQLite kept the journal mode {current}, is the database in use?")
+        self.stdout.write(f"{options['database']}: journal mode {current}")
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Frozen copy of Task.STATUS_RANKS at the time of this migration
+STATUS_RANKS = {
+    'New': 1,
+    'Reopened': 2,
+    'Inprogress': 3,
+    'Resolved': 4,
+    'closed': 5,
+}
+
+
+def backfill_status_rank(apps, schema_editor):
+    Task = apps.get_model('project', 'Task')
+    for status, rank in STATUS_RANKS.items():
+        Task.objects.filter(status=status).update(status_rank=rank)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0010_admin_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='status_rank',
+            field=models.PositiveSmallIntegerField(default=999, editable=False),
+        ),
+        migrations.RunPython(backfill_status_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status_rank', 'id'], name='task_status_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assigned_to', 'status_rank', 'id'], name='task_assignee_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0011_task_status_rank'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timesheet',
+            index=models.Index(fields=['date', 'id'], name='timesheet_date_idx'),
+        ),
+    ]
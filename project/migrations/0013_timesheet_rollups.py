@@ -0,0 +1,69 @@
+# Generated by Django 5.1.15 on 2026-10-18 14:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0012_timesheet_date_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectHours',
+            fields=[
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hours_rollup', serialize=False, to='project.project')),
+            ],
+            options={
+                'verbose_name_plural': 'project hours',
+            },
+        ),
+        migrations.CreateModel(
+            name='TaskHours',
+            fields=[
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='hours_rollup', serialize=False, to='project.task')),
+            ],
+            options={
+                'verbose_name_plural': 'task hours',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserDayHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('day', models.DateField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_hours', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'user day hours',
+                'constraints': [models.UniqueConstraint(fields=('user', 'day'), name='user_day_hours_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeekHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('iso_year', models.PositiveSmallIntegerField()),
+                ('iso_week', models.PositiveSmallIntegerField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='week_hours', to='project.project')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='week_hours', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'week hours',
+                'indexes': [models.Index(fields=['user', 'iso_year', 'iso_week'], name='week_hours_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('project', 'user', 'iso_year', 'iso_week'), name='week_hours_unique')],
+            },
+        ),
+    ]
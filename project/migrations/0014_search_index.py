@@ -0,0 +1,44 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:05
+
+from django.db import migrations
+
+# Frozen copy of the FTS5 tables of project.search at the time of this migration:
+# table: (indexed table, columns, default rank function weighting title matches higher)
+SEARCH_TABLES = {
+    'project_task_fts': ('project_task', ['title', 'description', 'steps_to_reproduce', 'environment'], 'bm25(10.0, 1.0, 1.0, 1.0)'),
+    'project_comment_fts': ('project_comment', ['title', 'content'], 'bm25(5.0, 1.0)'),
+}
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only, other backends keep the admin's LIKE search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, (source, columns, rank) in SEARCH_TABLES.items():
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}" USING fts5('
+            f"{', '.join(columns)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        values = ', '.join(f"COALESCE(\"{column}\", '')" for column in columns)
+        schema_editor.execute(
+            f'INSERT INTO "{table}" (rowid, {", ".join(columns)}) SELECT "id", {values} FROM "{source}"'
+        )
+        schema_editor.execute(f'INSERT INTO "{table}" ("{table}", rank) VALUES (\'rank\', \'{rank}\')')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in SEARCH_TABLES:
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0013_timesheet_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,17 +1,63 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+from django.db.models.lookups import Exact
+
+from .roles import DEVELOPER, get_user_roles
+from .storage import attachment_storage
 
 # Create your models here.
 
+class ExplicitDatesMixin:
+    """
+    An auto_now/auto_now_add field that keeps the date already set on a new
+    object marked by ``keep_dates()``, so bulk_create can store imported or
+    generated dates. The mark is on the objects, other saves are unaffected.
+    """
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        if add and value is not None and getattr(model_instance, '_keep_dates', False):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def deconstruct(self):
+        # The column is the plain field's: migrations keep it, no table is rebuilt
+        name, _, args, kwargs = super().deconstruct()
+        return name, self.plain_path, args, kwargs
+
+
+class AutoDateField(ExplicitDatesMixin, models.DateField):
+    plain_path = 'django.db.models.DateField'
+
+
+class AutoDateTimeField(ExplicitDatesMixin, models.DateTimeField):
+    plain_path = 'django.db.models.DateTimeField'
+
+
+def keep_dates(objs):
+    """Mark new objects whose auto_now/auto_now_add dates are set, for bulk_create; returns them."""
+    objs = list(objs)
+    for obj in objs:
+        obj._keep_dates = True
+    return objs
+
+
 class Master(models.Model):
-    created_at = models.DateField(auto_now_add=True)
-    updated_at = models.DateField(auto_now=True)
+    created_at = AutoDateField(auto_now_add=True)
+    updated_at = AutoDateField(auto_now=True)
     is_active = models.BooleanField(default=True, verbose_name='Active')
     created_user = models.ForeignKey(User, null=True,blank=True, on_delete=models.CASCADE,related_name="%(class)s_created")
     
     class Meta:
         abstract = True
         ordering = ['is_active']
+        indexes = [
+            # Default changelist ordering (is_active, -pk)
+            models.Index(fields=['is_active', '-id'], name='%(app_label)s_%(class)s_active_idx'),
+        ]
 
 
 PRIORITY_CHOICES = [
@@ -22,6 +68,17 @@ PRIORITY_CHOICES = [
 
 
 
+class ProjectQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """Projects where the user is part of the team or the creator (all projects for superusers)."""
+        if user.is_superuser:
+            return self
+
+        # EXISTS instead of joining the team table, so no DISTINCT is needed
+        membership = Project.team.through.objects.filter(project_id=OuterRef('pk'), user_id=user.pk)
+        return self.filter(Exists(membership) | Q(created_user=user))
+
+
 class Project(Master):
     STATUS_CHOICES = [
         ('New', 'New'),
@@ -37,10 +94,57 @@ class Project(Master):
     priority = models.CharField(max_length=50, choices=PRIORITY_CHOICES, default='Low')
     team = models.ManyToManyField(User,blank=True)
 
+    objects = ProjectQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
 
+class TaskQuerySet(models.QuerySet):
+    """Keeps the stored ``status_rank`` in sync for bulk writes that bypass ``Task.save``."""
+
+    def visible_to(self, user):
+        """
+        Tasks the user may see: all for superusers, the assigned ones for
+        developers, otherwise tasks of the user's projects or created by them.
+        """
+        if user.is_superuser:
+            return self
+
+        if DEVELOPER in get_user_roles(user):
+            return self.filter(assigned_to=user)
+
+        membership = Project.team.through.objects.filter(project_id=OuterRef('project_id'), user_id=user.pk)
+        return self.filter(Exists(membership) | Q(created_user=user))
+
+    def update(self, **kwargs):
+        if 'status' in kwargs and 'status_rank' not in kwargs:
+            kwargs['status_rank'] = Task.status_rank_for(kwargs['status'])
+        return super().update(**kwargs)
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.status_rank = Task.status_rank_for(obj.status)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    bulk_create.alters_data = True
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        fields = list(fields)
+        if 'status' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.status_rank = Task.status_rank_for(obj.status)
+            if 'status_rank' not in fields:
+                fields.append('status_rank')
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    bulk_update.alters_data = True
+
+
 class Task(Master):
     STATUS_CHOICES = [
         ('New', 'New'),
@@ -50,6 +154,15 @@ class Task(Master):
         ('closed', 'closed')
 
     ]
+    # Sort order of the statuses in the task changelist
+    STATUS_RANKS = {
+        'New': 1,
+        'Reopened': 2,
+        'Inprogress': 3,
+        'Resolved': 4,
+        'closed': 5,
+    }
+    UNKNOWN_STATUS_RANK = 999
     TRACKER_CHOICES = [
         ('Task', 'Task'),
         ('Bug', 'Bug'),
@@ -84,28 +197,151 @@ class Task(Master):
     due_date = models.DateField(blank=True,null=True)
     steps_to_reproduce = models.TextField(blank=True)
     environment = models.TextField(blank=True)
+    status_rank = models.PositiveSmallIntegerField(default=UNKNOWN_STATUS_RANK, editable=False)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta(Master.Meta):
+        indexes = Master.Meta.indexes + [
+            # Developer visibility (assigned_to=user) filtered by status
+            models.Index(fields=['assigned_to', 'status'], name='task_assignee_status_idx'),
+            # Tasks of a project by status (project changelist filter, task lookups)
+            models.Index(fields=['project', 'status'], name='task_project_status_idx'),
+            # Active tasks of a project by title (tasks-by-project lookups)
+            models.Index(fields=['project', 'title'], condition=models.Q(is_active=True), name='task_active_project_idx'),
+            # Changelist ordering, for everyone and for developers (assigned_to=user)
+            models.Index(fields=['status_rank', 'id'], name='task_status_rank_idx'),
+            models.Index(fields=['assigned_to', 'status_rank', 'id'], name='task_assignee_rank_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def status_rank_for(cls, status):
+        """Return the rank of a status value, or a Case expression when ``status`` is an expression."""
+        if hasattr(status, 'resolve_expression'):
+            return Case(
+                *[When(Exact(status, Value(name)), then=Value(rank)) for name, rank in cls.STATUS_RANKS.items()],
+                default=Value(cls.UNKNOWN_STATUS_RANK),
+            )
+        return cls.STATUS_RANKS.get(status, cls.UNKNOWN_STATUS_RANK)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored project, so the caches of the previous project are invalidated on reassign
+        instance._loaded_project_id = instance.__dict__.get('project_id')
+        # And the status and assignee, to tell which of them a save changed (live events)
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_assigned_to_id = instance.__dict__.get('assigned_to_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.status_rank = self.status_rank_for(self.status)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' in update_fields and 'status_rank' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'status_rank']
+        super().save(*args, **kwargs)
+
+
+def task_date_errors(start_date, due_date, project):
+    """Return the messages of the task date rules: within the project's window and start <= due."""
+    errors = []
+    if start_date and project and project.start_date and start_date < project.start_date:
+        errors.append(f"Task start date cannot be earlier than the project's start date ({project.start_date}).")
+
+    if due_date and project and project.end_date and due_date > project.end_date:
+        errors.append(f"Task due date cannot be later than the project's end date ({project.end_date}).")
+
+    # Ensure start_date is not later than due_date
+    if start_date and due_date and start_date > due_date:
+        errors.append("Start date cannot be later than due date.")
+
+    return errors
+
 
 class Comment(Master):
     title = models.CharField(max_length=200, null=True)
     task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='comment')
     content = models.TextField()
 
+    class Meta(Master.Meta):
+        indexes = Master.Meta.indexes + [
+            models.Index(fields=['task', 'created_user'], name='comment_task_user_idx'),
+        ]
+
     def __str__(self):
         return self.title if self.title else "No Title"
 
 
 class File(Master):
     name = models.CharField(max_length=50)
-    file = models.FileField(upload_to='media/files', max_length=200)
+    file = models.FileField(upload_to='media/files', max_length=200, storage=attachment_storage)
     task = models.ForeignKey(Task, on_delete=models.CASCADE, null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stored name as loaded, to release the blob it referenced when the file is replaced
+        instance._loaded_file_name = instance.__dict__.get('file')
+        return instance
+
     def __str__(self):
         return self.name
-    
+
+
+class Blob(models.Model):
+    """A unique attachment content in the content-addressed storage, with the number of Files using it."""
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refs = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
+
+class PreviewJob(models.Model):
+    """Thumbnail / text preview generation of a blob, see project.previews."""
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    blob = models.OneToOneField(Blob, on_delete=models.CASCADE, primary_key=True, related_name='preview_job')
+    # Name of a file with this content, its extension decides the kind of preview
+    filename = models.CharField(max_length=200)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    has_thumbnail = models.BooleanField(default=False)
+    has_preview = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='preview_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.blob_id} ({self.status})'
+
+
+class UploadSession(models.Model):
+    """A chunked upload of a task attachment in progress, see project.uploads."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='upload_sessions')
+    name = models.CharField(max_length=50)
+    filename = models.CharField(max_length=200)
+    size = models.PositiveBigIntegerField()
+    # Bytes received so far, the offset of the next chunk
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
 
 
 class TimeSheet(Master):
@@ -113,8 +349,83 @@ class TimeSheet(Master):
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
     
     
-    date = models.DateTimeField(auto_now_add=True)
+    date = AutoDateTimeField(auto_now_add=True)
     hours = models.DecimalField(max_digits=5, decimal_places=2)
     description = models.TextField()
 
- 
\ No newline at end of file
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values, so the rollups can subtract them when the entry changes
+        instance._rollup_snapshot = rollup_key(instance)
+        return instance
+
+    class Meta(Master.Meta):
+        indexes = Master.Meta.indexes + [
+            models.Index(fields=['project', 'task', 'date'], name='timesheet_project_task_idx'),
+            # Changelist ordering (-date, -id)
+            models.Index(fields=['date', 'id'], name='timesheet_date_idx'),
+        ]
+
+
+#-----------------------Timesheet rollups-----------------------------
+# Hour totals maintained incrementally from TimeSheet saves and deletes
+# (see project.rollups); `rebuild_timesheet_rollups` recomputes them.
+
+def rollup_key(timesheet):
+    """The values of a timesheet entry that its rollup rows depend on, None if any is not loaded."""
+    values = timesheet.__dict__
+    fields = ('task_id', 'project_id', 'created_user_id', 'date', 'hours')
+    if any(field not in values for field in fields) or values['date'] is None or values['hours'] is None:
+        return None
+    return tuple(values[field] for field in fields)
+
+
+class HoursRollup(models.Model):
+    hours = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    entries = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class TaskHours(HoursRollup):
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, primary_key=True, related_name='hours_rollup')
+
+    class Meta:
+        verbose_name_plural = 'task hours'
+
+
+class ProjectHours(HoursRollup):
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, primary_key=True, related_name='hours_rollup')
+
+    class Meta:
+        verbose_name_plural = 'project hours'
+
+
+class UserDayHours(HoursRollup):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='day_hours')
+    day = models.DateField()
+
+    class Meta:
+        verbose_name_plural = 'user day hours'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='user_day_hours_unique'),
+        ]
+
+
+class WeekHours(HoursRollup):
+    """Hours per project, user and ISO week."""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='week_hours')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='week_hours')
+    iso_year = models.PositiveSmallIntegerField()
+    iso_week = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name_plural = 'week hours'
+        constraints = [
+            models.UniqueConstraint(fields=['project', 'user', 'iso_year', 'iso_week'], name='week_hours_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'iso_year', 'iso_week'], name='week_hours_user_idx'),
+        ]
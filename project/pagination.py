@@ -0,0 +1,156 @@
+"""
+Keyset (cursor) pagination for admin changelists.
+
+OFFSET pagination reads and throws away every row before the requested page
+and counts the whole filtered set on each load. In keyset mode the changelist
+instead remembers the ordering key of the first/last row shown and asks for
+the rows after (or before) it, which an index on the ordering fields serves
+at the same cost on every page. Counting can be capped as well
+(``PROJECT_CHANGELIST_COUNT_CAP``), so the total shown is exact up to the cap
+and an estimated "N+" beyond it.
+"""
+import base64
+import json
+
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+CURSOR_VAR = 'cursor'
+
+
+def _cursor_value(value):
+    # Full isoformat, DjangoJSONEncoder would cut datetimes to milliseconds
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], default=_cursor_value)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, fields, token):
+    """Return ``(direction, values)`` of a cursor token, or None when it is invalid."""
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, values = json.loads(payload)
+        if direction not in ('after', 'before') or len(values) != len(fields):
+            return None
+        return direction, [
+            model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(fields, values)
+        ]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def keyset_filter(fields, values, reverse=False):
+    """
+    Q matching the rows that come after ``values`` in the ``fields`` ordering
+    (before them when ``reverse``).
+
+    Written as ``a >= x AND (a > x OR (b > y))`` rather than a flat OR, so the
+    database can seek an index on the ordering fields with the first condition.
+    """
+    name = fields[0].lstrip('-')
+    descending = fields[0].startswith('-') != reverse
+    after = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[0]})
+    if len(fields) == 1:
+        return after
+    from_value = Q(**{f"{name}__{'lte' if descending else 'gte'}": values[0]})
+    return from_value & (after | keyset_filter(fields[1:], values[1:], reverse))
+
+
+def reverse_ordering(fields):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in fields]
+
+
+class KeysetChangeList(ChangeList):
+    """ChangeList that pages with a cursor over the admin's ordering."""
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_queryset(self, request, exclude_parameters=None):
+        # Keep the cursor out of the filters and out of the links built from self.params
+        if CURSOR_VAR in self.params:
+            self.cursor = self.params.pop(CURSOR_VAR)
+            self.filter_params.pop(CURSOR_VAR, None)
+        return super().get_queryset(request, exclude_parameters)
+
+    @property
+    def keyset(self):
+        # Sorting by a column header or by full-text search rank falls back to the regular paginator
+        return ORDER_VAR not in self.params and 'search_rank' not in self.queryset.query.annotations
+
+    def get_results(self, request):
+        self.keyset_previous_url = self.keyset_next_url = self.keyset_first_url = None
+        self.result_count_is_estimate = False
+        if not self.keyset:
+            return super().get_results(request)
+
+        fields = list(self.model_admin.get_ordering(request))
+        queryset = self.queryset.order_by(*fields)
+        cursor = decode_cursor(self.model, fields, getattr(self, 'cursor', ''))
+
+        if cursor and cursor[0] == 'before':
+            rows = list(
+                queryset.order_by(*reverse_ordering(fields))
+                .filter(keyset_filter(fields, cursor[1], reverse=True))[:self.list_per_page + 1]
+            )
+            has_previous, has_next = len(rows) > self.list_per_page, True
+            result_list = rows[:self.list_per_page][::-1]
+        else:
+            if cursor:
+                queryset = queryset.filter(keyset_filter(fields, cursor[1]))
+            rows = list(queryset[:self.list_per_page + 1])
+            has_previous, has_next = cursor is not None, len(rows) > self.list_per_page
+            result_list = rows[:self.list_per_page]
+
+        if result_list:
+            key = lambda obj: [getattr(obj, field.lstrip('-')) for field in fields]
+            if has_previous:
+                self.keyset_previous_url = self.get_query_string({CURSOR_VAR: encode_cursor('before', key(result_list[0]))})
+                self.keyset_first_url = self.get_query_string()
+            if has_next:
+                self.keyset_next_url = self.get_query_string({CURSOR_VAR: encode_cursor('after', key(result_list[-1]))})
+
+        cap = self.model_admin.get_keyset_count_cap(request)
+        if cap:
+            # Count at most `cap` rows, the total is shown as "cap+" beyond that
+            result_count = self.queryset.order_by()[:cap + 1].count()
+            self.result_count_is_estimate = result_count > cap
+            result_count = min(result_count, cap)
+        else:
+            result_count = self.queryset.count()
+
+        self.result_count = result_count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = bool(result_list)
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_previous or has_next
+        self.paginator = None
+
+
+class KeysetPaginationMixin:
+    """
+    ModelAdmin mixin switching the changelist to keyset pagination.
+
+    The admin ``ordering`` is the keyset: it must end with the primary key and
+    should be backed by an index. The page is a list rather than a queryset,
+    so ``list_editable`` is not supported.
+    """
+    change_list_template = 'admin/project/keyset_change_list.html'
+
+    def get_keyset_count_cap(self, request):
+        """Number of rows counted at most, None for an exact count (PROJECT_CHANGELIST_COUNT_CAP)."""
+        return getattr(settings, 'PROJECT_CHANGELIST_COUNT_CAP', None)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,186 @@
+"""
+Background thumbnail and text preview generation for attachments.
+
+A PreviewJob row is created for every new blob. How it runs depends on
+``PROJECT_PREVIEW_WORKER``:
+
+- ``'pool'`` (default): after the upload's transaction commits, the job is handed to a
+  local process pool. The worker process only renders the derivatives from
+  the blob path (project.derivatives); the job row is updated in the parent
+  when it finishes. Nothing waits for it in the request.
+- ``'queue'``: jobs wait in the table for ``process_preview_jobs`` (run from
+  cron or as a long-running ``--loop`` worker).
+
+Both claim a job with a conditional UPDATE, so a job runs once even with
+several workers. Jobs of a crashed worker are retried once they are stale.
+The derivatives are stored next to the blob and shared by every File with
+that content.
+"""
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Substr
+from django.utils import timezone
+
+from .derivatives import PREVIEW_SUFFIX, THUMBNAIL_SUFFIX, render_derivatives
+from .models import Blob, File, PreviewJob
+from .storage import CAS_PREFIX, digest_of
+
+MAX_ATTEMPTS = 3
+# A running job not finished after this long is assumed lost (worker crashed) and retried
+STALE_AFTER = timedelta(minutes=15)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _storage():
+    return File._meta.get_field('file').storage
+
+
+def blob_path(digest):
+    storage = _storage()
+    return storage.path(storage.blob_name(digest))
+
+
+def worker_mode():
+    return getattr(settings, 'PROJECT_PREVIEW_WORKER', 'pool')
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the workers start clean, without the parent's threads and database connections
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'PROJECT_PREVIEW_POOL_SIZE', 2),
+                mp_context=get_context('spawn'),
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def enqueue_preview(blob, filename):
+    """Create the preview job of a new blob and, in pool mode, start it after commit."""
+    PreviewJob.objects.get_or_create(blob=blob, defaults={'filename': filename})
+    if worker_mode() == 'pool':
+        transaction.on_commit(lambda: _submit(blob.pk))
+
+
+def _claim(queryset):
+    """Mark the jobs of ``queryset`` running, returns the claimed jobs' (digest, filename)."""
+    claimed = []
+    for digest, filename, attempts in queryset.values_list('blob_id', 'filename', 'attempts'):
+        updated = PreviewJob.objects.filter(pk=digest, attempts=attempts).exclude(status=PreviewJob.DONE).update(
+            status=PreviewJob.RUNNING, attempts=attempts + 1, updated_at=timezone.now(),
+        )
+        if updated:
+            claimed.append((digest, filename))
+    return claimed
+
+
+def runnable_jobs():
+    """
+    Pending jobs, failed ones with attempts left and stale running ones. Stale
+    jobs without attempts left are marked failed, they would show as running
+    forever.
+    """
+    now = timezone.now()
+    stale = now - STALE_AFTER
+    PreviewJob.objects.filter(status=PreviewJob.RUNNING, updated_at__lt=stale, attempts__gte=MAX_ATTEMPTS).update(
+        status=PreviewJob.FAILED, error='The worker did not finish the job.', updated_at=now,
+    )
+    return PreviewJob.objects.filter(
+        Q(status=PreviewJob.PENDING)
+        | Q(status=PreviewJob.FAILED, attempts__lt=MAX_ATTEMPTS)
+        | Q(status=PreviewJob.RUNNING, updated_at__lt=stale, attempts__lt=MAX_ATTEMPTS)
+    ).order_by('created_at')
+
+
+def _finish(digest, result=None, error=None):
+    fields = {'updated_at': timezone.now()}
+    if error is None:
+        fields.update(status=PreviewJob.DONE, has_thumbnail=result[0], has_preview=result[1], error='')
+    else:
+        fields.update(status=PreviewJob.FAILED, error=error)
+    PreviewJob.objects.filter(pk=digest).update(**fields)
+
+
+def _submit(digest):
+    for digest, filename in _claim(PreviewJob.objects.filter(pk=digest)):
+        future = _get_pool().submit(render_derivatives, blob_path(digest), filename)
+        future.add_done_callback(lambda future, digest=digest: _pool_done(digest, future))
+
+
+def _pool_done(digest, future):
+    # Record the result from a thread of its own (and so with its own database connection):
+    # the callback runs in the pool's management thread, or in the caller's if already done
+    threading.Thread(target=_record_result, args=(digest, future), daemon=True).start()
+
+
+def _record_result(digest, future):
+    try:
+        error = future.exception()
+        if error is None:
+            _finish(digest, future.result())
+        else:
+            _finish(digest, error=f'{type(error).__name__}: {error}')
+    finally:
+        connection.close()
+
+
+def run_jobs(limit=100):
+    """Claim and run up to ``limit`` runnable jobs in this process, returns ``(done, failed)``."""
+    done = failed = 0
+    for digest, filename in _claim(runnable_jobs()[:limit]):
+        close_old_connections()
+        try:
+            result = render_derivatives(blob_path(digest), filename)
+        except Exception as e:
+            # Any error of a broken or unsupported file fails the job, not the worker
+            _finish(digest, error=f'{type(e).__name__}: {e}')
+            failed += 1
+        else:
+            _finish(digest, result)
+            done += 1
+    return done, failed
+
+
+def backfill_jobs():
+    """Create the missing jobs of existing blobs (e.g. after dedupe_attachments), returns how many."""
+    missing = Blob.objects.filter(preview_job__isnull=True)
+    names = {}
+    for name in File.objects.filter(file__startswith=CAS_PREFIX).values_list('file', flat=True).iterator():
+        names.setdefault(digest_of(name), name.rsplit('/', 1)[-1])
+    jobs = [PreviewJob(blob_id=digest, filename=names.get(digest, '')) for digest in missing.values_list('pk', flat=True)]
+    PreviewJob.objects.bulk_create(jobs, ignore_conflicts=True)
+    return len(jobs)
+
+
+def with_preview_status(queryset):
+    """Annotate Files with ``preview_status``, ``preview_thumbnail`` and ``preview_text`` of their blob's job."""
+    jobs = PreviewJob.objects.filter(pk=Substr(OuterRef('file'), len(CAS_PREFIX) + 1, 64))
+    return queryset.annotate(
+        preview_status=Subquery(jobs.values('status')[:1]),
+        preview_thumbnail=Subquery(jobs.values('has_thumbnail')[:1]),
+        preview_text=Subquery(jobs.values('has_preview')[:1]),
+    )
+
+
+def thumbnail_path(digest):
+    return blob_path(digest) + THUMBNAIL_SUFFIX
+
+
+def read_preview(digest, limit=None):
+    """The text preview of a blob, None when there is none."""
+    try:
+        with open(blob_path(digest) + PREVIEW_SUFFIX, encoding='utf-8', errors='replace') as preview:
+            return preview.read(limit) if limit else preview.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,328 @@
+"""
+Sampled request profiling: wall time, queries and cache lookups per view.
+
+ProfilingMiddleware records a random ``PROJECT_PROFILE_SAMPLE_RATE`` share
+of the requests. For those it counts the queries of every database
+connection (also from the threads async views run their ORM calls in) with
+their time, finds repeated ones (the same SQL and parameters: duplicates;
+the same SQL with other parameters: similar, the N+1 pattern) and counts
+the cache lookups that found a value. Each sampled request becomes one JSON
+line of a rotating log file, which the staff profile report ranks by view.
+
+Requests that are not sampled only draw a random number, and the hooks on
+queries and cache lookups check a context variable and return. With a rate
+of 0 (the default) the middleware removes itself and no hook is installed.
+"""
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Repeated statements listed per logged request at most, and characters kept of their SQL
+TOP_REPEATED = 5
+SQL_CHARS = 300
+
+_profile = ContextVar('project_request_profile', default=None)
+_missing = object()
+
+
+def sample_rate():
+    return getattr(settings, 'PROJECT_PROFILE_SAMPLE_RATE', 0) or 0
+
+
+def log_path():
+    return Path(getattr(settings, 'PROJECT_PROFILE_LOG', None) or Path(settings.BASE_DIR) / 'logs' / 'profile.jsonl')
+
+
+class RequestProfile:
+    """What one sampled request did."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Nested cache calls (get_many implemented with get) are counted once
+        self.cache_depth = 0
+        self.lock = threading.Lock()
+
+    def record_query(self, sql, params, elapsed):
+        with self.lock:
+            self.queries += 1
+            self.db_time += elapsed
+            self.statements[sql, repr(params)] += 1
+
+    def repeated(self):
+        """(duplicate count, similar count, [(sql, executions)] of the most repeated SQL)."""
+        by_sql = Counter()
+        duplicates = 0
+        for (sql, _), count in self.statements.items():
+            by_sql[sql] += count
+            duplicates += count - 1
+        similar = sum(count - 1 for count in by_sql.values()) - duplicates
+        top = [(sql, count) for sql, count in by_sql.most_common(TOP_REPEATED) if count > 1]
+        return duplicates, similar, top
+
+
+#-----------------------Hooks-----------------------------------------
+
+def record_queries(execute, sql, params, many, context):
+    """Database execute wrapper: times the query for the sampled request, if any."""
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record_query(sql, params, time.perf_counter() - started)
+
+
+def install_query_recorder(connection):
+    """Add the query hook to a new connection (connection_created) while profiling is on."""
+    if sample_rate() and record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def _counted_get(get):
+    @functools.wraps(get)
+    def wrapper(self, key, default=None, version=None):
+        profile = _profile.get()
+        if profile is None or profile.cache_depth:
+            return get(self, key, default, version)
+        profile.cache_depth += 1
+        try:
+            value = get(self, key, _missing, version)
+        finally:
+            profile.cache_depth -= 1
+        if value is _missing:
+            profile.cache_misses += 1
+            return default
+        profile.cache_hits += 1
+        return value
+    wrapper.profiled = True
+    return wrapper
+
+
+def _counted_get_many(get_many):
+    @functools.wraps(get_many)
+    def wrapper(self, keys, version=None):
+        profile = _profile.get()
+        if profile is None or profile.cache_depth:
+            return get_many(self, keys, version)
+        keys = list(keys)
+        profile.cache_depth += 1
+        try:
+            found = get_many(self, keys, version)
+        finally:
+            profile.cache_depth -= 1
+        profile.cache_hits += len(found)
+        profile.cache_misses += len(keys) - len(found)
+        return found
+    wrapper.profiled = True
+    return wrapper
+
+
+def install_cache_recorder():
+    """Count lookups of the configured cache backends (their async methods call these)."""
+    for alias in settings.CACHES:
+        backend = type(caches[alias])
+        if not getattr(backend.get, 'profiled', False):
+            backend.get = _counted_get(backend.get)
+        if not getattr(backend.get_many, 'profiled', False):
+            backend.get_many = _counted_get_many(backend.get_many)
+
+
+@contextmanager
+def profiled():
+    """Record the queries and cache lookups of the block (in this thread) into the yielded RequestProfile."""
+    install_cache_recorder()
+    profile = RequestProfile()
+    token = _profile.set(profile)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                if record_queries not in connection.execute_wrappers:
+                    stack.enter_context(connection.execute_wrapper(record_queries))
+            yield profile
+    finally:
+        _profile.reset(token)
+
+
+#-----------------------Log-------------------------------------------
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def profile_logger():
+    """The logger writing sampled requests as JSON lines to the rotating PROJECT_PROFILE_LOG."""
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            path = log_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, 'PROJECT_PROFILE_LOG_MAX_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'PROJECT_PROFILE_LOG_BACKUPS', 5),
+                encoding='utf-8',
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('project.profiling.requests')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+def profile_record(request, response, profile, elapsed):
+    match = getattr(request, 'resolver_match', None)
+    duplicates, similar, top = profile.repeated()
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'view': (match.view_name or match._func_path) if match else '<unresolved>',
+        'method': request.method,
+        'path': request.path,
+        'status': getattr(response, 'status_code', None),
+        'ms': round(elapsed * 1000, 2),
+        'queries': profile.queries,
+        'db_ms': round(profile.db_time * 1000, 2),
+        'duplicates': duplicates,
+        'similar': similar,
+        'repeated': [{'sql': sql[:SQL_CHARS], 'count': count} for sql, count in top],
+        'cache_hits': profile.cache_hits,
+        'cache_misses': profile.cache_misses,
+    }
+
+
+#-----------------------Middleware------------------------------------
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests (PROJECT_PROFILE_SAMPLE_RATE). Put it
+    first in MIDDLEWARE, so the time and queries of the others count too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.rate = sample_rate()
+        if not self.rate:
+            raise MiddlewareNotUsed
+        install_cache_recorder()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= self.rate:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.log(request, response, profile, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.rate:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+        self.log(request, response, profile, time.perf_counter() - started)
+        return response
+
+    def log(self, request, response, profile, elapsed):
+        # Streamed responses are timed until their first byte is ready
+        try:
+            profile_logger().info(json.dumps(profile_record(request, response, profile, elapsed)))
+        except OSError:
+            pass
+
+
+#-----------------------Report----------------------------------------
+
+def read_records(path=None):
+    """The logged requests, oldest first, from the log file and its rotated backups."""
+    path = Path(path or log_path())
+    # Backups are numbered from the newest (.1) on
+    backups = [file for file in path.parent.glob(path.name + '.*') if file.suffix[1:].isdigit()]
+    backups.sort(key=lambda file: int(file.suffix[1:]), reverse=True)
+    for file in [*backups, path]:
+        try:
+            with open(file, encoding='utf-8') as lines:
+                for line in lines:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, int(len(values) * fraction + 0.5) - 1))]
+
+
+def summarize(records):
+    """Per view: requests, wall time and query percentiles, DB time, repeated queries, cache hit rate."""
+    by_view = defaultdict(list)
+    for record in records:
+        by_view[record.get('view', '<unresolved>')].append(record)
+
+    rows = []
+    for view, entries in by_view.items():
+        times = sorted(entry['ms'] for entry in entries)
+        queries = sorted(entry['queries'] for entry in entries)
+        hits = sum(entry.get('cache_hits', 0) for entry in entries)
+        lookups = hits + sum(entry.get('cache_misses', 0) for entry in entries)
+        repeated = Counter()
+        for entry in entries:
+            for statement in entry.get('repeated', ()):
+                repeated[statement['sql']] += statement['count']
+        rows.append({
+            'view': view,
+            'requests': len(entries),
+            'p50': percentile(times, 0.50),
+            'p95': percentile(times, 0.95),
+            'p99': percentile(times, 0.99),
+            'queries': sum(queries) / len(queries),
+            'queries_p95': percentile(queries, 0.95),
+            'db_ms': sum(entry['db_ms'] for entry in entries) / len(entries),
+            'duplicates': sum(entry.get('duplicates', 0) for entry in entries) / len(entries),
+            'similar': sum(entry.get('similar', 0) for entry in entries) / len(entries),
+            'cache_hit_rate': hits / lookups if lookups else None,
+            'most_repeated': repeated.most_common(1)[0][0] if repeated else '',
+        })
+    return rows
@@ -0,0 +1,168 @@
+"""
+Read replica routing for changelists and reports.
+
+With ``PROJECT_READ_REPLICA`` set to a database alias, ReplicaRouter sends
+the reads made inside ``replica_reads()`` to it: admin changelists (GET,
+including their rendering), the timesheet hour reports and the admin
+exports. Everything else (forms, saves, the APIs) keeps reading the primary,
+so a replica that lags only delays what those pages show.
+
+Read-your-writes: a POST (or other unsafe request) pins the session to the
+primary for ``PROJECT_REPLICA_PIN_SECONDS``, longer than the expected lag,
+so the changelist shown after saving includes the change. Within a request,
+reads after a write go to the primary as well. Data put in versioned caches
+is read from the primary (``primary_reads()``), a stale replica read would
+otherwise stay cached under the new version.
+
+Locally the replica can be a second SQLite file kept up to date, with a
+delay, by the ``simulate_replication`` command.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_SESSION_KEY = '_replica_pinned_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Whether reads may use the replica, and {'pinned': bool} of the current request (None outside requests)
+_use_replica = ContextVar('project_use_replica', default=False)
+_request_state = ContextVar('project_replica_request', default=None)
+
+
+def replica_alias():
+    """The configured replica alias, None when there is none."""
+    alias = getattr(settings, 'PROJECT_READ_REPLICA', None)
+    return alias if alias and alias in connections.databases else None
+
+
+def pin_seconds():
+    return getattr(settings, 'PROJECT_REPLICA_PIN_SECONDS', 5)
+
+
+def read_alias():
+    """The alias reads of the current context go to."""
+    alias = replica_alias()
+    state = _request_state.get()
+    if alias and _use_replica.get() and not (state and state['pinned']):
+        return alias
+    return DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def on_replica(queryset):
+    """``queryset`` bound to the replica when allowed, for results read after the view returns (streaming)."""
+    with replica_reads():
+        return queryset.using(read_alias())
+
+
+def use_replica(view):
+    """Run a (non-streaming) view with its reads on the replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Reads inside replica_reads() go to PROJECT_READ_REPLICA, everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        # Later reads of the same request must see the write
+        state = _request_state.get()
+        if state is not None:
+            state['pinned'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets the schema from the primary
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Keeps a session on the primary for a while after it sent an unsafe request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        session = getattr(request, 'session', None) if replica_alias() else None
+        pinned = session is not None and session.get(PIN_SESSION_KEY, 0) > time.time()
+        token = _request_state.set({'pinned': pinned})
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if session is not None and request.method not in SAFE_METHODS:
+            session[PIN_SESSION_KEY] = time.time() + pin_seconds()
+        return response
+
+    async def __acall__(self, request):
+        # Same, without blocking the event loop on the session load
+        session = getattr(request, 'session', None) if replica_alias() else None
+        pinned = session is not None and await session.aget(PIN_SESSION_KEY, 0) > time.time()
+        token = _request_state.set({'pinned': pinned})
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if session is not None and request.method not in SAFE_METHODS:
+            await session.aset(PIN_SESSION_KEY, time.time() + pin_seconds())
+        return response
+
+
+class ReplicaReadsMixin:
+    """ModelAdmin mixin: the changelist page reads from the replica."""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method not in ('GET', 'HEAD'):
+            # Bulk actions and list_editable saves work on the primary
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            # A TemplateResponse runs the result queries while rendering, after the view returns
+            if hasattr(response, 'render'):
+                response.render()
+        return response
@@ -0,0 +1,104 @@
+"""
+Role resolution for the admin.
+
+A user's group names are loaded once per request and memoized on the user
+object, so the admin classes can ask role questions as often as they need
+without repeating the ``groups.filter(...).exists()`` query. Setting
+``PROJECT_ROLE_CACHE_TIMEOUT`` additionally keeps the roles in the cache
+across requests; the entry is dropped when the user's groups change.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .replicas import primary_reads
+
+PROJECT_MANAGER = 'Project Manager'
+PROJECT_LEAD = 'Project Lead'
+DEVELOPER = 'developer'
+TESTER = 'Testers'
+
+
+def _cache_key(user_id):
+    return f'project:roles:{user_id}'
+
+
+def get_user_roles(user):
+    """Return the set of group names of the user, loading them at most once."""
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, '_project_roles', None)
+    if roles is not None:
+        return roles
+
+    timeout = getattr(settings, 'PROJECT_ROLE_CACHE_TIMEOUT', 0)
+    if timeout:
+        roles = cache.get(_cache_key(user.pk))
+
+    if roles is None:
+        # Permissions follow the primary, never a lagging replica
+        with primary_reads():
+            roles = frozenset(user.groups.values_list('name', flat=True))
+        if timeout:
+            cache.set(_cache_key(user.pk), roles, timeout)
+
+    user._project_roles = roles
+    return roles
+
+
+async def aget_user_roles(user):
+    """get_user_roles for async views (async cache and ORM)."""
+    if not user.is_authenticated:
+        return frozenset()
+
+    roles = getattr(user, '_project_roles', None)
+    if roles is not None:
+        return roles
+
+    timeout = getattr(settings, 'PROJECT_ROLE_CACHE_TIMEOUT', 0)
+    if timeout:
+        roles = await cache.aget(_cache_key(user.pk))
+
+    if roles is None:
+        with primary_reads():
+            roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        if timeout:
+            await cache.aset(_cache_key(user.pk), roles, timeout)
+
+    user._project_roles = roles
+    return roles
+
+
+def invalidate_user_roles(*user_ids):
+    """Drop the cross-request role cache of the given users."""
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def has_role(request, *names):
+    return not get_user_roles(request.user).isdisjoint(names)
+
+
+def is_project_manager(request):
+    return has_role(request, PROJECT_MANAGER)
+
+
+def is_project_lead(request):
+    return has_role(request, PROJECT_LEAD)
+
+
+def is_developer(request):
+    return has_role(request, DEVELOPER)
+
+
+def is_tester(request):
+    return has_role(request, TESTER)
+
+
+def sees_all_project_tasks(request):
+    """Superusers, Project Managers and Project Leads see every task of their projects."""
+    return user_sees_all_project_tasks(request.user)
+
+
+def user_sees_all_project_tasks(user):
+    """sees_all_project_tasks for code without a request (imports, commands)."""
+    return user.is_superuser or not get_user_roles(user).isdisjoint((PROJECT_MANAGER, PROJECT_LEAD))
@@ -0,0 +1,129 @@
+"""
+Incremental timesheet rollups.
+
+Every TimeSheet entry contributes its hours to one row of each rollup table
+(task, project, user-day and project/user ISO week). Saving an entry
+subtracts its previous contribution and adds the new one, deleting it
+subtracts it, so reading a total is a single-row lookup however many entries
+there are. Writes that bypass the model signals (``QuerySet.update``, raw SQL)
+are not tracked; ``rebuild_timesheet_rollups`` recomputes everything.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractIsoYear, ExtractWeek, TruncDate
+from django.utils import timezone
+
+from .models import ProjectHours, TaskHours, TimeSheet, UserDayHours, WeekHours, rollup_key
+
+
+def _rollup_rows(key):
+    """(rollup model, lookup) pairs of the rows a timesheet entry with ``key`` contributes to."""
+    task_id, project_id, user_id, date, _ = key
+    day = timezone.localdate(date) if timezone.is_aware(date) else date.date()
+    iso_year, iso_week, _ = day.isocalendar()
+
+    rows = [
+        (TaskHours, {'task_id': task_id}),
+        (ProjectHours, {'project_id': project_id}),
+        (WeekHours, {'project_id': project_id, 'user_id': user_id, 'iso_year': iso_year, 'iso_week': iso_week}),
+    ]
+    if user_id is not None:
+        rows.append((UserDayHours, {'user_id': user_id, 'day': day}))
+    return rows
+
+
+def _add(model, lookup, hours, entries):
+    updated = model.objects.filter(**lookup).update(hours=F('hours') + hours, entries=F('entries') + entries)
+    if entries < 0:
+        # Drop rows without entries, like a rebuild would. Nothing to subtract from
+        # when the row is already gone (e.g. deleted by the same cascade).
+        if updated:
+            model.objects.filter(entries__lte=0, **lookup).delete()
+        return
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(hours=hours, entries=entries, **lookup)
+    except IntegrityError:
+        # Created concurrently, add to that row instead
+        model.objects.filter(**lookup).update(hours=F('hours') + hours, entries=F('entries') + entries)
+
+
+def apply_timesheet_change(old_key, new_key):
+    """Move a timesheet entry's contribution from ``old_key`` to ``new_key`` (either may be None)."""
+    if old_key == new_key:
+        return
+
+    with transaction.atomic():
+        if old_key is not None:
+            for model, lookup in _rollup_rows(old_key):
+                _add(model, lookup, -old_key[4], -1)
+        if new_key is not None:
+            for model, lookup in _rollup_rows(new_key):
+                _add(model, lookup, new_key[4], 1)
+
+
+def timesheet_saved(timesheet):
+    new_key = rollup_key(timesheet)
+    apply_timesheet_change(getattr(timesheet, '_rollup_snapshot', None), new_key)
+    timesheet._rollup_snapshot = new_key
+
+
+def timesheet_deleted(timesheet):
+    apply_timesheet_change(getattr(timesheet, '_rollup_snapshot', None) or rollup_key(timesheet), None)
+
+
+def apply_timesheet_batch(timesheets):
+    """
+    Add the contributions of timesheet entries created in bulk (``bulk_create``
+    sends no signals), with one update per affected rollup row.
+    """
+    deltas = {}
+    for timesheet in timesheets:
+        key = rollup_key(timesheet)
+        for model, lookup in _rollup_rows(key):
+            row = (model, tuple(sorted(lookup.items())))
+            hours, entries = deltas.get(row, (0, 0))
+            deltas[row] = (hours + key[4], entries + 1)
+        timesheet._rollup_snapshot = key
+
+    with transaction.atomic():
+        for (model, lookup), (hours, entries) in deltas.items():
+            _add(model, dict(lookup), hours, entries)
+
+
+def rebuild_rollups(batch_size=1000):
+    """Recompute every rollup table from the TimeSheet table with grouped queries."""
+    entries = TimeSheet.objects.order_by()
+    totals = {'hours': Sum('hours'), 'entries': Count('id')}
+
+    with transaction.atomic():
+        for model in (TaskHours, ProjectHours, UserDayHours, WeekHours):
+            model.objects.all().delete()
+
+        TaskHours.objects.bulk_create(
+            (TaskHours(task_id=row['task'], hours=row['hours'], entries=row['entries'])
+             for row in entries.values('task').annotate(**totals).iterator()),
+            batch_size=batch_size,
+        )
+        ProjectHours.objects.bulk_create(
+            (ProjectHours(project_id=row['project'], hours=row['hours'], entries=row['entries'])
+             for row in entries.values('project').annotate(**totals).iterator()),
+            batch_size=batch_size,
+        )
+        UserDayHours.objects.bulk_create(
+            (UserDayHours(user_id=row['created_user'], day=row['day'], hours=row['hours'], entries=row['entries'])
+             for row in entries.filter(created_user__isnull=False)
+             .values('created_user', day=TruncDate('date')).annotate(**totals).iterator()),
+            batch_size=batch_size,
+        )
+        WeekHours.objects.bulk_create(
+            (WeekHours(project_id=row['project'], user_id=row['created_user'], iso_year=row['iso_year'],
+                       iso_week=row['iso_week'], hours=row['hours'], entries=row['entries'])
+             for row in entries.values('project', 'created_user', iso_year=ExtractIsoYear('date'), iso_week=ExtractWeek('date'))
+             .annotate(**totals).iterator()),
+            batch_size=batch_size,
+        )
+
+    return {model.__name__: model.objects.count() for model in (TaskHours, ProjectHours, UserDayHours, WeekHours)}
@@ -0,0 +1,165 @@
+"""
+Full-text search over tasks and comments with SQLite FTS5.
+
+Each searchable model has an FTS5 table whose rowid is the primary key of the
+indexed row (created by migration 0014). Signals re-index a row when it is
+saved and drop it when it is deleted; writes that send no signals
+(``QuerySet.update``, raw SQL) are picked up by ``rebuild_search_index``.
+
+A search filters a queryset to the matching rows and annotates their bm25
+rank and a snippet of the best matching column, so the role rules of the
+queryset (the admin ``get_queryset``) still apply. On other database
+backends the index is unavailable and the admin falls back to its regular
+``search_fields`` lookups.
+"""
+import functools
+import re
+
+from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, SEARCH_VAR
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Comment, Task
+
+# Snippet match markers, replaced by <mark> after escaping the text
+MATCH_START, MATCH_END = '\x02', '\x03'
+SNIPPET_TOKENS = 12
+
+
+def match_expression(text):
+    """
+    FTS5 query of the words in ``text``: every word must occur, as a word
+    prefix. Words are quoted, so FTS5 operators in the input are plain text.
+    Returns None when there are no words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def highlight(snippet):
+    """HTML of a snippet with the matched words in <mark>."""
+    return mark_safe(escape(snippet or '').replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+class SearchIndex:
+    """The FTS5 table of one model, indexing ``fields`` (text columns) under the row's primary key."""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.table = f'{model._meta.db_table}_fts'
+
+    def available(self):
+        return connection.vendor == 'sqlite'
+
+    def _rows(self, objs):
+        return [(obj.pk, *(getattr(obj, field) or '' for field in self.fields)) for obj in objs]
+
+    def index(self, objs):
+        """Add or replace the index entries of ``objs``."""
+        if not self.available():
+            return
+        rows = self._rows(objs)
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM "{self.table}" WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO "{self.table}" (rowid, {", ".join(self.fields)}) '
+                f'VALUES ({", ".join(["%s"] * (len(self.fields) + 1))})',
+                rows,
+            )
+
+    def remove(self, pks):
+        if not self.available():
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM "{self.table}" WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def rebuild(self):
+        """Re-index every row of the model with one INSERT ... SELECT, returns the number of rows."""
+        columns = ', '.join(f"COALESCE(\"{self.model._meta.get_field(field).column}\", '')" for field in self.fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{self.table}"')
+            cursor.execute(
+                f'INSERT INTO "{self.table}" (rowid, {", ".join(self.fields)}) '
+                f'SELECT "{self.model._meta.pk.column}", {columns} FROM "{self.model._meta.db_table}"'
+            )
+            cursor.execute(f'INSERT INTO "{self.table}" ("{self.table}") VALUES (\'optimize\')')
+            cursor.execute(f'SELECT COUNT(*) FROM "{self.table}"')
+            return cursor.fetchone()[0]
+
+    def search(self, queryset, text):
+        """
+        Rows of ``queryset`` matching ``text``, annotated with ``search_rank``
+        (bm25, lower is better) and ``search_excerpt`` (snippet with markers).
+        """
+        match = match_expression(text)
+        if match is None:
+            return queryset.none()
+
+        # The outer row is referenced by table name, as Django names the base table of a queryset
+        row = f'"{self.table}".rowid = "{self.model._meta.db_table}"."{self.model._meta.pk.column}"'
+        matching = f'"{self.table}" MATCH %s'
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM "{self.table}" WHERE {matching}', [match]),
+        ).annotate(
+            search_rank=RawSQL(f'SELECT rank FROM "{self.table}" WHERE {matching} AND {row}', [match]),
+            search_excerpt=RawSQL(
+                f'SELECT snippet("{self.table}", -1, %s, %s, %s, %s) FROM "{self.table}" WHERE {matching} AND {row}',
+                [MATCH_START, MATCH_END, '…', SNIPPET_TOKENS, match],
+            ),
+        )
+
+
+TASK_INDEX = SearchIndex(Task, ['title', 'description', 'steps_to_reproduce', 'environment'])
+COMMENT_INDEX = SearchIndex(Comment, ['title', 'content'])
+
+SEARCH_INDEXES = {
+    'task': TASK_INDEX,
+    'comment': COMMENT_INDEX,
+}
+
+
+@functools.cache
+def ranked_changelist(changelist_class):
+    """Subclass of a ChangeList ordering full-text search results by rank."""
+
+    class RankedChangeList(changelist_class):
+        def get_ordering(self, request, queryset):
+            # A clicked column header still wins over the rank
+            if 'search_rank' in queryset.query.annotations and ORDER_VAR not in self.params:
+                return ['search_rank', '-pk']
+            return super().get_ordering(request, queryset)
+
+    RankedChangeList.__name__ = f'Ranked{changelist_class.__name__}'
+    return RankedChangeList
+
+
+class FullTextSearchMixin:
+    """
+    ModelAdmin mixin making the changelist search use the model's FTS5 index:
+    results are ranked and shown with a highlighted snippet.
+    """
+    search_index = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not (search_term and self.search_index.available()):
+            return super().get_search_results(request, queryset, search_term)
+        return self.search_index.search(queryset, search_term), False
+
+    def get_changelist(self, request, **kwargs):
+        return ranked_changelist(super().get_changelist(request, **kwargs))
+
+    def get_list_display(self, request):
+        list_display = super().get_list_display(request)
+        if request.GET.get(SEARCH_VAR) and self.search_index.available():
+            return (*list_display, 'search_match')
+        return list_display
+
+    @admin.display(description='Match')
+    def search_match(self, obj):
+        return highlight(getattr(obj, 'search_excerpt', ''))
@@ -1,9 +1,227 @@
-from django.db.models.signals import pre_save
+from django.contrib.auth.models import Group, User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import File
+from .actions import tasks_bulk_updated
+from .blobs import add_reference, release_reference
+from .caches import invalidate_project_tasks
+from .live import live_events_backend, queue_event
+from .models import Comment, File, Project, Task, TimeSheet
+from .profiling import install_query_recorder
+from .rollups import timesheet_deleted, timesheet_saved
+from .roles import invalidate_user_roles
+from .search import COMMENT_INDEX, TASK_INDEX
+from .sqlite import configure_connection
+from .teams import invalidate_team_choices, invalidate_team_rosters
 
 @receiver(pre_save, sender=File)
 def set_created_user(sender, instance, **kwargs):
     # Only set the created_user if it's not already set and a user is available in the request
     if not instance.pk and hasattr(instance, '_request') and instance._request.user.is_authenticated:
         instance.created_user = instance._request.user
+
+
+#-----------------------Role cache------------------------------------
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_group_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        # user.groups.add/remove/clear()
+        invalidate_user_roles(instance.pk)
+    elif action == 'pre_clear':
+        # group.user_set.clear(), collect the members before they are removed
+        invalidate_user_roles(*instance.user_set.values_list('pk', flat=True))
+    else:
+        # group.user_set.add/remove()
+        invalidate_user_roles(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_roles_on_group_rename(sender, instance, **kwargs):
+    # Roles are cached by group name, so a renamed or deleted group affects all its members
+    if instance.pk:
+        invalidate_user_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+#-----------------------Team choices cache----------------------------
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_team_choices_on_group_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_team_choices()
+
+
+@receiver(post_save, sender=User)
+def invalidate_team_choices_on_user_change(sender, instance, created, update_fields, **kwargs):
+    # Only usernames are part of the cached choices (e.g. a login only updates last_login),
+    # a new user has no groups yet
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    invalidate_team_choices()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_team_choices_on_change(sender, **kwargs):
+    # Group names are part of the cached choices, a deleted user leaves them
+    invalidate_team_choices()
+
+
+#-----------------------Tasks by project cache------------------------
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_project_tasks_on_task_change(sender, instance, **kwargs):
+    invalidate_project_tasks(instance.project_id, getattr(instance, '_loaded_project_id', None))
+
+
+@receiver(post_delete, sender=Project)
+def invalidate_project_caches_on_project_delete(sender, instance, **kwargs):
+    invalidate_project_tasks(instance.pk)
+    invalidate_team_rosters(instance.pk)
+
+
+#-----------------------Project team rosters--------------------------
+
+@receiver(m2m_changed, sender=Project.team.through)
+def invalidate_project_caches_on_team_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        project_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # Collected before the rows go, the stamps are bumped on commit
+        project_ids = list(instance.project_set.values_list('pk', flat=True))
+    else:
+        project_ids = list(pk_set)
+
+    invalidate_team_rosters(*project_ids)
+    # Team membership also decides which tasks a Project Lead or Tester may see
+    invalidate_project_tasks(*project_ids)
+
+
+@receiver(post_save, sender=User)
+def invalidate_team_rosters_on_user_change(sender, instance, created, update_fields, **kwargs):
+    # Rosters list the username of active members only (e.g. a login only updates last_login)
+    if created or (update_fields is not None and not {'username', 'is_active'} & set(update_fields)):
+        return
+    invalidate_team_rosters(*instance.project_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_team_rosters_on_user_delete(sender, instance, **kwargs):
+    # The team rows are removed by the cascade, which sends no m2m_changed: collect the
+    # projects now, their stamps are bumped on commit
+    invalidate_team_rosters(*instance.project_set.values_list('pk', flat=True))
+
+
+#-----------------------Timesheet rollups-----------------------------
+
+@receiver(post_save, sender=TimeSheet)
+def update_rollups_on_timesheet_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        timesheet_saved(instance)
+
+
+@receiver(post_delete, sender=TimeSheet)
+def update_rollups_on_timesheet_delete(sender, instance, **kwargs):
+    timesheet_deleted(instance)
+
+
+#-----------------------Full-text search index------------------------
+
+@receiver(post_save, sender=Task)
+def index_task_on_save(sender, instance, **kwargs):
+    TASK_INDEX.index([instance])
+
+
+@receiver(post_delete, sender=Task)
+def unindex_task_on_delete(sender, instance, **kwargs):
+    TASK_INDEX.remove([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+def index_comment_on_save(sender, instance, **kwargs):
+    COMMENT_INDEX.index([instance])
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment_on_delete(sender, instance, **kwargs):
+    COMMENT_INDEX.remove([instance.pk])
+
+
+#-----------------------Attachment blob references--------------------
+
+@receiver(post_save, sender=File)
+def update_blob_references_on_file_save(sender, instance, created, **kwargs):
+    loaded_name = getattr(instance, '_loaded_file_name', None)
+    if instance.file.name == loaded_name:
+        return
+    add_reference(instance.file.name)
+    release_reference(loaded_name)
+    instance._loaded_file_name = instance.file.name
+
+
+@receiver(post_delete, sender=File)
+def release_blob_reference_on_file_delete(sender, instance, **kwargs):
+    release_reference(getattr(instance, '_loaded_file_name', instance.file.name))
+
+
+#-----------------------Live change events---------------------------
+
+@receiver(post_save, sender=Task)
+def queue_task_live_event(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # None: the value was not loaded (deferred), so it is not known to have changed
+    loaded_status = getattr(instance, '_loaded_status', None)
+    loaded_assignee = getattr(instance, '_loaded_assigned_to_id', None)
+    if created:
+        kinds = ['task']
+    else:
+        kinds = [kind for kind, changed in (
+            ('status', loaded_status is not None and instance.status != loaded_status),
+            ('assignment', loaded_assignee is not None and instance.assigned_to_id != loaded_assignee),
+        ) if changed]
+    if kinds:
+        queue_event(instance.project_id, kinds, [instance.pk], [instance.assigned_to_id, loaded_assignee])
+    instance._loaded_status = instance.__dict__.get('status')
+    instance._loaded_assigned_to_id = instance.__dict__.get('assigned_to_id')
+
+
+@receiver(tasks_bulk_updated, sender=Task)
+def queue_bulk_task_live_event(sender, queryset, fields, assignees=None, **kwargs):
+    kinds = [kind for field, kind in (('status', 'status'), ('assigned_to', 'assignment')) if field in fields]
+    if kinds and assignees:
+        # One event per project, without the (possibly many) task IDs, for the streams of its assignees
+        for project_id, user_ids in assignees.items():
+            queue_event(project_id, kinds, None, user_ids)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=File)
+def queue_task_child_live_event(sender, instance, created, raw=False, **kwargs):
+    # Attachments may have no task, there is no project to notify then
+    if created and not raw and instance.task_id is not None and live_events_backend():
+        task = instance.task
+        queue_event(task.project_id, [sender._meta.model_name], [task.pk], [task.assigned_to_id])
+
+
+#-----------------------SQLite connection setup-----------------------
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    configure_connection(connection)
+
+
+#-----------------------Request profiling-----------------------------
+
+@receiver(connection_created)
+def profile_connection_queries(sender, connection, **kwargs):
+    install_query_recorder(connection)
@@ -0,0 +1,72 @@
+"""
+Connection setup for SQLite databases.
+
+Every new SQLite connection runs the PRAGMAs of ``PROJECT_SQLITE_PRAGMAS``
+(connected to ``connection_created`` in project.signals):
+
+- ``synchronous=NORMAL``: in WAL mode only checkpoints fsync, a commit does
+  not. A power loss can lose the last commits, never corrupt the database.
+  It is only safe in WAL mode, so it is skipped on databases in another
+  journal mode.
+- ``busy_timeout``: milliseconds a connection waits for the write lock
+  before failing with "database is locked".
+- ``mmap_size``, ``cache_size`` (negative: KiB) and ``temp_store``: read
+  through memory mapping, a larger page cache, temporary tables in memory.
+
+The journal mode is stored in the database file, so it is not set on
+connect (every manage.py command would convert the database and leave
+``-wal``/``-shm`` files next to it): ``manage.py sqlite_journal_mode wal``
+switches a served database to WAL once, where readers no longer block the
+writer and the writer no longer blocks readers.
+
+Writers wait on busy_timeout only if they ask for the write lock up front,
+a deferred transaction that reads then writes fails at once when another
+connection wrote in between, so settings.py also sets
+``transaction_mode='IMMEDIATE'``; with CONN_MAX_AGE connections (and their
+setup) are reused across requests.
+"""
+from django.conf import settings
+
+# Journal mode recommended for a served database (persistent, see sqlite_journal_mode)
+JOURNAL_MODE = 'WAL'
+
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -32 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def configured_pragmas():
+    pragmas = getattr(settings, 'PROJECT_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    return pragmas or {}
+
+
+def pragma_statements(pragmas):
+    # journal_mode first: it cannot change inside a transaction and the others do not depend on it
+    ordered = sorted(pragmas.items(), key=lambda item: item[0] != 'journal_mode')
+    return [f'PRAGMA {name} = {value}' for name, value in ordered]
+
+
+def apply_pragmas(cursor, pragmas):
+    for statement in pragma_statements(pragmas):
+        cursor.execute(statement)
+
+
+def journal_mode(cursor):
+    cursor.execute('PRAGMA journal_mode')
+    return cursor.fetchone()[0].lower()
+
+
+def configure_connection(connection):
+    if connection.vendor != 'sqlite':
+        return
+    # Persistent, changed by sqlite_journal_mode only
+    pragmas = {name: value for name, value in configured_pragmas().items() if name != 'journal_mode'}
+    if pragmas:
+        with connection.cursor() as cursor:
+            if 'synchronous' in pragmas and journal_mode(cursor) != 'wal':
+                del pragmas['synchronous']
+            apply_pragmas(cursor, pragmas)
@@ -0,0 +1,94 @@
+"""
+Content-addressed storage for task attachments.
+
+Saving a file streams it into a temporary file while hashing it (SHA-256)
+and keeps one blob per digest at ``blobs/<ab>/<digest>``, so an attachment
+uploaded to many tasks is stored once. The name returned to the FileField is
+``cas/<digest>/<filename>``: it keeps the original file name for downloads
+and ``path()`` maps it to the blob. Blobs are reference counted by the Blob
+model (see project.blobs) and only deleted when no File refers to them any
+more, so ``delete()`` leaves them alone. Names from before the storage
+(``media/files/...``) keep working as plain files.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+from .derivatives import PREVIEW_SUFFIX, THUMBNAIL_SUFFIX
+
+CAS_PREFIX = 'cas/'
+BLOB_DIR = 'blobs'
+# Longest kept file name, so cas/<digest>/<filename> fits File.file (max_length 200)
+MAX_FILENAME_LENGTH = 100
+
+
+def digest_of(name):
+    """The content digest of a content-addressed name, None for other names."""
+    if name and name.startswith(CAS_PREFIX):
+        return name.split('/')[1]
+    return None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def blob_name(self, digest):
+        return f'{BLOB_DIR}/{digest[:2]}/{digest}'
+
+    def path(self, name):
+        digest = digest_of(name)
+        return super().path(self.blob_name(digest) if digest else name)
+
+    def get_available_name(self, name, max_length=None):
+        # Nothing is written at the upload name, content with the same digest is the same file
+        return name
+
+    def _save(self, name, content):
+        filename = os.path.basename(name)
+        root, ext = os.path.splitext(filename)
+        filename = root[:MAX_FILENAME_LENGTH - len(ext)] + ext
+
+        tmp_dir = os.path.join(self.location, BLOB_DIR, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        sha256 = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (e.g. an assembled chunked upload): hash it, then move it
+            tmp_path = content.temporary_file_path()
+            with open(tmp_path, 'rb') as source:
+                for block in iter(lambda: source.read(content.DEFAULT_CHUNK_SIZE), b''):
+                    sha256.update(block)
+        else:
+            fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+
+        digest = sha256.hexdigest()
+        blob_path = super().path(self.blob_name(digest))
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+            # Fresh mtime, so garbage collection of unreferenced blobs leaves it to the File being saved
+            os.utime(blob_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            file_move_safe(tmp_path, blob_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(blob_path, self.file_permissions_mode)
+        return f'{CAS_PREFIX}{digest}/{filename}'
+
+    def delete(self, name):
+        # Blobs are shared, project.blobs deletes them when their last reference goes
+        if not digest_of(name):
+            super().delete(name)
+
+    def delete_blob(self, digest):
+        # With its derivatives (thumbnail, preview) stored next to it
+        for suffix in ('', THUMBNAIL_SUFFIX, PREVIEW_SUFFIX):
+            super().delete(self.blob_name(digest) + suffix)
+
+
+def attachment_storage():
+    return ContentAddressedStorage()
@@ -0,0 +1,140 @@
+"""
+Team member lookups used by the project and task forms.
+
+The grouped ``team`` choices are built from a single query over the
+user/group membership table and cached until a membership or username
+changes. The cache is cleared in the process that made the change, other
+processes with a cache of their own rebuild the choices after
+``PROJECT_TEAM_CHOICES_CACHE_TIMEOUT`` seconds.
+Project team rosters are cached per project under a version stamp that is
+bumped when a change of the team or one of its members commits.
+"""
+from itertools import groupby
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .caches import aget_versions, bump_version_on_commit, get_versions
+from .models import Project
+from .replicas import primary_reads
+from .roles import PROJECT_MANAGER
+
+TEAM_CHOICES_CACHE_KEY = 'project:team-choices'
+
+
+def team_memberships():
+    """(group name, user id, username) rows of every team-eligible user, ordered by group and username."""
+    return (
+        User.groups.through.objects
+        .exclude(group__name=PROJECT_MANAGER)
+        .order_by('group__name', 'user__username')
+        .values_list('group__name', 'user_id', 'user__username')
+    )
+
+
+def grouped_team_choices():
+    """Return ``[(group name, [(user id, username), ...]), ...]`` for the team select."""
+    choices = cache.get(TEAM_CHOICES_CACHE_KEY)
+    if choices is None:
+        with primary_reads():
+            choices = [
+                (group_name, [(user_id, username) for _, user_id, username in rows])
+                for group_name, rows in groupby(team_memberships(), key=lambda row: row[0])
+            ]
+        cache.set(TEAM_CHOICES_CACHE_KEY, choices, getattr(settings, 'PROJECT_TEAM_CHOICES_CACHE_TIMEOUT', 60))
+    return choices
+
+
+def invalidate_team_choices():
+    cache.delete(TEAM_CHOICES_CACHE_KEY)
+
+
+def search_team_members(term, offset, limit):
+    """
+    Return one page of team-eligible users matching ``term`` in select2's
+    grouped format, and whether more results follow.
+    """
+    rows = team_memberships()
+    if term:
+        rows = rows.filter(user__username__icontains=term)
+    rows = list(rows[offset:offset + limit + 1])
+
+    results = [
+        {'text': group_name, 'children': [{'id': user_id, 'text': username} for _, user_id, username in members]}
+        for group_name, members in groupby(rows[:limit], key=lambda row: row[0])
+    ]
+    return results, len(rows) > limit
+
+
+#-----------------------Project team rosters--------------------------
+
+def team_roster_versions(project_ids):
+    """Return ``{project id: version stamp}`` of the rosters of the given projects."""
+    versions = get_versions(f'project-team:{project_id}' for project_id in project_ids)
+    return {project_id: versions[f'project-team:{project_id}'] for project_id in project_ids}
+
+
+async def ateam_roster_versions(project_ids):
+    versions = await aget_versions(f'project-team:{project_id}' for project_id in project_ids)
+    return {project_id: versions[f'project-team:{project_id}'] for project_id in project_ids}
+
+
+def invalidate_team_rosters(*project_ids):
+    bump_version_on_commit(*(f'project-team:{project_id}' for project_id in project_ids))
+
+
+def get_team_rosters(project_ids):
+    """
+    Return ``{project id: [{"id": .., "username": ..}, ...]}`` with the active
+    team members of each existing project, loading all cache misses in one query.
+    """
+    versions = team_roster_versions(project_ids)
+    keys = {f'project:team-roster:{project_id}:{version}': project_id for project_id, version in versions.items()}
+    rosters = {keys[key]: roster for key, roster in cache.get_many(keys).items()}
+
+    missing = [project_id for project_id in project_ids if project_id not in rosters]
+    if missing:
+        # Cached under the current versions, so read from the primary (see project.replicas)
+        with primary_reads():
+            loaded = {project_id: [] for project_id in Project.objects.filter(pk__in=missing).values_list('pk', flat=True)}
+            members = (
+                Project.team.through.objects
+                .filter(project_id__in=loaded, user__is_active=True)
+                .order_by('user__username')
+                .values_list('project_id', 'user_id', 'user__username')
+            )
+            for project_id, user_id, username in members:
+                loaded[project_id].append({'id': user_id, 'username': username})
+
+        timeout = getattr(settings, 'PROJECT_TEAM_ROSTER_CACHE_TIMEOUT', 3600)
+        cache.set_many({f'project:team-roster:{project_id}:{versions[project_id]}': roster for project_id, roster in loaded.items()}, timeout)
+        rosters.update(loaded)
+
+    return rosters
+
+
+async def aget_team_rosters(project_ids):
+    """get_team_rosters for async views (async cache and ORM)."""
+    versions = await ateam_roster_versions(project_ids)
+    keys = {f'project:team-roster:{project_id}:{version}': project_id for project_id, version in versions.items()}
+    rosters = {keys[key]: roster for key, roster in (await cache.aget_many(keys)).items()}
+
+    missing = [project_id for project_id in project_ids if project_id not in rosters]
+    if missing:
+        with primary_reads():
+            loaded = {project_id: [] async for project_id in Project.objects.filter(pk__in=missing).values_list('pk', flat=True)}
+            members = (
+                Project.team.through.objects
+                .filter(project_id__in=list(loaded), user__is_active=True)
+                .order_by('user__username')
+                .values_list('project_id', 'user_id', 'user__username')
+            )
+            async for project_id, user_id, username in members:
+                loaded[project_id].append({'id': user_id, 'username': username})
+
+        timeout = getattr(settings, 'PROJECT_TEAM_ROSTER_CACHE_TIMEOUT', 3600)
+        await cache.aset_many({f'project:team-roster:{project_id}:{versions[project_id]}': roster for project_id, roster in loaded.items()}, timeout)
+        rosters.update(loaded)
+
+    return rosters
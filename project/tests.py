@@ -1,3 +1,1630 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.sessions.backends.cache import SessionStore as CacheSessionStore
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db import transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
+
+from .models import (
+    AutoDateTimeField, Blob, Comment, File, PreviewJob, Project, ProjectHours, Task, TaskHours, TimeSheet, UploadSession,
+    UserDayHours, WeekHours, task_date_errors,
+)
+from . import blobs, caches, live, previews, profiling, replicas, rollups, sqlite, teams, views
+from .imports import TimeSheetImporter, read_records
+from .pagination import encode_cursor
+from .roles import DEVELOPER, PROJECT_LEAD, PROJECT_MANAGER, TESTER, get_user_roles
+from .search import COMMENT_INDEX, TASK_INDEX
+from .storage import digest_of
+
+# Scale of the seeded visibility dataset, 1.0 = 10k projects and 500k tasks.
+# The default keeps the regular test run fast; set e.g. PM_TEST_SCALE=1 for the full dataset.
+TEST_SCALE = float(os.environ.get('PM_TEST_SCALE', '0.01'))
+# Upper bound in seconds for one visibility query on the seeded dataset
+VISIBILITY_QUERY_BUDGET = float(os.environ.get('PM_VISIBILITY_QUERY_BUDGET', '2.0'))
+
+
+class VisibilityTests(TestCase):
+    """Project/Task ``visible_to`` on a seeded dataset, with query-count and timing checks."""
+
+    @classmethod
+    def setUpTestData(cls):
+        project_count = max(int(10_000 * TEST_SCALE), 20)
+        tasks_per_project = 50
+        team_size = 5
+
+        developers = Group.objects.create(name='developer')
+        leads = Group.objects.create(name='Project Lead')
+
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        members = User.objects.bulk_create(User(username=f'member{i}') for i in range(team_size * 4))
+        cls.developer, cls.lead, cls.outsider = members[0], members[1], members[-1]
+        cls.developer.groups.add(developers)
+        cls.lead.groups.add(leads)
+
+        projects = Project.objects.bulk_create(
+            Project(name=f'Project {i}', start_date=date(2024, 1, 1), created_user=cls.superuser)
+            for i in range(project_count)
+        )
+
+        # Every project has a large team; the lead and developer are on every other project
+        Membership = Project.team.through
+        memberships = []
+        for index, project in enumerate(projects):
+            team = members[2 + index % 3:2 + index % 3 + team_size]
+            if index % 2 == 0:
+                team = [cls.lead, cls.developer, *team]
+            memberships.extend(Membership(project_id=project.pk, user_id=user.pk) for user in team)
+        Membership.objects.bulk_create(memberships)
+
+        # One project created by the outsider without being on its team
+        cls.own_project = Project.objects.create(name='Own', start_date=date(2024, 1, 1), created_user=cls.outsider)
+        projects.append(cls.own_project)
+
+        tasks = (
+            Task(
+                title=f'Task {index}',
+                project=project,
+                assigned_to=members[index % len(members)],
+                start_date=date(2024, 1, 1),
+                created_user=cls.superuser,
+            )
+            for project in projects
+            for index in range(tasks_per_project)
+        )
+        Task.objects.bulk_create(tasks, batch_size=5000)
+
+    def test_project_visibility_matches_team_or_creator(self):
+        for user in (self.lead, self.developer, self.outsider):
+            expected = set(
+                Project.objects.filter(team=user).values_list('pk', flat=True)
+            ) | set(Project.objects.filter(created_user=user).values_list('pk', flat=True))
+            self.assertEqual(set(Project.objects.visible_to(user).values_list('pk', flat=True)), expected)
+
+        self.assertEqual(Project.objects.visible_to(self.superuser).count(), Project.objects.count())
+
+    def test_task_visibility(self):
+        lead_projects = Project.objects.filter(team=self.lead)
+        self.assertEqual(
+            Task.objects.visible_to(self.lead).count(),
+            Task.objects.filter(project__in=lead_projects).count(),
+        )
+        # Developers only see the tasks assigned to them, even on their projects
+        self.assertEqual(
+            set(Task.objects.visible_to(self.developer).values_list('pk', flat=True)),
+            set(Task.objects.filter(assigned_to=self.developer).values_list('pk', flat=True)),
+        )
+        # Users outside a project's team only see the tasks they created
+        own_task = Task.objects.create(
+            title='Own task', project=self.own_project, assigned_to=self.lead,
+            start_date=date(2024, 1, 1), created_user=self.outsider,
+        )
+        self.assertEqual(list(Task.objects.visible_to(self.outsider)), [own_task])
+
+    def test_visibility_uses_exists_without_distinct(self):
+        for queryset in (Project.objects.visible_to(self.lead), Task.objects.visible_to(self.lead)):
+            sql = str(queryset.query).upper()
+            self.assertIn('EXISTS', sql)
+            self.assertNotIn('DISTINCT', sql)
+
+    def test_visibility_query_count(self):
+        # Roles are resolved once per user object, every listing is then a single query
+        lead = User.objects.get(pk=self.lead.pk)
+        with self.assertNumQueries(3):
+            list(Task.objects.visible_to(lead)[:100])
+            list(Task.objects.visible_to(lead)[100:200])
+        with self.assertNumQueries(1):
+            list(Project.objects.visible_to(lead)[:100])
+
+    def test_visibility_query_time(self):
+        for user in (self.lead, self.outsider):
+            user = User.objects.get(pk=user.pk)
+            for queryset in (Project.objects.visible_to(user), Task.objects.visible_to(user)):
+                started = time.perf_counter()
+                queryset.count()
+                list(queryset.order_by('-pk')[:100])
+                elapsed = time.perf_counter() - started
+                self.assertLess(elapsed, VISIBILITY_QUERY_BUDGET, f'{queryset.model.__name__} visibility for {user}')
+
+@override_settings(PROJECT_ROLE_CACHE_TIMEOUT=60)
+class RoleCacheTests(TestCase):
+    """Roles are cached across requests and dropped when the user's groups change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.developers, cls.leads = Group.objects.create(name=DEVELOPER), Group.objects.create(name=PROJECT_LEAD)
+        cls.alice, cls.bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        cls.developers.user_set.add(cls.alice, cls.bob)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def roles(self, user):
+        # A fresh user object, the roles are also memoized on the instance
+        user = User.objects.get(pk=user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            roles = get_user_roles(user)
+        return roles, len(queries)
+
+    def test_roles_are_cached(self):
+        self.assertEqual(self.roles(self.alice), ({DEVELOPER}, 1))
+        self.assertEqual(self.roles(self.alice), ({DEVELOPER}, 0))
+        with override_settings(PROJECT_ROLE_CACHE_TIMEOUT=0):
+            self.assertEqual(self.roles(self.alice), ({DEVELOPER}, 1))
+
+    def test_group_changes_from_either_side(self):
+        changes = [
+            (lambda: self.alice.groups.add(self.leads), {DEVELOPER, PROJECT_LEAD}, {DEVELOPER}),
+            (lambda: self.alice.groups.remove(self.developers), {PROJECT_LEAD}, {DEVELOPER}),
+            (lambda: self.leads.user_set.add(self.bob), {PROJECT_LEAD}, {DEVELOPER, PROJECT_LEAD}),
+            (lambda: self.developers.user_set.remove(self.bob), {PROJECT_LEAD}, {PROJECT_LEAD}),
+            (lambda: self.alice.groups.clear(), set(), {PROJECT_LEAD}),
+            (lambda: self.leads.user_set.clear(), set(), set()),
+        ]
+        for change, alice, bob in changes:
+            # Cache the current roles first
+            self.roles(self.alice)
+            self.roles(self.bob)
+            change()
+            self.assertEqual((self.roles(self.alice)[0], self.roles(self.bob)[0]), (alice, bob))
+
+    def test_group_rename_and_delete(self):
+        self.assertEqual((self.roles(self.alice)[0], self.roles(self.bob)[0]), ({DEVELOPER}, {DEVELOPER}))
+        self.developers.name = 'Developers'
+        self.developers.save()
+        self.assertEqual((self.roles(self.alice)[0], self.roles(self.bob)[0]), ({'Developers'}, {'Developers'}))
+        self.developers.delete()
+        self.assertEqual((self.roles(self.alice)[0], self.roles(self.bob)[0]), (set(), set()))
+
+
+class ChangeListQueryCountTests(TestCase):
+    """Every changelist renders in the same number of queries whatever its page size."""
+
+    SMALL_PAGE = 5
+    LARGE_PAGE = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.lead = User.objects.create_user('lead', is_staff=True)
+        cls.lead.groups.add(Group.objects.create(name='Project Lead'))
+        cls.lead.user_permissions.add(*Permission.objects.filter(content_type__app_label='project', codename__startswith='view_'))
+        users = User.objects.bulk_create(User(username=f'user{i}') for i in range(4))
+
+        projects = Project.objects.bulk_create(
+            Project(name=f'Project {i}', start_date=date(2024, 1, 1), created_user=users[i % 4]) for i in range(cls.LARGE_PAGE + 5)
+        )
+        Project.team.through.objects.bulk_create(
+            Project.team.through(project_id=project.pk, user_id=user.pk) for project in projects for user in (cls.lead, *users)
+        )
+        tasks = Task.objects.bulk_create(
+            Task(
+                title=f'Task {i}', description='x' * 1000, project=projects[i % 3], assigned_to=(cls.lead, *users)[i % 5],
+                created_user=users[(i + 1) % 4], start_date=date(2024, 1, 1), status_rank=i % 5,
+            )
+            for i in range(cls.LARGE_PAGE * 2)
+        )
+        TaskHours.objects.bulk_create(TaskHours(task=task, hours=Decimal('1.5'), entries=1) for task in tasks[::2])
+        Comment.objects.bulk_create(
+            Comment(title=f'Comment {i}', content='y' * 1000, task=tasks[i], created_user=cls.lead if i % 2 else users[i % 4])
+            for i in range(len(tasks))
+        )
+        File.objects.bulk_create(
+            File(name=f'File {i}', file=f'media/files/file{i}.txt', task=tasks[i], created_user=cls.lead if i % 2 else users[i % 4])
+            for i in range(len(tasks))
+        )
+        TimeSheet.objects.bulk_create(
+            TimeSheet(project=task.project, task=task, hours=Decimal('1.5'), description='z' * 1000, created_user=users[i % 4])
+            for i, task in enumerate(tasks)
+        )
+        TASK_INDEX.rebuild()
+
+    def changelist_queries(self, model, url, page_size):
+        model_admin = admin.site.get_model_admin(model)
+        with mock.patch.object(model_admin, 'list_per_page', page_size), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), page_size, url)
+        return len(queries)
+
+    def test_changelist_query_count_is_constant(self):
+        changelists = [
+            (Project, '/admin/project/project/'),
+            (Task, '/admin/project/task/'),
+            (Task, '/admin/project/task/?q=task'),
+            (Task, '/admin/project/task/?o=1'),
+            (Comment, '/admin/project/comment/'),
+            (File, '/admin/project/file/'),
+            (TimeSheet, '/admin/project/timesheet/'),
+        ]
+        for user in (self.superuser, self.lead):
+            self.client.force_login(user)
+            for model, url in changelists:
+                with self.subTest(user=user.username, url=url):
+                    # Warm up the per-process caches (content types, roles)
+                    self.changelist_queries(model, url, self.SMALL_PAGE)
+                    self.assertEqual(
+                        self.changelist_queries(model, url, self.SMALL_PAGE),
+                        self.changelist_queries(model, url, self.LARGE_PAGE),
+                    )
+
+    def test_changelists_defer_large_text_fields(self):
+        self.client.force_login(self.superuser)
+        for model, url, column in (
+            (Project, '/admin/project/project/', 'description'),
+            (Task, '/admin/project/task/', 'description'),
+            (Comment, '/admin/project/comment/', 'content'),
+            (TimeSheet, '/admin/project/timesheet/', 'description'),
+        ):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            table = model._meta.db_table
+            row_queries = [query['sql'] for query in queries if f'FROM "{table}"' in query['sql'] and not query['sql'].startswith('SELECT COUNT(')]
+            self.assertTrue(row_queries, url)
+            self.assertFalse(any(f'"{table}"."{column}"' in sql for sql in row_queries), url)
+
+class ProjectTaskCountTests(TestCase):
+    """The task count of the project changelist counts the tasks each role sees, in one query for all rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.lead, cls.developer, cls.other_developer = (
+            User.objects.create_user(name, is_staff=True) for name in ('lead', 'dev', 'other')
+        )
+        Group.objects.create(name=PROJECT_LEAD).user_set.add(cls.lead)
+        Group.objects.create(name=DEVELOPER).user_set.add(cls.developer, cls.other_developer)
+        view_project = Permission.objects.get(codename='view_project')
+        cls.lead.user_permissions.add(view_project)
+        cls.developer.user_permissions.add(view_project)
+
+        for index in range(3):
+            cls.add_project(index)
+
+    @classmethod
+    def add_project(cls, index):
+        project = Project.objects.create(name=f'Project {index}', start_date=date(2024, 1, 1))
+        project.team.add(cls.lead, cls.developer, cls.other_developer)
+        assignees = [cls.developer] * index + [cls.other_developer, cls.lead]
+        Task.objects.bulk_create(
+            Task(title=f'Task {i}', project=project, assigned_to=assignee, start_date=date(2024, 1, 1))
+            for i, assignee in enumerate(assignees)
+        )
+
+    def task_counts(self, user):
+        self.client.force_login(user)
+        response = self.client.get('/admin/project/project/')
+        self.assertEqual(response.status_code, 200)
+        return {project.pk: project.task_count_value for project in response.context['cl'].result_list}
+
+    def test_counts_match_the_visible_tasks(self):
+        for user in (self.superuser, self.lead, self.developer):
+            with self.subTest(user=user.username):
+                visible = Task.objects.visible_to(user)
+                counts = self.task_counts(user)
+                self.assertEqual(len(counts), 3)
+                self.assertEqual(counts, {pk: visible.filter(project_id=pk).count() for pk in counts})
+        self.assertEqual(sorted(self.task_counts(self.developer).values()), [0, 1, 2])
+        self.assertEqual(sorted(self.task_counts(self.lead).values()), [2, 3, 4])
+
+    def queries(self, user, project_count):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.task_counts(user)), project_count)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_projects(self):
+        users = (self.superuser, self.lead, self.developer)
+        for user in users:
+            # Warm up the per-process caches (content types, roles)
+            self.task_counts(user)
+        before = [self.queries(user, 3) for user in users]
+        for index in range(3, 6):
+            self.add_project(index)
+        self.assertEqual([self.queries(user, 6) for user in users], before)
+
+
+class BulkTaskActionTests(TestCase):
+    """The bulk task actions run one UPDATE over the selection and apply the changelist's role rules."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.developer = User.objects.create_user('dev', is_staff=True)
+        developers = Group.objects.create(name='developer')
+        cls.developer.groups.add(developers)
+        cls.developer.user_permissions.add(*Permission.objects.filter(codename__in=('view_task', 'change_task')))
+        cls.member, cls.outsider = User.objects.create_user('member'), User.objects.create_user('outsider')
+        # Assignees are picked from the team-eligible users (members of a role group)
+        developers.user_set.add(cls.member, cls.outsider)
+
+        cls.project = Project.objects.create(name='Team', start_date=date(2024, 1, 1), end_date=date(2024, 6, 30))
+        cls.project.team.add(cls.developer, cls.member)
+        cls.other = Project.objects.create(name='Other', start_date=date(2024, 1, 1))
+        cls.other.team.add(cls.outsider)
+        cls.own = [
+            Task.objects.create(
+                title=f'Own {i}', project=cls.project, assigned_to=cls.developer,
+                start_date=date(2024, 1, 1), due_date=date(2024, 6, 20 + i),
+            )
+            for i in range(3)
+        ]
+        cls.foreign = Task.objects.create(
+            title='Foreign', project=cls.other, assigned_to=cls.outsider, start_date=date(2024, 1, 1), due_date=date(2024, 2, 1),
+        )
+
+    def run_action(self, user, action, tasks, **values):
+        self.client.force_login(user)
+        data = {'action': action, '_selected_action': [task.pk for task in tasks], 'index': 0, **values}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/admin/project/task/', data)
+        self.assertEqual(response.status_code, 302)
+        return [query['sql'] for query in queries if query['sql'].startswith('UPDATE "project_task"')]
+
+    def test_set_status_is_one_update_and_keeps_the_rank(self):
+        updates = self.run_action(self.superuser, 'set_status', [*self.own, self.foreign], status='Resolved')
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(Task.objects.values_list('status', 'status_rank')), {('Resolved', Task.STATUS_RANKS['Resolved'])},
+        )
+
+    def test_developer_only_changes_own_tasks(self):
+        self.run_action(self.developer, 'set_priority', [*self.own, self.foreign], priority='High')
+        self.assertEqual(Task.objects.filter(priority='High').count(), len(self.own))
+        self.assertEqual(Task.objects.get(pk=self.foreign.pk).priority, 'Low')
+
+    def test_reassign_checks_team_and_invalidates_tasks_cache(self):
+        from .caches import project_tasks_version
+
+        version = project_tasks_version(self.project.pk)
+        time.sleep(0.01)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.run_action(self.superuser, 'reassign', [*self.own, self.foreign], assigned_to=self.member.pk)
+        self.assertEqual(set(Task.objects.filter(project=self.project).values_list('assigned_to', flat=True)), {self.member.pk})
+        self.assertEqual(Task.objects.get(pk=self.foreign.pk).assigned_to, self.outsider)
+        self.assertNotEqual(project_tasks_version(self.project.pk), version)
+
+    def test_shift_due_dates_stays_within_project_window(self):
+        self.run_action(self.superuser, 'shift_due_dates', [*self.own, self.foreign], shift_days=10)
+        # 2024-06-20 + 10 = 06-30 fits the project end, 06-21 and 06-22 would not; Other has no end
+        self.assertEqual(
+            list(Task.objects.order_by('pk').values_list('due_date', flat=True)),
+            [date(2024, 6, 30), date(2024, 6, 21), date(2024, 6, 22), date(2024, 2, 11)],
+        )
+        self.run_action(self.superuser, 'shift_due_dates', [self.foreign], shift_days=-365)
+        self.assertEqual(Task.objects.get(pk=self.foreign.pk).due_date, date(2024, 2, 11))
+
+
+@override_settings(PROJECT_LIVE_EVENTS='memory')
+class LiveEventTests(TestCase):
+    """Change events are merged per project and transaction before they are published."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.projects = Project.objects.bulk_create(
+            Project(name=f'Project {i}', start_date=date(2024, 1, 1)) for i in range(2)
+        )
+        Task.objects.bulk_create(
+            Task(title=f'Task {i}', project=cls.projects[i % 2], assigned_to=cls.superuser, start_date=date(2024, 1, 1))
+            for i in range(300)
+        )
+
+    def published(self, change):
+        with mock.patch.object(live.hub, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            change()
+        return {call.args[0]: json.loads(call.args[1]) for call in publish.call_args_list}, publish.call_count
+
+    def test_saves_of_a_transaction_send_one_event_per_project(self):
+        commented = Task.objects.first()
+
+        def change():
+            with transaction.atomic():
+                for task in Task.objects.all():
+                    task.status = 'Resolved'
+                    task.save()
+                Comment.objects.create(task=commented, content='Done')
+
+        events, count = self.published(change)
+        self.assertEqual(count, 2)
+        event = events[live.channel(commented.project_id)]
+        self.assertEqual(event['kinds'], ['comment', 'status'])
+        # Too many tasks to list
+        self.assertIsNone(event['tasks'])
+
+    def test_bulk_action_sends_one_event_per_project(self):
+        self.client.force_login(self.superuser)
+        events, count = self.published(lambda: self.client.post('/admin/project/task/', {
+            'action': 'set_status', 'select_across': 1, 'index': 0, '_selected_action': [0], 'status': 'closed',
+        }))
+        self.assertEqual(count, 2)
+        self.assertEqual(set(events), {live.channel(project.pk) for project in self.projects})
+        self.assertEqual([event['assignees'] for event in events.values()], [[self.superuser.pk]] * 2)
+
+    def test_bulk_reassign_reaches_old_and_new_assignees(self):
+        developer = User.objects.create_user('dev', is_staff=True)
+        developer.groups.add(Group.objects.create(name=DEVELOPER))
+        developer.user_permissions.add(*Permission.objects.filter(codename__in=('view_task', 'change_task')))
+        teammate = User.objects.create_user('teammate')
+        teammate.groups.add(Group.objects.get(name=DEVELOPER))
+        project = self.projects[0]
+        project.team.add(developer, teammate)
+        task = Task.objects.filter(project=project).first()
+        Task.objects.filter(pk=task.pk).update(assigned_to=developer)
+
+        # The developer's changelist only holds their own tasks, which the update takes out of it
+        self.client.force_login(developer)
+        events, count = self.published(lambda: self.client.post('/admin/project/task/', {
+            'action': 'reassign', 'index': 0, '_selected_action': [task.pk], 'assigned_to': teammate.pk,
+        }))
+        self.assertEqual(count, 1)
+        self.assertEqual(events[live.channel(project.pk)]['assignees'], sorted([developer.pk, teammate.pk]))
+
+    def test_new_comment_sends_an_event_to_the_task_assignee(self):
+        task = Task.objects.filter(project=self.projects[1]).first()
+        events, count = self.published(lambda: Comment.objects.create(task=task, content='Looks good'))
+        self.assertEqual(count, 1)
+        self.assertEqual(
+            events[live.channel(task.project_id)],
+            {'project': task.project_id, 'kinds': ['comment'], 'tasks': [task.pk], 'assignees': [self.superuser.pk]},
+        )
+
+    def test_file_without_a_task_sends_no_event(self):
+        events, count = self.published(lambda: File.objects.create(name='Loose', file=''))
+        self.assertEqual(count, 0)
+
+
+class ProfilingTests(TestCase):
+    """Sampled requests are logged with their queries and summarized per view for staff."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'profile.jsonl')
+        settings = override_settings(PROJECT_PROFILE_SAMPLE_RATE=1, PROJECT_PROFILE_LOG=self.log)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # The log handler and the query hook are set up once per process / connection
+        self.addCleanup(setattr, profiling, '_logger', None)
+        profiling._logger = None
+        profiling.install_query_recorder(connection)
+        self.addCleanup(connection.execute_wrappers.remove, profiling.record_queries)
+
+        self.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        Task.objects.bulk_create(
+            Task(title=f'Task {i}', project=project, assigned_to=self.superuser, start_date=date(2024, 1, 1)) for i in range(3)
+        )
+        self.tasks_url = f'/api/v1/projects/{project.pk}/tasks/'
+
+    def test_sampled_requests_are_logged_and_ranked(self):
+        self.client.force_login(self.superuser)
+        self.client.get('/admin/project/task/')
+        self.client.get(self.tasks_url)
+        self.client.get(self.tasks_url)
+
+        with open(self.log) as lines:
+            records = [json.loads(line) for line in lines]
+        self.assertEqual([record['view'] for record in records], [
+            'admin:project_task_changelist', 'get_tasks_for_project', 'get_tasks_for_project',
+        ])
+        self.assertTrue(all(record['queries'] > 0 for record in records))
+        # The second task list is served from the cache
+        self.assertGreater(records[2]['cache_hits'], records[1]['cache_hits'])
+
+        response = self.client.get('/admin/profile/?o=requests')
+        self.assertEqual([row['view'] for row in response.context['rows']][0], 'get_tasks_for_project')
+
+    def test_duplicate_queries_are_detected(self):
+        profile = profiling.RequestProfile()
+        for user_id in (1, 1, 2):
+            profile.record_query('SELECT 1 FROM auth_user WHERE id = %s', (user_id,), 0.001)
+        duplicates, similar, top = profile.repeated()
+        self.assertEqual((duplicates, similar), (1, 1))
+        self.assertEqual(top, [('SELECT 1 FROM auth_user WHERE id = %s', 3)])
+
+    def test_report_is_staff_only(self):
+        self.client.force_login(User.objects.create_user('member'))
+        self.assertEqual(self.client.get('/admin/profile/').status_code, 302)
+
+
+class SyntheticBenchmarkTests(TestCase):
+    """The synthetic dataset follows the model rules and the benchmark compares runs with a baseline."""
+
+    @classmethod
+    def setUpTestData(cls):
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name):
+            call_command(
+                'generate_dataset', users=40, projects=4, team_size=10, tasks=300, timesheets=200,
+                comments=100, files=20, attachments=2, stdout=io.StringIO(),
+            )
+
+    def test_dataset(self):
+        for role in (PROJECT_MANAGER, PROJECT_LEAD, TESTER, DEVELOPER):
+            self.assertTrue(User.objects.filter(groups__name=role, is_staff=True).exists(), role)
+        self.assertEqual(Task.objects.count(), 300)
+        for task in Task.objects.select_related('project'):
+            self.assertEqual(task_date_errors(task.start_date, task.due_date, task.project), [])
+        self.assertFalse(Task.objects.exclude(project__team=F('assigned_to')).exists())
+        # Derived data is rebuilt after the bulk inserts
+        self.assertEqual(
+            TaskHours.objects.aggregate(total=Sum('hours'))['total'],
+            TimeSheet.objects.aggregate(total=Sum('hours'))['total'],
+        )
+        self.assertEqual(Blob.objects.aggregate(total=Sum('refs'))['total'], 20)
+        self.assertTrue(TASK_INDEX.search(Task.objects.all(), Task.objects.first().title).exists())
+
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', users=10, stdout=io.StringIO())
+
+    def test_benchmark_against_baseline(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'baseline.json')
+        options = {'role': ['superuser', 'developer'], 'repeat': 2, 'warmup': 1, 'stdout': io.StringIO()}
+
+        call_command('benchmark_admin', output=baseline, **options)
+        with open(baseline) as file:
+            results = json.load(file)['results']
+        self.assertEqual(len(results), 16)
+        self.assertEqual({result['status'] for result in results.values()}, {200})
+        self.assertTrue(all(result['queries'] > 0 for result in results.values()))
+
+        # A baseline with one query less for a target is a regression
+        results['developer/task-changelist']['queries'] -= 1
+        with open(baseline, 'w') as file:
+            json.dump({'results': results}, file)
+        with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+            call_command(
+                'benchmark_admin', baseline=baseline, tolerance=100, fail_on_regression=True,
+                output=os.path.join(directory.name, 'run.json'), **options,
+            )
+
+
+class AsyncAPITests(TestCase):
+    """The async task list and team member views (PROJECT_ASYNC_API) answer like the sync ones."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.developer = User.objects.create_user('dev', is_staff=True)
+        cls.developer.groups.add(Group.objects.create(name=DEVELOPER))
+        cls.lead = User.objects.create_user('lead', is_staff=True)
+        cls.lead.groups.add(Group.objects.create(name=PROJECT_LEAD))
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.developer, cls.lead)
+        Task.objects.bulk_create(
+            Task(title=f'Task {i}', project=cls.project, assigned_to=(cls.developer, cls.lead)[i % 2], start_date=date(2024, 1, 1))
+            for i in range(4)
+        )
+
+    def setUp(self):
+        # Rosters and task lists are cached per project ID, which the test databases reuse
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # The URLconf picks the async views when it is loaded
+        with override_settings(PROJECT_ASYNC_API=True):
+            urlconf = type('AsyncURLConf', (), {'urlpatterns': [
+                path('admin/', admin.site.urls),
+                path('api/v1/projects/<int:project_id>/tasks/', views.aget_tasks_for_project, name='get_tasks_for_project'),
+            ]})
+        urls = override_settings(ROOT_URLCONF=urlconf)
+        urls.enable()
+        self.addCleanup(urls.disable)
+
+    async def responses(self, user):
+        await self.async_client.aforce_login(user)
+        tasks = await self.async_client.get(f'/api/v1/projects/{self.project.pk}/tasks/')
+        members = await self.async_client.get(f'/admin/project/task/fetch-team-members/?project_id={self.project.pk}')
+        return tasks, members
+
+    async def test_async_views_per_role(self):
+        for user, titles in (
+            (self.superuser, ['Task 0', 'Task 1', 'Task 2', 'Task 3']),
+            (self.developer, ['Task 0', 'Task 2']),
+            # Leads see the tasks of their projects (through the roster, not cached yet)
+            (self.lead, ['Task 0', 'Task 1', 'Task 2', 'Task 3']),
+        ):
+            await cache.aclear()
+            with self.subTest(user=user.username):
+                tasks, members = await self.responses(user)
+                self.assertEqual(tasks.status_code, 200)
+                self.assertEqual([task['title'] for task in tasks.json()], titles)
+                self.assertEqual(members.status_code, 200)
+                self.assertEqual(
+                    [member['username'] for member in members.json()['team_members']], ['dev', 'lead'],
+                )
+
+    async def test_async_responses_revalidate(self):
+        tasks, members = await self.responses(self.lead)
+        again = await self.async_client.get(
+            f'/api/v1/projects/{self.project.pk}/tasks/', headers={'if-none-match': tasks['ETag']},
+        )
+        self.assertEqual(again.status_code, 304)
+        again = await self.async_client.get(
+            f'/admin/project/task/fetch-team-members/?project_id={self.project.pk}', headers={'if-none-match': members['ETag']},
+        )
+        self.assertEqual(again.status_code, 304)
+
+
+class SQLiteSetupTests(SimpleTestCase):
+    """New connections get the per-connection PRAGMAs but keep the database's journal mode."""
+
+    def connect(self, name):
+        # A connection of its own, so connection_created runs outside the test transaction
+        other = DatabaseWrapper({**connection.settings_dict, 'NAME': name}, alias='sqlite-setup')
+        self.addCleanup(other.close)
+        return other
+
+    def test_connecting_keeps_the_journal_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.join(directory, 'test.sqlite3')
+            other = self.connect(name)
+            with other.cursor() as cursor:
+                self.assertEqual(sqlite.journal_mode(cursor), 'delete')
+                # synchronous=NORMAL is only safe in WAL mode
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 2)
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], sqlite.DEFAULT_PRAGMAS['busy_timeout'])
+                cursor.execute('PRAGMA journal_mode = wal')
+            other.close()
+
+            with self.connect(name).cursor() as cursor:
+                self.assertEqual(sqlite.journal_mode(cursor), 'wal')
+                cursor.execute('PRAGMA synchronous')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class TeamChoicesCacheTests(TestCase):
+    """The cached team choices are only rebuilt when a username or membership changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.developer = User.objects.create_user('dev', password='dev', is_staff=True)
+        cls.developer.groups.add(Group.objects.create(name=DEVELOPER))
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_login_keeps_the_choices(self):
+        self.assertEqual(teams.grouped_team_choices(), [(DEVELOPER, [(self.developer.pk, 'dev')])])
+        self.assertTrue(self.client.login(username='dev', password='dev'))
+        self.assertIsNotNone(cache.get(teams.TEAM_CHOICES_CACHE_KEY))
+
+    def test_username_change_rebuilds_the_choices(self):
+        teams.grouped_team_choices()
+        self.developer.username = 'developer'
+        self.developer.save(update_fields=['username'])
+        self.assertEqual(teams.grouped_team_choices(), [(DEVELOPER, [(self.developer.pk, 'developer')])])
+
+
+class VersionedCacheTests(TestCase):
+    """Version stamps expire, so changes made by processes with a cache of their own show up."""
+
+    @classmethod
+    def setUpTestData(cls):
+        developer = User.objects.create_user('dev')
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.task = Task.objects.create(title='Before', project=cls.project, assigned_to=developer, start_date=date(2024, 1, 1))
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    @override_settings(PROJECT_CACHE_VERSION_TIMEOUT=1)
+    def test_stamps_expire(self):
+        self.assertEqual([row[1] for row in caches.get_project_task_rows(self.project.pk)], ['Before'])
+        # Like a change in another worker: no signal reaches this process's cache
+        Task.objects.filter(pk=self.task.pk).update(title='After')
+        self.assertEqual([row[1] for row in caches.get_project_task_rows(self.project.pk)], ['Before'])
+        time.sleep(1.1)
+        self.assertEqual([row[1] for row in caches.get_project_task_rows(self.project.pk)], ['After'])
+
+    def test_changes_bump_the_stamp_on_commit(self):
+        version = caches.project_tasks_version(self.project.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.task.title = 'After'
+            self.task.save()
+            # A reader before the commit still gets the old rows, which must stay under the old stamp
+            self.assertEqual(caches.project_tasks_version(self.project.pk), version)
+        self.assertNotEqual(caches.project_tasks_version(self.project.pk), version)
+        self.assertEqual([row[1] for row in caches.get_project_task_rows(self.project.pk)], ['After'])
+
+
+class TimesheetHoursTests(TestCase):
+    """Incremental rollups agree with a rebuild, and the hour reports follow the role rules."""
+
+    @classmethod
+    def setUpTestData(cls):
+        developers = Group.objects.create(name=DEVELOPER)
+        cls.lead = User.objects.create_user('lead', is_staff=True)
+        cls.lead.groups.add(Group.objects.create(name=PROJECT_LEAD))
+        cls.developer = User.objects.create_user('dev', is_staff=True)
+        cls.teammate = User.objects.create_user('teammate', is_staff=True)
+        cls.outsider = User.objects.create_user('outsider', is_staff=True)
+        developers.user_set.add(cls.developer, cls.teammate, cls.outsider)
+
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.lead, cls.developer, cls.teammate)
+        cls.other_project = Project.objects.create(name='Other', start_date=date(2024, 1, 1))
+        cls.other_project.team.add(cls.outsider)
+        cls.tasks = [
+            Task.objects.create(title=f'Task {i}', project=cls.project, assigned_to=user, start_date=date(2024, 1, 1))
+            for i, user in enumerate((cls.developer, cls.teammate))
+        ]
+        for user, task, hours in ((cls.developer, cls.tasks[0], 2), (cls.teammate, cls.tasks[1], 3)):
+            TimeSheet.objects.create(project=cls.project, task=task, hours=Decimal(hours), description='Work', created_user=user)
+
+    def rollups(self):
+        return {
+            model.__name__: sorted(tuple(sorted(row.items())) for row in model.objects.values(*[
+                field.attname for field in model._meta.concrete_fields if field.attname != 'id'
+            ]))
+            for model in (TaskHours, ProjectHours, UserDayHours, WeekHours)
+        }
+
+    def test_incremental_rollups_match_rebuild(self):
+        entry = TimeSheet.objects.create(
+            project=self.project, task=self.tasks[0], hours=Decimal('1.5'), description='More', created_user=self.developer,
+        )
+        entry = TimeSheet.objects.get(pk=entry.pk)
+        entry.hours = Decimal('4.25')
+        entry.task = self.tasks[1]
+        entry.date = timezone.now() - timedelta(days=10)
+        entry.save()
+        TimeSheet.objects.filter(created_user=self.teammate).first().delete()
+
+        incremental = self.rollups()
+        rollups.rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(ProjectHours.objects.get(project=self.project).hours, Decimal('6.25'))
+
+    def test_weeks_of_teammates(self):
+        url = reverse('project_hours', args=[self.project.pk])
+        self.client.force_login(self.developer)
+        self.assertEqual(self.client.get(url, {'user': self.teammate.pk}).status_code, 403)
+        self.assertEqual(self.client.get(url, {'user': '²'}).status_code, 400)
+        response = self.client.get(url)
+        self.assertEqual([Decimal(week['hours']) for week in response.json()['weeks']], [2])
+
+        self.client.force_login(self.lead)
+        response = self.client.get(url, {'user': self.teammate.pk})
+        self.assertEqual([Decimal(week['hours']) for week in response.json()['weeks']], [3])
+        response = self.client.get(url)
+        self.assertEqual([Decimal(week['hours']) for week in response.json()['weeks']], [5])
+
+    def test_daily_hours_of_others(self):
+        self.client.force_login(self.developer)
+        self.assertEqual(self.client.get(reverse('user_hours', args=[self.developer.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('user_hours', args=[self.teammate.pk])).status_code, 403)
+
+        self.client.force_login(self.lead)
+        self.assertEqual(self.client.get(reverse('user_hours', args=[self.teammate.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('user_hours', args=[self.outsider.pk])).status_code, 403)
+
+
+class TimeSheetImportTests(TestCase):
+    """Timesheet imports: whose entries may be imported, on which tasks, and with what dates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        developers = Group.objects.create(name=DEVELOPER)
+        cls.lead = User.objects.create_user('lead', is_staff=True)
+        cls.lead.groups.add(Group.objects.create(name=PROJECT_LEAD))
+        cls.developer = User.objects.create_user('dev', is_staff=True)
+        cls.teammate = User.objects.create_user('teammate', is_staff=True)
+        cls.outsider = User.objects.create_user('outsider', is_staff=True)
+        developers.user_set.add(cls.developer, cls.teammate, cls.outsider)
+
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.lead, cls.developer, cls.teammate)
+        cls.own_task = Task.objects.create(title='Own', project=cls.project, assigned_to=cls.developer, start_date=date(2024, 1, 1))
+        cls.other_task = Task.objects.create(title='Other', project=cls.project, assigned_to=cls.teammate, start_date=date(2024, 1, 1))
+
+    def run_import(self, user, rows):
+        text = 'project,task,date,hours,description,user,is_active\n' + '\n'.join(rows) + '\n'
+        return TimeSheetImporter(user).run(read_records(io.StringIO(text), 'csv'))
+
+    def test_entries_of_other_users(self):
+        importer = self.run_import(self.developer, ['Project,Own,2024-03-04,2,Work,teammate,'])
+        self.assertEqual([(error.field, error.message) for error in importer.errors], [('user', 'You can only import your own entries.')])
+
+        importer = self.run_import(self.lead, ['Project,Other,2024-03-04,2,Work,teammate,', 'Project,Other,2024-03-04,2,Work,outsider,'])
+        self.assertEqual([(error.line, error.field) for error in importer.errors], [(3, 'user')])
+        self.assertEqual(list(TimeSheet.objects.values_list('created_user__username', flat=True)), ['teammate'])
+
+    def test_tasks_are_visibility_filtered(self):
+        importer = self.run_import(self.developer, [
+            'Project,Other,2024-03-04,2,Work,,', f'Project,{self.other_task.pk},2024-03-04,2,Work,,', 'Project,²,2024-03-04,2,Work,,',
+        ])
+        self.assertEqual([error.field for error in importer.errors], ['task', 'task', 'task'])
+        self.assertFalse(TimeSheet.objects.exists())
+
+    def test_dates_and_booleans(self):
+        with CaptureQueriesContext(connection) as queries:
+            importer = self.run_import(self.developer, ['Project,Own,2024-03-04,2,Work,,false', 'Project,Own,2024-03-05T10:30,1.5,Work,,TRUE'])
+        self.assertEqual(importer.errors, [])
+        # Inserted once, not inserted and then updated with the dates
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "project_timesheet"') for query in queries), 0)
+        self.assertEqual(
+            list(TimeSheet.objects.order_by('date').values_list('date__date', 'is_active')),
+            [(date(2024, 3, 4), False), (date(2024, 3, 5), True)],
+        )
+        self.assertEqual(UserDayHours.objects.get(user=self.developer, day=date(2024, 3, 5)).hours, Decimal('1.5'))
+        # Only the imported objects keep their dates
+        entry = TimeSheet.objects.create(
+            project=self.project, task=self.own_task, hours=1, description='Now', created_user=self.developer,
+            date=timezone.now() - timedelta(days=30),
+        )
+        self.assertEqual(entry.date.date(), timezone.now().date())
+
+    def test_saves_during_an_import_get_the_current_date(self):
+        # A save in the middle of the import's bulk_create, like one of another thread
+        field = TimeSheet._meta.get_field('date')
+        saved = []
+
+        def pre_save(model_instance, add):
+            if getattr(model_instance, '_keep_dates', False) and not saved:
+                saved.append(TimeSheet.objects.create(
+                    project=self.project, task=self.own_task, hours=1, description='Meanwhile', created_user=self.developer,
+                ))
+            return AutoDateTimeField.pre_save(field, model_instance, add)
+
+        with mock.patch.object(field, 'pre_save', pre_save):
+            importer = self.run_import(self.developer, ['Project,Own,2024-03-04,2,Work,,'])
+        self.assertEqual(importer.errors, [])
+        self.assertEqual(saved[0].date.date(), timezone.now().date())
+        self.assertEqual(TimeSheet.objects.get(description='Work').date.date(), date(2024, 3, 4))
+
+
+@override_settings(PROJECT_PREVIEW_WORKER='queue')
+class BlobReferenceTests(TestCase):
+    """Files with the same content share one blob, removed with its last reference."""
+
+    @classmethod
+    def setUpTestData(cls):
+        developer = User.objects.create_user('dev')
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.task = Task.objects.create(title='Task', project=project, assigned_to=developer, start_date=date(2024, 1, 1))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def attach(self, name, content=b'same content'):
+        return File.objects.create(name=name, file=ContentFile(content, name=f'{name}.txt'), task=self.task)
+
+    def blob_path(self, digest):
+        storage = File._meta.get_field('file').storage
+        return storage.path(storage.blob_name(digest))
+
+    def age(self, digest):
+        # Older than the release, like a blob uploaded a while ago
+        past = time.time() - 60
+        os.utime(self.blob_path(digest), (past, past))
+
+    def test_shared_blob(self):
+        first, second = self.attach('first'), self.attach('second')
+        digest = digest_of(first.file.name)
+        self.assertEqual(digest_of(second.file.name), digest)
+        self.assertEqual(Blob.objects.get(pk=digest).refs, 2)
+        self.age(digest)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(pk=digest).refs, 1)
+        self.assertTrue(os.path.exists(self.blob_path(digest)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.file = ContentFile(b'other content', name='second.txt')
+            second.save()
+        self.assertFalse(Blob.objects.filter(pk=digest).exists())
+        self.assertFalse(os.path.exists(self.blob_path(digest)))
+        self.assertEqual(Blob.objects.get(pk=digest_of(second.file.name)).refs, 1)
+
+    def test_blob_taken_again_before_commit(self):
+        first = self.attach('first')
+        digest = digest_of(first.file.name)
+        self.age(digest)
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        self.assertFalse(Blob.objects.filter(pk=digest).exists())
+        # A concurrent upload of the same content references the blob before the callback runs
+        Blob.objects.create(digest=digest, size=12, refs=1)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(self.blob_path(digest)))
+
+    def test_blob_touched_by_an_upload(self):
+        first = self.attach('first')
+        digest = digest_of(first.file.name)
+        self.age(digest)
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        # An upload of the same content found the blob, its File is not saved yet
+        os.utime(self.blob_path(digest))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(self.blob_path(digest)))
+        self.assertEqual(blobs.collect_garbage(min_age=timedelta(0)), 1)
+
+
+class PreviewJobTests(TestCase):
+    """Lost preview jobs are retried until they run out of attempts, then they fail."""
+
+    def job(self, digest, attempts):
+        job = PreviewJob.objects.create(
+            blob=Blob.objects.create(digest=digest), filename='notes.txt', status=PreviewJob.RUNNING, attempts=attempts,
+        )
+        # updated_at is auto_now
+        PreviewJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - previews.STALE_AFTER - timedelta(minutes=1))
+        return job
+
+    def test_stale_running_jobs(self):
+        retried = self.job('a' * 64, previews.MAX_ATTEMPTS - 1)
+        lost = self.job('b' * 64, previews.MAX_ATTEMPTS)
+        self.assertEqual(list(previews.runnable_jobs().values_list('pk', flat=True)), [retried.pk])
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, PreviewJob.FAILED)
+        self.assertTrue(lost.error)
+        self.assertEqual(PreviewJob.objects.get(pk=retried.pk).status, PreviewJob.RUNNING)
+
+
+@override_settings(PROJECT_PREVIEW_WORKER='queue', PROJECT_UPLOAD_CHUNK_SIZE=4)
+class ChunkedUploadTests(TestCase):
+    """Attachments are uploaded in ordered chunks and downloaded whole or by byte range."""
+    content = b'0123456789'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.task = Task.objects.create(title='Task', project=project, assigned_to=cls.superuser, start_date=date(2024, 1, 1))
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_login(self.superuser)
+
+    def put(self, upload, chunk, start):
+        return self.client.put(
+            reverse('file_upload', args=[upload]), chunk, content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(self.content)}'},
+        )
+
+    def start(self):
+        response = self.client.post(
+            reverse('start_file_upload'), {'task': self.task.pk, 'filename': 'digits.txt', 'size': len(self.content)},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def upload(self):
+        upload = self.start()
+        for start in range(0, len(self.content), 4):
+            self.assertEqual(self.put(upload, self.content[start:start + 4], start).status_code, 200)
+        response = self.client.post(reverse('complete_file_upload', args=[upload]))
+        self.assertEqual(response.status_code, 201)
+        return File.objects.get(pk=response.json()['id'])
+
+    def test_chunks_in_order(self):
+        upload = self.start()
+        self.assertEqual(self.put(upload, b'0123', 0).json()['offset'], 4)
+        # A re-sent chunk answers with the offset to resume from
+        response = self.put(upload, b'0123', 0)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 4))
+        self.assertEqual(self.put(upload, b'45678', 4).status_code, 413)
+        self.assertEqual(self.client.post(reverse('complete_file_upload', args=[upload])).status_code, 409)
+        self.assertEqual(self.client.get(reverse('file_upload', args=[upload])).json()['offset'], 4)
+
+        self.put(upload, b'4567', 4)
+        self.put(upload, b'89', 8)
+        response = self.client.post(reverse('complete_file_upload', args=[upload]))
+        self.assertEqual(response.status_code, 201)
+        with File.objects.get(pk=response.json()['id']).file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_range_downloads(self):
+        url = reverse('download_file', args=[self.upload().pk])
+
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response['Accept-Ranges']), (200, 'bytes'))
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+        response = self.client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 2-5/10'))
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(url, headers={'Range': 'bytes=-3'})
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(url, headers={'Range': 'bytes=10-'})
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+        # A changed file since the client's copy: the whole file
+        response = self.client.get(url, headers={'Range': 'bytes=2-5', 'If-Range': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """Reads go to the replica only inside replica_reads(), and never for a pinned session."""
+
+    def setUp(self):
+        # A replica alias without a second database: the routing decisions are what is tested
+        patcher = mock.patch.object(replicas, 'replica_alias', return_value='replica')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = replicas.ReplicaRouter()
+
+    def routed_view(self, write=False):
+        def view(request):
+            with replicas.replica_reads():
+                before = self.router.db_for_read(Task)
+                if write:
+                    self.router.db_for_write(Task)
+                return HttpResponse(f'{before} {self.router.db_for_read(Task)}')
+        return view
+
+    def request(self, method='get', pinned_until=0):
+        request = getattr(RequestFactory(), method)('/')
+        request.session = CacheSessionStore()
+        if pinned_until:
+            request.session[replicas.PIN_SESSION_KEY] = pinned_until
+        return request
+
+    def test_replica_reads(self):
+        self.assertEqual(self.router.db_for_read(Task), 'default')
+        with replicas.replica_reads():
+            self.assertEqual(self.router.db_for_read(Task), 'replica')
+            with replicas.primary_reads():
+                self.assertEqual(self.router.db_for_read(Task), 'default')
+        self.assertEqual(self.router.db_for_write(Task), 'default')
+
+    def test_session_pinning(self):
+        middleware = replicas.ReplicaPinningMiddleware(self.routed_view())
+        self.assertEqual(middleware(self.request()).content, b'replica replica')
+        self.assertEqual(middleware(self.request(pinned_until=time.time() + 60)).content, b'default default')
+        self.assertEqual(middleware(self.request(pinned_until=time.time() - 1)).content, b'replica replica')
+
+        request = self.request('post')
+        middleware(request)
+        self.assertGreater(request.session[replicas.PIN_SESSION_KEY], time.time())
+
+    def test_reads_after_a_write_use_the_primary(self):
+        middleware = replicas.ReplicaPinningMiddleware(self.routed_view(write=True))
+        self.assertEqual(middleware(self.request()).content, b'replica default')
+        # The pin ends with the request
+        self.assertEqual(replicas.ReplicaPinningMiddleware(self.routed_view())(self.request()).content, b'replica replica')
+
+    async def test_async_session_pinning(self):
+        async def view(request):
+            with replicas.replica_reads():
+                return HttpResponse(self.router.db_for_read(Task))
+
+        middleware = replicas.ReplicaPinningMiddleware(view)
+        self.assertEqual((await middleware(self.request(pinned_until=time.time() + 60))).content, b'default')
+        request = self.request('post')
+        self.assertEqual((await middleware(request)).content, b'replica')
+        self.assertGreater(await request.session.aget(replicas.PIN_SESSION_KEY), time.time())
+
+
+class TeamRosterCacheTests(TestCase):
+    """Project team rosters are cached per project and invalidated when a team change commits."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        developers = Group.objects.create(name=DEVELOPER)
+        cls.alice, cls.bob, cls.carol = (User.objects.create_user(name, is_staff=True) for name in ('alice', 'bob', 'carol'))
+        developers.user_set.add(cls.alice, cls.bob, cls.carol)
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.alice, cls.bob)
+        cls.other = Project.objects.create(name='Other', start_date=date(2024, 1, 1))
+        cls.other.team.add(cls.bob, cls.carol)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def usernames(self, project):
+        return [member['username'] for member in teams.get_team_rosters([project.pk])[project.pk]]
+
+    def change(self, func, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            func(*args)
+
+    def test_team_change_bumps_the_stamp_on_commit(self):
+        self.assertEqual(self.usernames(self.project), ['alice', 'bob'])
+        version = teams.team_roster_versions([self.project.pk])[self.project.pk]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.team.add(self.carol)
+            # Other connections still read the old roster until the commit, it stays under the old stamp
+            self.assertEqual(teams.team_roster_versions([self.project.pk])[self.project.pk], version)
+        self.assertEqual(self.usernames(self.project), ['alice', 'bob', 'carol'])
+
+    def test_cached_rosters_are_read_without_queries(self):
+        with self.assertNumQueries(2):
+            # Every miss of a bulk load is read with one project and one member query
+            rosters = teams.get_team_rosters([self.project.pk, self.other.pk, 0])
+        self.assertEqual(set(rosters), {self.project.pk, self.other.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.usernames(self.other), ['bob', 'carol'])
+        with self.assertNumQueries(1):
+            # Only the unknown project is looked up again, it has no members to read
+            teams.get_team_rosters([self.project.pk, 0])
+
+    def test_team_changes_from_either_side(self):
+        self.assertEqual(self.usernames(self.project), ['alice', 'bob'])
+        self.change(self.project.team.remove, self.bob)
+        self.assertEqual(self.usernames(self.project), ['alice'])
+        self.change(self.carol.project_set.add, self.project)
+        self.assertEqual(self.usernames(self.project), ['alice', 'carol'])
+        self.change(self.project.team.clear)
+        self.assertEqual(self.usernames(self.project), [])
+
+        self.assertEqual(self.usernames(self.other), ['bob', 'carol'])
+        self.change(self.bob.project_set.clear)
+        self.assertEqual(self.usernames(self.other), ['carol'])
+
+    def test_member_changes(self):
+        self.assertEqual((self.usernames(self.project), self.usernames(self.other)), (['alice', 'bob'], ['bob', 'carol']))
+        self.bob.username = 'robert'
+        self.change(self.bob.save)
+        self.assertEqual((self.usernames(self.project), self.usernames(self.other)), (['alice', 'robert'], ['carol', 'robert']))
+
+        # A login does not touch the rosters
+        version = teams.team_roster_versions([self.project.pk])[self.project.pk]
+        self.change(lambda: self.alice.save(update_fields=['last_login']))
+        self.assertEqual(teams.team_roster_versions([self.project.pk])[self.project.pk], version)
+
+        self.alice.is_active = False
+        self.change(lambda: self.alice.save(update_fields=['is_active']))
+        self.assertEqual(self.usernames(self.project), ['robert'])
+        self.change(self.bob.delete)
+        self.assertEqual((self.usernames(self.project), self.usernames(self.other)), ([], ['carol']))
+
+    def test_fetch_team_members_revalidates_with_the_etag(self):
+        self.client.force_login(self.superuser)
+        url = reverse('admin:fetch-team-members')
+        response = self.client.get(url, {'project_id': self.project.pk})
+        self.assertEqual([member['username'] for member in response.json()['team_members']], ['alice', 'bob'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, {'project_id': self.project.pk}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # The bulk mode has an ETag of its own
+        response = self.client.get(url, {'project_ids': f'{self.project.pk},{self.other.pk},0'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['team_members']), {str(self.project.pk), str(self.other.pk)})
+
+        self.change(self.project.team.add, self.carol)
+        response = self.client.get(url, {'project_id': self.project.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['team_members']), 3)
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.assertEqual(self.client.get(url, {'project_id': 0}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'project_id': 'x'}).status_code, 400)
+
+class TaskAutocompleteTests(TestCase):
+    """The task autocomplete applies the choice rules of the form it serves."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.tester, cls.lead, cls.no_permission = (
+            User.objects.create_user(name, is_staff=True) for name in ('tester', 'lead', 'nobody')
+        )
+        Group.objects.create(name=TESTER).user_set.add(cls.tester)
+        Group.objects.create(name=PROJECT_LEAD).user_set.add(cls.lead, cls.no_permission)
+        view_task = Permission.objects.get(codename='view_task')
+        cls.tester.user_permissions.add(view_task)
+        cls.lead.user_permissions.add(view_task)
+
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.tester, cls.lead, cls.no_permission)
+        cls.other = Project.objects.create(name='Other', start_date=date(2024, 1, 1))
+        cls.other.team.add(cls.tester)
+        cls.resolved, cls.new, cls.other_resolved = (
+            Task.objects.create(title=title, status=status, project=project, assigned_to=cls.lead, start_date=date(2024, 1, 1))
+            for title, status, project in (
+                ('Resolved', 'Resolved', cls.project), ('New', 'New', cls.project), ('Other resolved', 'Resolved', cls.other),
+            )
+        )
+
+    def autocomplete(self, user, model_name, status_code=200, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'project', 'model_name': model_name, 'field_name': 'task', 'term': '', **params,
+        })
+        self.assertEqual(response.status_code, status_code)
+        return {int(result['id']) for result in response.json()['results']} if status_code == 200 else None
+
+    def test_testers_only_get_resolved_tasks_on_the_comment_form(self):
+        self.assertEqual(self.autocomplete(self.tester, 'comment'), {self.resolved.pk, self.other_resolved.pk})
+        self.assertEqual(self.autocomplete(self.lead, 'comment'), {self.resolved.pk, self.new.pk})
+        # The rule belongs to the comment form only
+        self.assertEqual(self.autocomplete(self.tester, 'timesheet'), {self.resolved.pk, self.new.pk, self.other_resolved.pk})
+
+    def test_timesheet_tasks_are_filtered_by_project(self):
+        self.assertEqual(self.autocomplete(self.lead, 'timesheet', project=self.project.pk), {self.resolved.pk, self.new.pk})
+        self.assertEqual(self.autocomplete(self.superuser, 'timesheet', project=self.other.pk), {self.other_resolved.pk})
+        self.assertEqual(self.autocomplete(self.lead, 'timesheet', project='²'), set())
+
+    def test_non_members_are_denied(self):
+        # Not on the team of the project
+        self.autocomplete(self.lead, 'timesheet', status_code=403, project=self.other.pk)
+        # No permission to view tasks
+        self.autocomplete(self.no_permission, 'comment', status_code=403)
+
+class ExplainQuerysetsTests(TestCase):
+    """Smoke test of ``explain_admin_querysets`` on the admin query indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        developer = User.objects.create_user('dev', is_staff=True)
+        Group.objects.create(name=DEVELOPER).user_set.add(developer)
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        Task.objects.bulk_create(
+            Task(title=f'Task {i}', project=project, assigned_to=developer, start_date=date(2024, 1, 1)) for i in range(20)
+        )
+
+    def test_plans_use_the_indexes(self):
+        out = io.StringIO()
+        call_command('explain_admin_querysets', '--user', 'admin', '--user', 'dev', '--verbose-plan', '--fail-on-scan', stdout=out)
+        # {"<queryset> as <user>": (status, plan)}
+        plans, label = {}, None
+        for line in out.getvalue().splitlines():
+            if line.startswith('    '):
+                plans[label][1].append(line)
+            else:
+                label, status = line.split(': ')
+                plans[label] = (status, [])
+        self.assertEqual({status for status, _ in plans.values()}, {'OK'})
+
+        def plan(label):
+            return '\n'.join(plans[label][1])
+
+        for user in ('admin', 'dev'):
+            self.assertIn('USING INDEX task_active_project_idx (project_id=?)', plan(f'get_tasks_for_project as {user}'))
+            self.assertIn('USING INDEX timesheet_date_idx', plan(f'TimeSheetAdmin changelist as {user}'))
+        self.assertIn('USING INDEX task_status_rank_idx', plan('TaskAdmin changelist as admin'))
+        self.assertIn('USING INDEX task_assignee_rank_idx (assigned_to_id=?)', plan('TaskAdmin changelist as dev'))
+
+
+class SearchTests(TestCase):
+    """FTS5 search of tasks and comments in the changelists and the search endpoint, with the admin role rules."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        developers = Group.objects.create(name=DEVELOPER)
+        cls.developer, cls.other_developer = (User.objects.create_user(name, is_staff=True) for name in ('dev', 'other'))
+        developers.user_set.add(cls.developer, cls.other_developer)
+        cls.developer.user_permissions.add(*Permission.objects.filter(codename__in=('view_task', 'view_comment')))
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        cls.project.team.add(cls.developer, cls.other_developer)
+        cls.own = Task.objects.create(
+            title='Login crash', description='The login form crashes on submit', project=cls.project,
+            assigned_to=cls.developer, start_date=date(2024, 1, 1),
+        )
+        cls.foreign = Task.objects.create(
+            title='Logout crash', environment='Firefox on Linux', project=cls.project,
+            assigned_to=cls.other_developer, start_date=date(2024, 1, 1),
+        )
+        cls.comment = Comment.objects.create(
+            title='Stack trace', content='Crashes in the session middleware', task=cls.own, created_user=cls.developer,
+        )
+
+    def matches(self, index, text):
+        return set(index.search(index.model.objects.all(), text).values_list('pk', flat=True))
+
+    def endpoint(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_saves_and_deletes_update_the_index(self):
+        self.assertEqual(self.matches(TASK_INDEX, 'firefox'), {self.foreign.pk})
+        self.foreign.environment = 'Chrome'
+        self.foreign.save()
+        self.assertEqual(self.matches(TASK_INDEX, 'firefox'), set())
+        self.assertEqual(self.matches(TASK_INDEX, 'chrom'), {self.foreign.pk})
+
+        self.assertEqual(self.matches(COMMENT_INDEX, 'middleware'), {self.comment.pk})
+        self.comment.delete()
+        self.assertEqual(self.matches(COMMENT_INDEX, 'middleware'), set())
+        self.foreign.delete()
+        self.assertEqual(self.matches(TASK_INDEX, 'chrome'), set())
+
+    def test_rebuild_picks_up_writes_without_signals(self):
+        Task.objects.filter(pk=self.own.pk).update(description='Blank page after sign in')
+        self.assertEqual(self.matches(TASK_INDEX, 'blank'), set())
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', 'task', stdout=out)
+        self.assertIn('task: 2 rows', out.getvalue())
+        self.assertEqual(self.matches(TASK_INDEX, 'blank'), {self.own.pk})
+        self.assertEqual(self.matches(TASK_INDEX, 'submit'), set())
+        with self.assertRaises(CommandError):
+            call_command('rebuild_search_index', 'project', stdout=out)
+
+    def test_endpoint_ranks_and_highlights(self):
+        results = self.endpoint(self.superuser, q='crash')
+        self.assertEqual({task['id'] for task in results['task']}, {self.own.pk, self.foreign.pk})
+        self.assertEqual([comment['id'] for comment in results['comment']], [self.comment.pk])
+        self.assertIn('<mark>Crashes</mark>', results['comment'][0]['snippet'])
+        # Every word must match
+        self.assertEqual([task['id'] for task in self.endpoint(self.superuser, q='login crash', type='task')['task']], [self.own.pk])
+
+        self.client.force_login(self.superuser)
+        self.assertEqual(self.client.get(reverse('search'), {'q': ' '}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'crash', 'type': 'project'}).status_code, 400)
+
+    def test_developers_only_find_their_own_tasks(self):
+        results = self.endpoint(self.developer, q='crash')
+        self.assertEqual([task['id'] for task in results['task']], [self.own.pk])
+        self.assertEqual(self.endpoint(self.developer, q='firefox', type='task'), {'task': []})
+
+        response = self.client.get('/admin/project/task/', {'q': 'crash'})
+        self.assertEqual([task.pk for task in response.context['cl'].result_list], [self.own.pk])
+        self.assertContains(response, '<mark>crash')
+
+        self.assertEqual(self.endpoint(self.other_developer, q='middleware'), {'task': [], 'comment': []})
+
+    def test_changelist_search_is_ranked(self):
+        self.client.force_login(self.superuser)
+        response = self.client.get('/admin/project/task/', {'q': 'login'})
+        self.assertEqual([task.pk for task in response.context['cl'].result_list], [self.own.pk])
+        response = self.client.get('/admin/project/comment/', {'q': 'session'})
+        self.assertEqual([comment.pk for comment in response.context['cl'].result_list], [self.comment.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages of the task changelist over the (status_rank, id) ordering."""
+
+    url = '/admin/project/task/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        # Runs of equal status_rank, so the pages split inside a rank and the id decides
+        statuses = ['Resolved', 'New', 'New', 'Inprogress', 'New', 'Resolved', 'New', 'Inprogress', 'New', 'Resolved']
+        for index, status in enumerate(statuses):
+            Task.objects.create(
+                title=f'Task {index}', status=status, project=project, assigned_to=cls.superuser, start_date=date(2024, 1, 1),
+            )
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+        patcher = mock.patch.object(admin.site.get_model_admin(Task), 'list_per_page', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changelist(self, query=''):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def walk(self, query, link):
+        """Primary keys of every page, following the ``link`` URL from ``query``, and the last changelist."""
+        pages = []
+        while True:
+            cl = self.changelist(query)
+            pages.append([task.pk for task in cl.result_list])
+            query = getattr(cl, link)
+            if query is None:
+                return pages, cl
+
+    def test_next_and_previous_pages(self):
+        expected = list(Task.objects.order_by('status_rank', 'id').values_list('pk', flat=True))
+        pages, last = self.walk('', 'keyset_next_url')
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertIsNotNone(last.keyset_first_url)
+
+        # Back from the last page: full pages ending right before it
+        back, first = self.walk(last.keyset_previous_url, 'keyset_previous_url')
+        self.assertEqual(back, pages[-2::-1])
+        self.assertIsNone(first.keyset_first_url)
+
+    def test_cursor_keeps_the_filters(self):
+        expected = list(Task.objects.filter(status='New').order_by('id').values_list('pk', flat=True))
+        pages, last = self.walk('?status=New', 'keyset_next_url')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertIn('status=New', last.keyset_previous_url)
+        self.assertEqual(last.result_count, len(expected))
+
+    def test_search_uses_the_regular_paginator(self):
+        cl = self.changelist('?q=task')
+        self.assertFalse(cl.keyset)
+        self.assertIsNone(cl.keyset_next_url)
+        self.assertEqual(cl.result_count, 10)
+        self.assertEqual(len(cl.result_list), 3)
+        self.assertEqual(len(self.changelist('?q=task&p=4').result_list), 1)
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        first = [task.pk for task in self.changelist().result_list]
+        for cursor in ('garbage', encode_cursor('after', ['x', 'y']), encode_cursor('sideways', [1, 1]), encode_cursor('after', [1])):
+            cl = self.changelist(f'?cursor={cursor}')
+            self.assertEqual([task.pk for task in cl.result_list], first)
+            self.assertIsNone(cl.keyset_previous_url)
+
+    def test_count_cap(self):
+        with override_settings(PROJECT_CHANGELIST_COUNT_CAP=4):
+            response = self.client.get(self.url)
+            self.assertEqual(response.context['cl'].result_count, 4)
+            self.assertTrue(response.context['cl'].result_count_is_estimate)
+            self.assertContains(response, '4+ tasks')
+            # Below the cap the count is exact
+            cl = self.changelist('?status=Inprogress')
+            self.assertEqual((cl.result_count, cl.result_count_is_estimate), (2, False))
+        cl = self.changelist()
+        self.assertEqual((cl.result_count, cl.result_count_is_estimate), (10, False))
+
+
+class ExportTests(TestCase):
+    """The export actions and ``export_records`` stream the rows of the user's changelist."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        developers = Group.objects.create(name=DEVELOPER)
+        cls.developer, cls.other_developer = (User.objects.create_user(name, is_staff=True) for name in ('dev', 'other'))
+        developers.user_set.add(cls.developer, cls.other_developer)
+        cls.developer.user_permissions.add(*Permission.objects.filter(codename__in=('view_task', 'view_comment')))
+        project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+        project.team.add(cls.developer, cls.other_developer)
+        cls.own_new, cls.own_resolved, cls.foreign = (
+            Task.objects.create(
+                title=title, description='Line one\nline "two", three', status=status, project=project,
+                assigned_to=assignee, start_date=date(2024, 1, 1),
+            )
+            for title, status, assignee in (
+                ('Own new', 'New', cls.developer), ('Own resolved', 'Resolved', cls.developer), ('Foreign', 'New', cls.other_developer),
+            )
+        )
+        cls.own_comment = Comment.objects.create(title='Own', content='Seen', task=cls.own_new, created_user=cls.other_developer)
+        Comment.objects.create(title='Foreign', content='Hidden', task=cls.foreign, created_user=cls.other_developer)
+
+    def run_action(self, user, model, action, query=''):
+        """Export everything the changelist at ``query`` shows ("select all"), returns the streamed text."""
+        self.client.force_login(user)
+        data = {'action': action, 'select_across': 1, '_selected_action': [0], 'index': 0}
+        response = self.client.post(f'/admin/project/{model}/{query}', data)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def csv_ids(self, text):
+        return [int(row['id']) for row in csv.DictReader(io.StringIO(text))]
+
+    def test_exports_only_the_rows_of_the_role(self):
+        self.assertEqual(self.csv_ids(self.run_action(self.developer, 'task', 'export_as_csv')), [self.own_new.pk, self.own_resolved.pk])
+        self.assertEqual(
+            self.csv_ids(self.run_action(self.superuser, 'task', 'export_as_csv')),
+            [self.own_new.pk, self.own_resolved.pk, self.foreign.pk],
+        )
+        lines = self.run_action(self.developer, 'comment', 'export_as_jsonl').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.own_comment.pk])
+        self.assertEqual(json.loads(lines[0])['task'], 'Own new')
+
+    def test_exports_follow_the_changelist_filters(self):
+        text = self.run_action(self.developer, 'task', 'export_as_csv', '?status=New')
+        self.assertEqual(self.csv_ids(text), [self.own_new.pk])
+        # Multi-line text survives the CSV quoting
+        self.assertEqual(next(csv.DictReader(io.StringIO(text)))['description'], 'Line one\nline "two", three')
+
+        text = self.run_action(self.developer, 'task', 'export_as_jsonl', '?q=resolved')
+        self.assertEqual([json.loads(line)['id'] for line in text.splitlines()], [self.own_resolved.pk])
+
+    def test_command_writes_the_rows_of_the_user(self):
+        for fmt, action in (('csv', 'export_as_csv'), ('jsonl', 'export_as_jsonl')):
+            out = io.StringIO()
+            call_command('export_records', 'task', '--user', 'dev', '--format', fmt, '--chunk-size', 1, stdout=out)
+            self.assertEqual(out.getvalue(), self.run_action(self.developer, 'task', action))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'comments.csv')
+            call_command('export_records', 'comment', '--user', 'dev', '--output', output)
+            with open(output, newline='', encoding='utf-8') as exported:
+                self.assertEqual(self.csv_ids(exported.read()), [self.own_comment.pk])
+
+        with self.assertRaises(CommandError):
+            call_command('export_records', 'task', '--user', 'nobody')
+
+
+class StatusRankTests(TestCase):
+    """The stored ``status_rank`` follows ``status`` on every write path."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('dev')
+        cls.project = Project.objects.create(name='Project', start_date=date(2024, 1, 1))
+
+    def create(self, status, **kwargs):
+        return Task.objects.create(
+            title=status, status=status, project=self.project, assigned_to=self.user, start_date=date(2024, 1, 1), **kwargs,
+        )
+
+    def ranks(self):
+        return {task.status: task.status_rank for task in Task.objects.all()}
+
+    def assertRanksMatch(self):
+        for status, rank in Task.objects.values_list('status', 'status_rank'):
+            self.assertEqual(rank, Task.STATUS_RANKS.get(status, Task.UNKNOWN_STATUS_RANK), status)
+
+    def test_save(self):
+        task = self.create('Reopened')
+        self.assertEqual(Task.objects.get(pk=task.pk).status_rank, Task.STATUS_RANKS['Reopened'])
+        task.status = 'closed'
+        task.save(update_fields=['status'])
+        self.assertEqual(Task.objects.get(pk=task.pk).status_rank, Task.STATUS_RANKS['closed'])
+        task.status = 'Unknown'
+        task.save()
+        self.assertEqual(Task.objects.get(pk=task.pk).status_rank, Task.UNKNOWN_STATUS_RANK)
+
+    def test_queryset_update(self):
+        for status in ('New', 'Inprogress', 'Resolved'):
+            self.create(status)
+        Task.objects.filter(status='New').update(status='Resolved')
+        self.assertRanksMatch()
+        # An expression: the rank is computed per row by the database
+        Task.objects.filter(title='Inprogress').update(status=F('title'))
+        Task.objects.filter(title='Resolved').update(status=F('description'))
+        self.assertRanksMatch()
+
+    def test_bulk_create_and_update(self):
+        tasks = Task.objects.bulk_create(
+            Task(title=status, status=status, project=self.project, assigned_to=self.user, start_date=date(2024, 1, 1))
+            for status in ('New', 'Resolved')
+        )
+        self.assertRanksMatch()
+        tasks[0].status, tasks[1].status = 'closed', 'Reopened'
+        Task.objects.bulk_update(tasks, ['status'])
+        self.assertEqual(self.ranks(), {'closed': Task.STATUS_RANKS['closed'], 'Reopened': Task.STATUS_RANKS['Reopened']})
+
+    def test_migration_backfill(self):
+        migration = import_module('project.migrations.0011_task_status_rank')
+        self.assertEqual(migration.STATUS_RANKS, Task.STATUS_RANKS)
+        for status in ('New', 'Inprogress', 'closed', 'Unknown'):
+            self.create(status)
+        # Rows as the schema change left them, before the backfill
+        Task.objects.update(status_rank=Task.UNKNOWN_STATUS_RANK)
+
+        migration.backfill_status_rank(apps, None)
+        self.assertRanksMatch()
+        self.assertEqual(self.ranks()['Unknown'], Task.UNKNOWN_STATUS_RANK)
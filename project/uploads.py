@@ -0,0 +1,142 @@
+"""
+Chunked, resumable uploads of task attachments.
+
+A client opens an upload session with the file name and size, then sends the
+file in chunks of at most ``PROJECT_UPLOAD_CHUNK_SIZE`` bytes, each at the
+offset the server reports. Chunks are streamed from the request into a
+temporary file under ``PROJECT_UPLOAD_TEMP_DIR``, so neither the whole file
+nor a whole chunk is held in memory. After a dropped connection the client
+asks for the session's offset and continues from there. Once every byte is
+received, completing the session moves the temporary file into the File
+storage and creates the ``File`` row.
+"""
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+
+from .models import File, UploadSession
+
+# Bytes copied from the request to the temporary file at a time
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """An invalid upload request, ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def chunk_size_limit():
+    return getattr(settings, 'PROJECT_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def temp_dir():
+    return getattr(settings, 'PROJECT_UPLOAD_TEMP_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'uploads-tmp')
+
+
+def temp_path(session):
+    return os.path.join(temp_dir(), f'{session.pk}.part')
+
+
+class _AssembledFile(DjangoFile):
+    # FileSystemStorage moves a file with a temporary_file_path() instead of copying it
+    def temporary_file_path(self):
+        return self.name
+
+
+def start_upload(user, task, filename, size, name=''):
+    max_size = getattr(settings, 'PROJECT_UPLOAD_MAX_SIZE', None)
+    if size < 0 or (max_size and size > max_size):
+        raise UploadError(f'File size must be between 0 and {max_size} bytes.', status=413)
+
+    filename = os.path.basename(filename.replace('\\', '/')).strip()
+    if not filename:
+        raise UploadError('A file name is required.')
+
+    session = UploadSession.objects.create(
+        user=user,
+        task=task,
+        filename=filename[:200],
+        name=(name or filename)[:50],
+        size=size,
+    )
+    os.makedirs(temp_dir(), exist_ok=True)
+    open(temp_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, offset, stream, length):
+    """
+    Write ``length`` bytes of ``stream`` (the request body) at ``offset`` and
+    return the new offset. The offset must be the session's current offset,
+    so chunks are appended in order; re-sending an already received chunk
+    answers 409 with the current offset.
+    """
+    if offset != session.received:
+        raise UploadError(f'Expected offset {session.received}.', status=409)
+    if length > chunk_size_limit():
+        raise UploadError(f'Chunks are limited to {chunk_size_limit()} bytes.', status=413)
+    if offset + length > session.size:
+        raise UploadError(f'The chunk ends past the file size ({session.size} bytes).', status=416)
+
+    written = 0
+    with open(temp_path(session), 'r+b') as part:
+        part.seek(offset)
+        while written < length:
+            block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+    if written != length:
+        # Connection dropped mid-chunk: keep the offset, the client re-sends the chunk
+        raise UploadError(f'Received {written} of {length} bytes.')
+
+    # Only advance from the offset this chunk was written at (concurrent retries of the same chunk)
+    advanced = UploadSession.objects.filter(pk=session.pk, received=offset).update(
+        received=offset + length, updated_at=timezone.now(),
+    )
+    if not advanced:
+        session.refresh_from_db(fields=['received'])
+        raise UploadError(f'Expected offset {session.received}.', status=409)
+    session.received = offset + length
+    return session.received
+
+
+def complete_upload(session):
+    """Move the assembled file into the File storage and create the File row."""
+    if session.received != session.size:
+        raise UploadError(f'Received {session.received} of {session.size} bytes.', status=409)
+
+    with transaction.atomic():
+        # Locks the session, a concurrent completion finds it gone
+        if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+            raise UploadError('Upload not found.', status=404)
+        attachment = File(name=session.name, task_id=session.task_id, created_user_id=session.user_id)
+        with open(temp_path(session), 'rb') as part:
+            attachment.file.save(session.filename, _AssembledFile(part, name=temp_path(session)), save=False)
+        attachment.save()
+    return attachment
+
+
+def abort_upload(session):
+    path = temp_path(session)
+    session.delete()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_stale_uploads(older_than=timedelta(days=1)):
+    """Delete the sessions (and temporary files) not written to for ``older_than``, returns how many."""
+    stale = list(UploadSession.objects.filter(updated_at__lt=timezone.now() - older_than))
+    for session in stale:
+        abort_upload(session)
+    return len(stale)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.urls import path
+
+from . import views
+
+# Async versions of the lookup APIs when served by an ASGI server
+ASYNC_API = getattr(settings, 'PROJECT_ASYNC_API', False)
+
+urlpatterns = [
+    path(
+        'api/v1/projects/<int:project_id>/tasks/',
+        views.aget_tasks_for_project if ASYNC_API else views.get_tasks_for_project,
+        name='get_tasks_for_project',
+    ),
+    path('api/v1/events/', views.live_events, name='live_events'),
+    path('api/v1/projects/<int:project_id>/hours/', views.project_hours, name='project_hours'),
+    path('api/v1/users/<int:user_id>/hours/', views.user_hours, name='user_hours'),
+    path('api/v1/search/', views.search, name='search'),
+    path('api/v1/uploads/', views.start_file_upload, name='start_file_upload'),
+    path('api/v1/uploads/<uuid:upload_id>/', views.file_upload, name='file_upload'),
+    path('api/v1/uploads/<uuid:upload_id>/complete/', views.complete_file_upload, name='complete_file_upload'),
+    path('api/v1/files/<int:file_id>/download/', views.download_file, name='download_file'),
+    path('api/v1/files/<int:file_id>/thumbnail/', views.file_thumbnail, name='file_thumbnail'),
+]
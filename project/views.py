@@ -1,9 +1,504 @@
-from django.http import JsonResponse
-from .models import Task
-
-def get_tasks_for_project(request):
-    project_id = request.GET.get('project')
-    if project_id:
-        tasks = Task.objects.filter(project_id=project_id).values('id', 'title')
-        return JsonResponse(list(tasks), safe=False)
-    return JsonResponse([])
\ No newline at end of file
+import hashlib
+import json
+from datetime import date, datetime, timezone
+
+from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models import Sum
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET, require_http_methods, require_POST
+
+from .caches import aget_project_task_rows, aproject_tasks_version, get_project_task_rows, project_tasks_version
+from .conditional import acondition
+from .downloads import file_response
+from .live import event_stream, live_events_backend
+from .models import File, Project, Task, TaskHours, UploadSession, UserDayHours, WeekHours
+from .previews import thumbnail_path
+from .profiling import log_path, read_records, sample_rate, summarize
+from .replicas import use_replica
+from .roles import (
+    DEVELOPER, aget_user_roles, get_user_roles, is_project_lead, is_project_manager, sees_all_project_tasks,
+)
+from .search import SEARCH_INDEXES, highlight
+from .storage import digest_of
+from .teams import aget_team_rosters, get_team_rosters
+from .uploads import UploadError, abort_upload, chunk_size_limit, complete_upload, start_upload, write_chunk
+
+# Number of tasks returned when no (or an invalid) limit is given, and the upper bound for `limit`
+TASKS_DEFAULT_LIMIT = 100
+TASKS_MAX_LIMIT = 500
+
+# Same for the results of each type of the search endpoint
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def _limit(request, default, maximum):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        limit = default
+    return min(max(limit, 1), maximum)
+
+
+def _tasks_limit(request):
+    return _limit(request, TASKS_DEFAULT_LIMIT, TASKS_MAX_LIMIT)
+
+
+def _tasks_etag_value(request, user, version, roles):
+    # Everything the response depends on: the task list version, who asks and the parameters
+    key = '|'.join([
+        repr(version),
+        str(user.pk),
+        str(user.is_superuser),
+        ','.join(sorted(roles)),
+        request.GET.get('q', ''),
+        str(_tasks_limit(request)),
+    ])
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def _tasks_etag(request, project_id):
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    return _tasks_etag_value(request, user, project_tasks_version(project_id), get_user_roles(user))
+
+
+def _tasks_last_modified(request, project_id):
+    return datetime.fromtimestamp(project_tasks_version(project_id), tz=timezone.utc)
+
+
+def _visible_task_rows(user, project_id, rows):
+    """Apply the Task.objects.visible_to rules to the cached rows of one project."""
+    if user.is_superuser:
+        return rows
+
+    if DEVELOPER in get_user_roles(user):
+        return [row for row in rows if row[2] == user.pk]
+
+    if any(member['id'] == user.pk for member in get_team_rosters([project_id]).get(project_id, [])):
+        return rows
+    return [row for row in rows if row[3] == user.pk]
+
+
+def _tasks_response(request, rows):
+    prefix = request.GET.get('q', '').strip().lower()
+    if prefix:
+        rows = [row for row in rows if row[1].lower().startswith(prefix)]
+
+    tasks = [{'id': task_id, 'title': title} for task_id, title, _, _ in rows[:_tasks_limit(request)]]
+    response = JsonResponse(tasks, safe=False)
+    # Let the browser keep the list but revalidate it (ETag / Last-Modified) on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@require_GET
+@condition(etag_func=_tasks_etag, last_modified_func=_tasks_last_modified)
+def get_tasks_for_project(request, project_id):
+    """
+    Active tasks of a project visible to the user, as ``[{"id": .., "title": ..}]``.
+
+    Supports ``q`` (title prefix) and ``limit``, and answers conditional GETs
+    with 304 until a task of the project or the project team changes.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    rows = get_project_task_rows(project_id)
+    if rows is None:
+        return JsonResponse({'error': 'Project not found'}, status=404)
+
+    return _tasks_response(request, _visible_task_rows(request.user, project_id, rows))
+
+
+#-----------------------Async (ASGI) versions-------------------------
+
+async def _atasks_etag(request, project_id):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    return _tasks_etag_value(request, user, await aproject_tasks_version(project_id), await aget_user_roles(user))
+
+
+async def _atasks_last_modified(request, project_id):
+    return datetime.fromtimestamp(await aproject_tasks_version(project_id), tz=timezone.utc)
+
+
+async def _avisible_task_rows(user, project_id, rows):
+    if user.is_superuser:
+        return rows
+
+    if DEVELOPER in await aget_user_roles(user):
+        return [row for row in rows if row[2] == user.pk]
+
+    rosters = await aget_team_rosters([project_id])
+    if any(member['id'] == user.pk for member in rosters.get(project_id, [])):
+        return rows
+    return [row for row in rows if row[3] == user.pk]
+
+
+@require_GET
+@acondition(etag_func=_atasks_etag, last_modified_func=_atasks_last_modified)
+async def aget_tasks_for_project(request, project_id):
+    """get_tasks_for_project with the async cache and ORM, same responses; routed when PROJECT_ASYNC_API is on."""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    rows = await aget_project_task_rows(project_id)
+    if rows is None:
+        return JsonResponse({'error': 'Project not found'}, status=404)
+
+    return _tasks_response(request, await _avisible_task_rows(user, project_id, rows))
+
+
+#-----------------------Live change events----------------------------
+
+# Projects one event stream follows at most
+LIVE_EVENTS_MAX_PROJECTS = 500
+
+
+@require_GET
+async def live_events(request):
+    """
+    Server-sent events of task, comment and file changes in the projects the
+    user can see (or the given ``project`` IDs, comma separated), see
+    project.live. Needs an ASGI server and PROJECT_LIVE_EVENTS.
+    """
+    if not live_events_backend():
+        raise Http404('Live events are disabled')
+    if not hasattr(request, 'scope'):
+        # Under WSGI the endless stream would hold a worker and never be sent
+        return JsonResponse({'error': 'Live events need an ASGI server'}, status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    projects = Project.objects.visible_to(user)
+    if request.GET.get('project'):
+        try:
+            projects = projects.filter(pk__in=[int(value) for value in request.GET['project'].split(',')])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid project ID'}, status=400)
+    project_ids = [
+        project_id async for project_id in
+        projects.order_by('pk').values_list('pk', flat=True)[:LIVE_EVENTS_MAX_PROJECTS]
+    ]
+
+    # Developers only see their assigned tasks, so only hear of those
+    developer = not user.is_superuser and DEVELOPER in await aget_user_roles(user)
+    response = StreamingHttpResponse(
+        event_stream(project_ids, assigned_to=user.pk if developer else None), content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+#-----------------------Request profile report------------------------
+
+# Columns the profile report can be ranked by (descending)
+PROFILE_SORTS = {
+    'p50': 'p50', 'p95': 'p95', 'p99': 'p99', 'queries': 'queries per request', 'db_ms': 'DB time',
+    'duplicates': 'duplicate queries', 'requests': 'requests',
+}
+
+
+@staff_member_required
+def profile_report(request):
+    """Views of the sampled requests (project.profiling) ranked by latency percentile or queries per request."""
+    sort = request.GET.get('o') if request.GET.get('o') in PROFILE_SORTS else 'p95'
+    rows = sorted(summarize(read_records()), key=lambda row: row[sort], reverse=True)
+    return TemplateResponse(request, 'admin/project/profile_report.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profile',
+        'rows': rows,
+        'sort': sort,
+        'sorts': PROFILE_SORTS,
+        'sampled': sum(row['requests'] for row in rows),
+        'sample_rate': sample_rate(),
+        'log_path': log_path(),
+    })
+
+
+#-----------------------Timesheet hours-------------------------------
+
+@use_replica
+def project_hours(request, project_id):
+    """
+    Logged hours of a project from the timesheet rollups: the project total,
+    the visible tasks and the ISO weeks (optionally of one ``user``). Users
+    who do not see every task of the project only get their own weeks.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    project = Project.objects.visible_to(request.user).filter(pk=project_id).select_related('hours_rollup').first()
+    if project is None:
+        return JsonResponse({'error': 'Project not found'}, status=404)
+
+    tasks = (
+        TaskHours.objects
+        .filter(task__in=Task.objects.visible_to(request.user).filter(project_id=project_id))
+        .order_by('-hours')
+        .values('task_id', 'task__title', 'hours', 'entries')
+    )
+    try:
+        user_id = int(request.GET['user']) if request.GET.get('user') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid user ID'}, status=400)
+
+    weeks = WeekHours.objects.filter(project_id=project_id)
+    if not sees_all_project_tasks(request):
+        # Same rule as user_hours: a teammate's hours are not theirs to read
+        if user_id not in (None, request.user.pk):
+            return JsonResponse({'error': 'Permission denied'}, status=403)
+        user_id = request.user.pk
+    if user_id is not None:
+        weeks = weeks.filter(user_id=user_id)
+    weeks = (
+        weeks.values('iso_year', 'iso_week')
+        .annotate(total_hours=Sum('hours'), total_entries=Sum('entries'))
+        .order_by('iso_year', 'iso_week')
+    )
+
+    rollup = project.hours_rollup if hasattr(project, 'hours_rollup') else None
+    return JsonResponse({
+        'project': project.pk,
+        'hours': rollup.hours if rollup else 0,
+        'entries': rollup.entries if rollup else 0,
+        'tasks': [
+            {'id': row['task_id'], 'title': row['task__title'], 'hours': row['hours'], 'entries': row['entries']}
+            for row in tasks
+        ],
+        'weeks': [
+            {'year': row['iso_year'], 'week': row['iso_week'], 'hours': row['total_hours'], 'entries': row['total_entries']}
+            for row in weeks
+        ],
+    })
+
+
+def _sees_hours_of(request, user_id):
+    """Users see their own hours, superusers and Project Managers everyone's, Project Leads their teams'."""
+    if request.user.pk == user_id or request.user.is_superuser or is_project_manager(request):
+        return True
+    return is_project_lead(request) and Project.objects.visible_to(request.user).filter(team=user_id).exists()
+
+
+@use_replica
+def user_hours(request, user_id):
+    """Logged hours per day of a user from the timesheet rollups, between ``from`` and ``to`` (ISO dates)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    if not _sees_hours_of(request, user_id):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+
+    days = UserDayHours.objects.filter(user_id=user_id).order_by('day')
+    try:
+        if request.GET.get('from'):
+            days = days.filter(day__gte=date.fromisoformat(request.GET['from']))
+        if request.GET.get('to'):
+            days = days.filter(day__lte=date.fromisoformat(request.GET['to']))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date, expected YYYY-MM-DD'}, status=400)
+
+    return JsonResponse({
+        'user': user_id,
+        'days': [
+            {'day': row['day'], 'hours': row['hours'], 'entries': row['entries']}
+            for row in days.values('day', 'hours', 'entries')
+        ],
+    })
+
+
+#-----------------------Full-text search------------------------------
+
+# Columns of each result type: (key, field path)
+SEARCH_RESULT_FIELDS = {
+    'task': [('id', 'id'), ('title', 'title'), ('project', 'project__name'), ('status', 'status')],
+    'comment': [('id', 'id'), ('title', 'title'), ('task', 'task_id'), ('task_title', 'task__title')],
+}
+
+
+@require_GET
+def search(request):
+    """
+    Full-text search of the tasks and comments the user sees in the admin,
+    best matches first: ``q`` (words, matched as prefixes), ``type`` (task or
+    comment, default both) and ``limit`` per type. Each result has an HTML
+    ``snippet`` with the matched words in ``<mark>``.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    text = request.GET.get('q', '').strip()
+    if not text:
+        return JsonResponse({'error': 'No search query provided'}, status=400)
+
+    types = [request.GET['type']] if request.GET.get('type') else list(SEARCH_INDEXES)
+    if any(name not in SEARCH_INDEXES for name in types):
+        return JsonResponse({'error': f"Unknown type, expected one of: {', '.join(SEARCH_INDEXES)}"}, status=400)
+    if not all(SEARCH_INDEXES[name].available() for name in types):
+        return JsonResponse({'error': 'Full-text search is not available'}, status=501)
+
+    limit = _limit(request, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    results = {}
+    for name in types:
+        index = SEARCH_INDEXES[name]
+        # The admin queryset applies the role visibility rules
+        queryset = admin.site.get_model_admin(index.model).get_queryset(request)
+        fields = SEARCH_RESULT_FIELDS[name]
+        rows = (
+            index.search(queryset, text)
+            .order_by('search_rank', '-pk')
+            .values_list('search_rank', 'search_excerpt', *(path for _, path in fields))[:limit]
+        )
+        results[name] = [
+            {**dict(zip((key for key, _ in fields), values)), 'rank': rank, 'snippet': highlight(excerpt)}
+            for rank, excerpt, *values in rows
+        ]
+
+    return JsonResponse({'query': text, 'results': results})
+
+
+#-----------------------File uploads and downloads--------------------
+
+def _upload_state(session):
+    return {
+        'id': str(session.pk),
+        'task': session.task_id,
+        'filename': session.filename,
+        'size': session.size,
+        'offset': session.received,
+        'chunk_size': chunk_size_limit(),
+    }
+
+
+def _chunk_offset(request):
+    """Offset of an upload chunk: ``Content-Range: bytes start-end/total`` or ``Upload-Offset``."""
+    content_range = request.headers.get('Content-Range', '')
+    if content_range.startswith('bytes ') and '-' in content_range:
+        return int(content_range[6:].split('-', 1)[0])
+    return int(request.headers.get('Upload-Offset', ''))
+
+
+@require_POST
+def start_file_upload(request):
+    """
+    Open a chunked upload of a task attachment. JSON body: ``task`` (ID),
+    ``filename``, ``size`` (bytes) and optionally ``name``.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if not request.user.has_perm('project.add_file'):
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+        task_id, filename, size = int(data['task']), str(data['filename']), int(data['size'])
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'error': 'Expected JSON with task, filename and size'}, status=400)
+
+    task = Task.objects.visible_to(request.user).filter(pk=task_id).first()
+    if task is None:
+        return JsonResponse({'error': 'Task not found'}, status=404)
+
+    try:
+        session = start_upload(request.user, task, filename, size, name=str(data.get('name') or ''))
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(_upload_state(session), status=201)
+
+
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def file_upload(request, upload_id):
+    """
+    A chunked upload: GET its state (``offset`` to resume from), PUT the next
+    chunk as the raw request body with ``Content-Range: bytes start-end/size``
+    (or ``Upload-Offset: start``), DELETE to abort.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+
+    if request.method == 'DELETE':
+        abort_upload(session)
+        return HttpResponse(status=204)
+
+    if request.method == 'PUT':
+        try:
+            offset = _chunk_offset(request)
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Content-Range or Upload-Offset header required'}, status=400)
+        try:
+            write_chunk(session, offset, request, length)
+        except UploadError as e:
+            return JsonResponse({**_upload_state(session), 'error': str(e)}, status=e.status)
+
+    return JsonResponse(_upload_state(session))
+
+
+@require_POST
+def complete_file_upload(request, upload_id):
+    """Turn a fully received upload into a File attachment of its task."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+
+    try:
+        attachment = complete_upload(session)
+    except UploadError as e:
+        return JsonResponse({**_upload_state(session), 'error': str(e)}, status=e.status)
+    return JsonResponse({'id': attachment.pk, 'name': attachment.name, 'task': attachment.task_id, 'size': session.size}, status=201)
+
+
+def _visible_files(request):
+    # The File admin queryset applies the role visibility rules
+    return admin.site.get_model_admin(File).get_queryset(request)
+
+
+@require_GET
+def download_file(request, file_id):
+    """Stream a task attachment the user may see (``?inline=1`` to display it rather than download)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    attachment = get_object_or_404(_visible_files(request), pk=file_id)
+    return file_response(request, attachment.file, as_attachment=not request.GET.get('inline'))
+
+
+@require_GET
+def file_thumbnail(request, file_id):
+    """PNG thumbnail of an image attachment the user may see (404 until it is generated)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    attachment = get_object_or_404(_visible_files(request), pk=file_id)
+    digest = digest_of(attachment.file.name)
+    try:
+        thumbnail = open(thumbnail_path(digest), 'rb') if digest else None
+    except FileNotFoundError:
+        thumbnail = None
+    if thumbnail is None:
+        raise Http404
+    response = FileResponse(thumbnail, content_type='image/png')
+    # The thumbnail of a content-addressed file never changes
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
+@require_GET
+def media(request, path):
+    """MEDIA_URL: attachments at their storage URL, permission checked and streamed like download_file."""
+    if not request.user.is_authenticated:
+        raise Http404
+    attachment = _visible_files(request).filter(file=path).first()
+    if attachment is None:
+        raise Http404
+    return file_response(request, attachment.file, as_attachment=False)
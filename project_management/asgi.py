@@ -11,6 +11,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from project.live import live_events_application
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project_management.settings')
 
-application = get_asgi_application()
+# Runs the live events relay (PROJECT_LIVE_EVENTS) over the server's lifespan
+application = live_events_application(get_asgi_application())
@@ -42,8 +42,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it times the whole request; off unless PROJECT_PROFILE_SAMPLE_RATE is set
+    'project.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'project.replicas.ReplicaPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -79,7 +82,42 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so writers queue on busy_timeout
+            # instead of failing with "database is locked" (see project/sqlite.py). Every atomic()
+            # block takes it, read-only ones included, so keep reads out of transactions.
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Reuse connections (and their PRAGMA setup) across requests for up to 10 minutes
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # A read replica for changelists and reports, see PROJECT_READ_REPLICA. Locally a second
+    # SQLite file kept in sync by `manage.py simulate_replication --lag 3`:
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'db-replica.sqlite3',
+    #     'CONN_MAX_AGE': 600,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+
+DATABASE_ROUTERS = ['project.replicas.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+
+# The task lists, team rosters and team choices are cached and invalidated when they change.
+# The local-memory cache is private to each process: with several workers (gunicorn -w N,
+# uvicorn --workers N) the others only see a change once their entry expires, see
+# PROJECT_CACHE_VERSION_TIMEOUT. Use a shared cache for them, e.g.
+# 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379',
+# and set PROJECT_CACHE_VERSION_TIMEOUT to None.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
 }
 
 
@@ -159,3 +197,94 @@ JAZZMIN_SETTINGS = {
 }
 
 
+
+# Seconds to keep a user's roles (group names) cached across requests, 0 disables it.
+# Entries are invalidated when the user's groups change.
+PROJECT_ROLE_CACHE_TIMEOUT = 0
+
+# Render the project team field as a searchable select loaded on demand instead of
+# listing every user, for organisations with thousands of users.
+PROJECT_TEAM_AUTOCOMPLETE = False
+
+# Seconds the grouped team choices of the project form are cached. They are invalidated on
+# membership and username changes, processes that do not share the cache see them after this long.
+PROJECT_TEAM_CHOICES_CACHE_TIMEOUT = 60
+
+# Seconds a project's cached task list is kept. It is versioned: changes are visible at once to
+# the processes sharing the cache, others see them after PROJECT_CACHE_VERSION_TIMEOUT.
+PROJECT_TASKS_CACHE_TIMEOUT = 3600
+
+# Seconds a project's cached team roster is kept (versioned, invalidated on team and member changes)
+PROJECT_TEAM_ROSTER_CACHE_TIMEOUT = 3600
+
+# Seconds the version stamps of the task lists and team rosters (project/caches.py) are kept.
+# Changes replace the stamp in the cache of the process that made them; other processes with a
+# local-memory cache keep serving their data (and ETags) until their stamp expires. None keeps
+# stamps until they change, only for a single process or a cache shared by all (see CACHES).
+PROJECT_CACHE_VERSION_TIMEOUT = 60
+
+# Task and TimeSheet changelists page with a cursor. Set a number to count at most that
+# many rows and show an estimated "N+" total instead of an exact COUNT(*), None for exact counts.
+PROJECT_CHANGELIST_COUNT_CAP = None
+
+# Chunked attachment uploads (api/v1/uploads/): largest chunk accepted per request, largest file
+# in bytes (None for no limit) and where partial uploads are kept (default MEDIA_ROOT/uploads-tmp).
+PROJECT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+PROJECT_UPLOAD_MAX_SIZE = 4 * 1024 ** 3
+PROJECT_UPLOAD_TEMP_DIR = None
+
+# How attachment downloads are sent: None streams them from Django (with Range support),
+# 'x-accel-redirect' (nginx, internal location at PROJECT_FILE_ACCEL_PREFIX mapped to MEDIA_ROOT)
+# or 'x-sendfile' (Apache/lighttpd) hands the file to the front proxy.
+PROJECT_FILE_SENDFILE = None
+PROJECT_FILE_ACCEL_PREFIX = '/protected-media/'
+
+# Attachment thumbnails and text previews are generated off-request: 'pool' renders them in a
+# local process pool of PROJECT_PREVIEW_POOL_SIZE workers right after the upload, 'queue' leaves
+# the jobs in the database for the process_preview_jobs command (cron or --loop worker).
+PROJECT_PREVIEW_WORKER = 'pool'
+PROJECT_PREVIEW_POOL_SIZE = 2
+
+# PRAGMAs run on every new SQLite connection (project/sqlite.py): commits without fsync (only
+# in WAL mode), milliseconds to wait for the write lock, memory-mapped reads, page cache
+# (negative: KiB) and in-memory temporary tables. None or {} leaves SQLite's defaults. The WAL
+# journal is stored in the database file: switch a served database once with
+# `manage.py sqlite_journal_mode wal`.
+PROJECT_SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -32 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Alias in DATABASES of a read replica serving the admin changelists, exports and hour reports
+# (project/replicas.py), None to read everything from default. After a POST the session reads
+# from default for PROJECT_REPLICA_PIN_SECONDS, keep it above the replication lag.
+PROJECT_READ_REPLICA = None
+PROJECT_REPLICA_PIN_SECONDS = 5
+
+# Serve the task list and team member lookups with their async views (async cache and ORM).
+# Turn it on when running under an ASGI server (uvicorn project_management.asgi:application);
+# under WSGI every async view would run in an event loop of its own. Under ASGI also set
+# CONN_MAX_AGE to 0: requests run their sync code in threads of their own, so persistent
+# connections are not reused but pile up.
+PROJECT_ASYNC_API = False
+
+# Live change events pushed to the task changelist (server-sent events at api/v1/events/, needs an
+# ASGI server, see project/live.py): None disables them, 'memory' delivers them within the process
+# that made the change (a single ASGI process), a 'redis://host:port' URL publishes them through
+# Redis or the live_broker command for several processes. Events arriving within
+# PROJECT_LIVE_COALESCE_SECONDS are sent to a client as one message. Servers wait for open streams
+# when stopping, bound it (e.g. uvicorn --timeout-graceful-shutdown 10).
+PROJECT_LIVE_EVENTS = None
+PROJECT_LIVE_COALESCE_SECONDS = 0.5
+
+# Request profiling (project/profiling.py): share of requests recorded, 0 turns it off. Sampled
+# requests log their time, queries (with repeated ones) and cache hits as JSON lines to
+# PROJECT_PROFILE_LOG (default BASE_DIR/logs/profile.jsonl), rotated at PROJECT_PROFILE_LOG_MAX_BYTES
+# with PROJECT_PROFILE_LOG_BACKUPS old files kept. Staff see the summary at /admin/profile/.
+PROJECT_PROFILE_SAMPLE_RATE = 0
+PROJECT_PROFILE_LOG = None
+PROJECT_PROFILE_LOG_MAX_BYTES = 10 * 1024 * 1024
+PROJECT_PROFILE_LOG_BACKUPS = 5
@@ -15,12 +15,14 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path
-from project.views import get_tasks_for_project
+from project.views import media, profile_report
 urlpatterns = [
+    # Staff page of the sampled request profiles, before the admin catch-all
+    path('admin/profile/', profile_report, name='profile_report'),
     path('admin/', admin.site.urls),
-    path('admin/project/task/', get_tasks_for_project, name='get_tasks_for_project'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('', include('project.urls')),
+    # Attachments are permission checked and streamed (or handed to the front proxy), see project.downloads
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media, name='media'),
+]